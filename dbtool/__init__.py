@@ -5,8 +5,8 @@ import configparser
 
 from flask import Flask
 
-def create_app(config = None):
-    app = Flask(__name__, instance_relative_config=True)
+def create_app(config = None, instance_path = None):
+    app = Flask(__name__, instance_path=instance_path, instance_relative_config=True)
     app.logger.setLevel(logging.DEBUG)
 
 
@@ -16,23 +16,30 @@ def create_app(config = None):
         app.config.from_mapping(config)
 
 
+    from .cevidblib.config import SettingsRegistry
+    app.config["SETTINGS"] = SettingsRegistry()
     app.config["USER"] = {}
     for filename in glob.glob(os.path.join(app.instance_path, "*.ini")):
-        conf = configparser.ConfigParser()
-        conf.read(filename, encoding="utf-8") # !! encoding must be specified
         try:
-            users = conf.get("db", "allowed_users").split(",")
-        except (configparser.NoOptionError, configparser.NoSectionError):
+            users = app.config["SETTINGS"].get(filename).allowed_users
+        except (IOError, configparser.Error, ValueError):
+            users = []
+        if len(users) == 0:
             app.logger.warning("Broken config file: %s (ignoring)", filename)
             continue
         for user in users:
-            if len(user) == 0:
-                continue
             if user in app.config["USER"]:
                 app.logger.warning("User %s present in more then one config file. Ignoring %s", user, filename)
             app.config["USER"][user] = filename
 
 
+    from .cevidblib.groupcache import GroupCache
+    app.config["GROUP_CACHE"] = GroupCache(
+            ttl=app.config.get("GROUP_CACHE_TTL", 60),
+            max_entries=app.config.get("GROUP_CACHE_SIZE", 32),
+            )
+
+
     app.config["TMP_PATH"] = os.path.join(app.instance_path, "tmp")
     try:
         os.makedirs(app.config["TMP_PATH"])
@@ -40,6 +47,49 @@ def create_app(config = None):
         pass
 
 
+    from .metrics import Metrics
+    app.config.setdefault("METRICS_PATH", os.path.join(app.instance_path, "metrics"))
+    metrics = Metrics(app.config["METRICS_PATH"])
+    app.config["METRICS"] = metrics
+
+    from .cevidblib.report import logging_hook
+    report_hook = app.config.get("REPORT_HOOK") or logging_hook(app.logger)
+    def record_report(report):
+        metrics.observe_report(report)
+        report_hook(report)
+    app.config["REPORT_HOOK"] = record_report
+
+
+    from .jobs import JobStore, JobQueue
+    master_pool = None
+    if app.config.get("PROCESS_WORKERS", 0) > 0:
+        from .cevidblib.pool import MasterPool
+        master_pool = MasterPool(
+                max_workers=app.config["PROCESS_WORKERS"],
+                timeout=app.config.get("JOB_TIMEOUT", 300),
+                cache_ttl=app.config.get("GROUP_CACHE_TTL", 60),
+                report_hook=app.config["REPORT_HOOK"],
+                request_hook=metrics.db_request,
+                )
+    app.config["MASTER_POOL"] = master_pool
+    app.config.setdefault("IN_MEMORY", False)
+    app.config["JOB_PATH"] = os.path.join(app.instance_path, "jobs")
+    os.makedirs(app.config["JOB_PATH"], exist_ok=True)
+    app.config.setdefault("JOB_MAX_AGE", 3600)
+    app.config["JOB_STORE"] = JobStore(os.path.join(app.instance_path, "jobs.sqlite"))
+    app.config["JOB_QUEUE"] = JobQueue(
+            app.config["JOB_STORE"],
+            app.config["SETTINGS"],
+            group_cache=app.config["GROUP_CACHE"],
+            max_workers=app.config.get("JOB_WORKERS", 2),
+            logger=app.logger,
+            master_pool=master_pool,
+            report_hook=app.config["REPORT_HOOK"],
+            request_hook=metrics.db_request,
+            )
+    app.config["JOB_QUEUE"].recover()
+
+
     from flask_login import LoginManager
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -50,6 +100,10 @@ def create_app(config = None):
     from . import main
     app.register_blueprint(main.bp)
     app.add_url_rule('/', endpoint='index')
+    if app.config.get("TEST_LOGIN", False):
+        from . import testlogin
+        app.logger.warning("TEST_LOGIN is set, /test-login is available")
+        app.register_blueprint(testlogin.bp)
 
     @login_manager.user_loader
     def load_user(email):  # pylint: disable=unused-variable
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+asyncdb.py -- asyncio class to handel connection to CeviDB
+
+"""
+
+import asyncio
+import os
+import ssl
+import time
+import aiohttp
+from .db import build_url, split_link, observe_request
+
+
+class AsyncCeviDB(object):
+    """ asyncio counterpart of cevidblib.db.CeviDB
+
+    the object provides the same requests as CeviDB as coroutines.
+    All requests share one connection pool with a limited number of
+    connections. The object must be used as async context manager
+    or closed with close().
+
+    """
+
+    def __init__(self,
+                 token,
+                 db_root="https://db.cevi.ch",
+                 cert_file=None,
+                 timeout=(5, 30),
+                 limit=10,
+                 retries=2,
+                 request_hook=None
+                 ):
+        """ initialise basic connection settings
+
+        Parameters
+        ----------
+        token : string
+            authentication token
+        db_root : string
+            base url for database (default: https://db.cevi.ch)
+        cert_file : string
+            certificate file used for SSL verification including path
+            (default: None, use certificates installed on system)
+        timeout : float or tuple
+            timeout in seconds for requests, either one value or a
+            tuple (connect timeout, read timeout) (default: (5, 30))
+        limit : int
+            maximal number of open connections (default: 10)
+        retries : int
+            number of times a failed request for person details
+            is repeated (default: 2)
+        request_hook : callable
+            function called after every request, see
+            cevidblib.db.observe_request() (default: None)
+
+        Raises
+        ------
+        ValueError
+            if retries is negative
+
+        """
+        # ensure one trailing slash for db url
+        self._db_root    = db_root.strip("/")+"/"
+        self._token      = token
+        self._cert_file  = None
+        if cert_file and os.path.isfile(cert_file):
+            self._cert_file = cert_file
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        self._timeout    = timeout
+        self._limit      = max(1, limit)
+        if retries < 0:
+            raise ValueError("retries must not be negative")
+        self._retries    = retries
+        self._request_hook = request_hook
+        # person details already fetched {pers_id: {...}, ...}
+        self._persons    = {}
+        self._session    = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        """ create session on first use (inside the running loop) """
+        if self._session is None:
+            ssl_context = None
+            if self._cert_file is not None:
+                ssl_context = ssl.create_default_context(cafile=self._cert_file)
+            connector = aiohttp.TCPConnector(limit=self._limit,
+                                             limit_per_host=self._limit,
+                                             ssl=ssl_context)
+            timeout = aiohttp.ClientTimeout(sock_connect=self._timeout[0],
+                                            sock_read=self._timeout[1])
+            self._session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=timeout,
+                    headers={"Accept": "application/json"},
+                    )
+        return self._session
+
+    async def close(self):
+        """ close all connections """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_group_members(self, group_id):
+        """ get list with all members of given group
+
+        if the result is paginated, the remaining pages are fetched
+        concurrently and merged in order.
+
+        Parameters
+        ----------
+        group_id : int
+            id of group to retrieve
+
+        """
+        endpoint = "groups/{gid}/people.json".format(gid=group_id)
+        json = await self.get_request(endpoint)
+        people = list(json['people'])
+        total_pages = json.get("total_pages")
+        if total_pages is not None:
+            pages = await asyncio.gather(*[
+                self.get_request(endpoint, "page={nr}".format(nr=nr))
+                for nr in range(2, int(total_pages)+1)
+                ])
+            for page in pages:
+                people.extend(page['people'])
+        else:
+            # no page count known, follow the links one by one
+            while json.get("next_page_link"):
+                json = await self.get_request(*split_link(json["next_page_link"]))
+                people.extend(json['people'])
+        return people
+
+    async def get_groups_members(self, group_ids):
+        """ get members for several groups concurrently
+
+        Parameters
+        ----------
+        group_ids : list
+            ids of groups to retrieve
+
+        Returns
+        -------
+        members : dict
+            dictionary mapping group ids to the list of members
+
+        """
+        members = await asyncio.gather(*[
+            self.get_group_members(gid) for gid in group_ids
+            ])
+        return dict(zip(group_ids, members))
+
+    async def get_person(self, pers_id):
+        """ get details for a given person
+
+        Parameters
+        ----------
+        pers_id : int
+            id of person to retrieve
+
+        Returns
+        -------
+        json : dict
+            dictionary representing result json
+
+        """
+        endpoint = "people/{pid}.json".format(pid=pers_id)
+        return await self.get_request(endpoint)
+
+    async def get_persons(self, pers_ids):
+        """ get details for several persons
+
+        details not fetched before are requested concurrently,
+        failed requests are retried.
+
+        Parameters
+        ----------
+        pers_ids : list
+            ids of persons to retrieve
+
+        Returns
+        -------
+        persons : dict
+            dictionary mapping ids to the person details
+
+        """
+        missing = [pid for pid in set(pers_ids) if pid not in self._persons]
+        details = await asyncio.gather(*[
+            self.retry(self.get_person, pid) for pid in missing
+            ])
+        for pid, json in zip(missing, details):
+            self._persons[pid] = json['people'][0]
+        return dict((pid, self._persons[pid]) for pid in pers_ids)
+
+    async def retry(self, function, *args):
+        """ await function and repeat it on temporary errors
+
+        connection errors, timeouts and http errors with status
+        429 or 5xx are retried with an increasing delay
+
+        Parameters
+        ----------
+        function : coroutine function
+            function sending a request
+        args :
+            arguments passed to function
+
+        """
+        for attempt in range(self._retries+1):
+            try:
+                return await function(*args)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            except aiohttp.ClientResponseError as e:
+                if e.status != 429 and e.status < 500:
+                    raise
+                error = e
+            if attempt < self._retries:
+                await asyncio.sleep(0.5*2**attempt)
+        raise error
+
+    async def get_group(self, group_id):
+        """ get info on a given group
+
+        this function does not return the members of a group
+
+        Parameters
+        ----------
+        group_id : int
+            id of group to retrieve
+
+        Returns
+        -------
+        json : dict
+            dictionary representing result json
+
+        """
+        endpoint = "groups/{gid}.json".format(gid=group_id)
+        return await self.get_request(endpoint)
+
+    async def get_request(self, endpoint, query_string=None, redirect=1):
+        """ general get request
+
+        see cevidblib.db.CeviDB.get_request(), but the
+        decoded json is returned instead of the result object
+
+        Parameters
+        ----------
+        endpoint : string
+            part of request url between domain (db_root) and query string
+            or url including domain but without query string
+        query_string : string
+            query_string without preceding '?' or '&'
+        redirect : int
+            counter to limit number of redirects
+
+        Returns
+        -------
+        json : dict
+            dictionary representing result json
+
+        Raises
+        ------
+        aiohttp.ClientResponseError
+            if a http error occured
+        RuntimeError
+            if the get request gets redirected too often
+
+        """
+        url = build_url(self._db_root, self._token, endpoint, query_string)
+        start = time.perf_counter()
+        try:
+            res = await self._get_session().get(url)
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            observe_request(self._request_hook, url, 0,
+                            time.perf_counter()-start)
+            raise
+        observe_request(self._request_hook, url, res.status,
+                        time.perf_counter()-start)
+        async with res:
+            # internal redirects do not pass the query string on
+            # (see CeviDB.get_request())
+            if len(res.history) > 0:
+                if redirect > 0:
+                    target, query = split_link(str(res.url))
+                    return await self.get_request(target, query,
+                                                  redirect=redirect-1)
+                raise RuntimeError("Too many redirects")
+            res.raise_for_status()
+            return await res.json(content_type=None)
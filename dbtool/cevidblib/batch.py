@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+batch.py -- update many files in parallel
+
+usage (in the dbtool directory):
+    python -m cevidblib.batch [--workers 4] [--db-jobs 2] [--no-backup]
+                              MANIFEST_OR_DIRECTORY
+
+A manifest lists one pair "config.ini workbook.xlsx" per line
+(relative paths are relative to the manifest, # starts a comment).
+For a directory, every workbook with a config of the same name
+(list.xlsx and list.ini) is updated.
+
+The members of every distinct group (and token) are fetched only once,
+at most db-jobs groups at the same time. The files are then updated in
+worker processes using these members, without further requests. The
+files of a group are split into one chunk per worker, so the members
+are sent to every worker only once.
+
+"""
+
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import as_completed
+from .config import Settings
+from .master import Master
+from .groupcache import GroupCache
+
+
+class BatchResult(object):
+    """ outcome of updating a single file
+
+    Attributes
+    ----------
+    config, filename : string
+        files of the pair
+    group : int
+        id of the group, None if the config could not be read
+    fetch_seconds : float
+        duration of the shared fetch of the group
+    new, changed : int
+        number of persons added and changed
+    phases : dict
+        seconds spent in each phase of the update
+    seconds : float
+        duration of the update in the worker process
+    error : string
+        description of the error, None if the update succeeded
+
+    """
+
+    def __init__(self, config, filename, group=None):
+        self.config = config
+        self.filename = filename
+        self.group = group
+        self.fetch_seconds = None
+        self.new = None
+        self.changed = None
+        self.phases = {}
+        self.seconds = None
+        self.error = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def read_manifest(filename):
+    """ list of (config, workbook) pairs in a manifest file """
+    base = os.path.dirname(os.path.abspath(filename))
+    pairs = []
+    with open(filename, encoding="utf-8") as manifest:
+        for nr, line in enumerate(manifest, 1):
+            line = line.split("#", 1)[0].strip()
+            if line == "":
+                continue
+            parts = line.replace(",", " ").split()
+            if len(parts) != 2:
+                raise ValueError("{0}:{1}: expected 'config.ini workbook.xlsx'"
+                                 .format(filename, nr))
+            pairs.append(tuple(os.path.join(base, part) for part in parts))
+    return pairs
+
+def find_pairs(directory):
+    """ list of (config, workbook) pairs with the same name in directory """
+    pairs = []
+    for name in sorted(os.listdir(directory)):
+        base, ext = os.path.splitext(name)
+        config = os.path.join(directory, base+".ini")
+        if ext == ".xlsx" and os.path.isfile(config):
+            pairs.append((config, os.path.join(directory, name)))
+    return pairs
+
+def ignore_report(report):
+    """ report hook dropping the report """
+    pass
+
+def fetch_group(settings_list, cert=None):
+    """ members of a group with the details needed by all configs
+
+    Parameters
+    ----------
+    settings_list : list of cevidblib.config.Settings objects
+        configurations of the files using the group
+
+    Returns
+    -------
+    members : list of dicts
+        list with data from DB query
+
+    """
+    masters = [Master(settings, report_hook=ignore_report)
+               for settings in settings_list]
+    db = masters[0].connect(cert)
+    members = db.get_group_members(settings_list[0].group_id)
+    # fetch details missing for any of the configs at once
+    pers_ids = collections.OrderedDict()
+    for master in masters:
+        for pers_id in master.detail_ids(members):
+            pers_ids[pers_id] = True
+    if len(pers_ids) == 0:
+        return members
+    details = db.get_persons(list(pers_ids))
+    for master in masters:
+        members = master.merge_details(members, details)
+    return members
+
+def update_file(settings, filename, members, cert=None, backup=True):
+    """ update a file with the fetched members, in a worker process
+
+    Returns
+    -------
+    result : tuple
+        (persons added, persons changed, seconds per phase, seconds)
+
+    """
+    start = time.perf_counter()
+    cache = GroupCache(ttl=float("inf"))
+    master = Master(settings, group_cache=cache, report_hook=ignore_report)
+    cache.put(master.cache_key, members)
+    try:
+        changes = master.run(filename, cert=cert, backup=backup)
+    except Exception as e:
+        # not all exceptions (e.g. of requests) can be pickled
+        raise RuntimeError(*e.args)
+    return (len(changes.new), len(changes.changed), master.report.phases,
+            time.perf_counter()-start)
+
+def update_files(jobs, members, cert=None, backup=True):
+    """ update several files of a group with the fetched members
+
+    runs in a worker process, the members are passed only once for
+    all files
+
+    Parameters
+    ----------
+    jobs : list of tuples
+        (settings, filename) pairs of the files to update
+
+    Returns
+    -------
+    outcomes : list of tuples
+        (result of update_file(), None) for every updated file,
+        (None, error message) for every failed file
+
+    """
+    outcomes = []
+    for settings, filename in jobs:
+        try:
+            outcomes.append((update_file(settings, filename, members, cert,
+                                         backup), None))
+        except Exception as e:
+            outcomes.append((None, str(e)))
+    return outcomes
+
+
+def run_batch(pairs, workers=None, db_jobs=2, cert=None, backup=True):
+    """ update all files
+
+    Parameters
+    ----------
+    pairs : list of tuples
+        (config, workbook) pairs to update
+    workers : int
+        number of worker processes, None for one per core
+        (default: None)
+    db_jobs : int
+        number of groups fetched at the same time (default: 2)
+    cert : string
+        certificate file used for SSL verification including path
+        (default: None)
+    backup : bool
+        if True, the previous versions are kept with a YYYY-MM-DD_
+        prefix (default: True)
+
+    Returns
+    -------
+    results : list of BatchResult objects
+        in the order of pairs
+
+    """
+    results = []
+    groups = collections.OrderedDict()
+    for config, filename in pairs:
+        result = BatchResult(config, filename)
+        results.append(result)
+        try:
+            settings = Settings(config)
+        except Exception as e:
+            result.error = "config: {0}".format(e)
+            continue
+        result.group = settings.group_id
+        # group_key contains the token, files fetched with different
+        # tokens do not share members
+        key = Master(settings, report_hook=ignore_report).group_key
+        groups.setdefault(key, []).append((settings, result))
+
+    def fetch(jobs):
+        start = time.perf_counter()
+        members = fetch_group([settings for settings, result in jobs], cert)
+        return members, time.perf_counter()-start
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    context = None
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    with ThreadPoolExecutor(max_workers=max(1, db_jobs)) as fetchers, \
+            ProcessPoolExecutor(max_workers=workers,
+                                mp_context=context) as pool:
+        fetches = dict((fetchers.submit(fetch, jobs), jobs)
+                       for jobs in groups.values())
+        updates = {}
+        # start the updates of a group as soon as it is fetched
+        for future in as_completed(fetches):
+            jobs = fetches[future]
+            try:
+                members, seconds = future.result()
+            except Exception as e:
+                for settings, result in jobs:
+                    result.error = "fetch: {0}".format(e)
+                continue
+            for settings, result in jobs:
+                result.fetch_seconds = seconds
+            # one chunk per worker, each gets the members once
+            chunks = min(len(jobs), workers)
+            for nr in range(chunks):
+                chunk = jobs[nr::chunks]
+                future = pool.submit(update_files,
+                                     [(settings, result.filename)
+                                      for settings, result in chunk],
+                                     members, cert, backup)
+                updates[future] = [result for settings, result in chunk]
+        for future in as_completed(updates):
+            chunk = updates[future]
+            try:
+                outcomes = future.result()
+            except Exception as e:
+                outcomes = [(None, str(e))]*len(chunk)
+            for result, (values, error) in zip(chunk, outcomes):
+                if error is not None:
+                    result.error = "update: {0}".format(error)
+                    continue
+                result.new, result.changed, result.phases, result.seconds = \
+                        values
+    return results
+
+
+def format_table(results):
+    """ summary of the results as text table """
+    def seconds(value):
+        return "-" if value is None else "{0:.2f}".format(value)
+
+    def number(value):
+        return "-" if value is None else str(value)
+
+    def name(filename):
+        relative = os.path.relpath(filename)
+        return filename if relative.startswith("..") else relative
+
+    rows = [("file", "group", "new", "changed", "fetch", "read", "update",
+             "write", "total", "status")]
+    for result in results:
+        rows.append((
+            name(result.filename),
+            number(result.group),
+            number(result.new),
+            number(result.changed),
+            seconds(result.fetch_seconds),
+            seconds(result.phases.get("read")),
+            seconds(result.phases.get("update")),
+            seconds(result.phases.get("write")),
+            seconds(result.seconds),
+            "ok" if result.ok else result.error,
+        ))
+    widths = [max(len(row[col]) for row in rows)
+              for col in range(len(rows[0])-1)]
+    lines = []
+    for row in rows:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:-1],
+                                                          widths[1:])]
+        lines.append("  ".join(cells+[row[-1]]))
+    failed = len([result for result in results if not result.ok])
+    lines.append("{0} files, {1} failed".format(len(results), failed))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="update many files in parallel")
+    parser.add_argument("source", help="manifest file or directory")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--db-jobs", type=int, default=2,
+                        help="groups fetched at the same time (default: 2)")
+    parser.add_argument("--cert", default=None,
+                        help="certificate file for SSL verification")
+    parser.add_argument("--no-backup", dest="backup", action="store_false",
+                        help="do not keep the previous versions")
+    args = parser.parse_args(argv)
+
+    if os.path.isdir(args.source):
+        pairs = find_pairs(args.source)
+    else:
+        pairs = read_manifest(args.source)
+    start = time.perf_counter()
+    results = run_batch(pairs, workers=args.workers, db_jobs=args.db_jobs,
+                        cert=args.cert, backup=args.backup)
+    print(format_table(results))
+    print("finished in {0:.1f} s".format(time.perf_counter()-start))
+    return int(not all(result.ok for result in results))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,8 +11,14 @@ config.py - classes to manage configuration
 
 """
 import configparser
+import os
+import re
+import threading
 import openpyxl
 
+# types of sort keys, see Settings.parse_sort_keys()
+SORT_KINDS = ("text", "nocase", "number")
+
 class ColConfig(object):
     """ object to represent column configuration
 
@@ -64,6 +70,8 @@ class Settings(object):
         ------
         RuntimeError
             if config file could not be read
+        ValueError
+            if a value is invalid (e.g. negative retries)
 
         """
         # open and read file
@@ -78,9 +86,32 @@ class Settings(object):
         self.db_url       = self._parser.get("db", "url")
         self.api_token       = self._parser.get("db", "api_token")
         self.group_id     = self._parser.getint("db", "groupid")
+        self.allowed_users = [user for user in self._parser.get(
+                                "db", "allowed_users", fallback="").split(",")
+                              if len(user) > 0]
+        self.timeout = (
+                self._parser.getfloat("db", "connecttimeout", fallback=5),
+                self._parser.getfloat("db", "readtimeout", fallback=30),
+                )
+        self.pool_size    = self._parser.getint("db", "poolsize", fallback=10)
+        self.max_workers  = self._parser.getint("db", "maxworkers", fallback=4)
+        self.retries      = self._parser.getint("db", "retries", fallback=2)
+        if self.retries < 0:
+            raise ValueError("retries must not be negative")
+        self.async_client = self._parser.getboolean("db", "asyncclient",
+                                                    fallback=False)
+        self.cache_dir    = self._parser.get("db", "cachedir", fallback="")
+        self.cache_size   = self._parser.getint("db", "cachesize",
+                                                fallback=50)*1024*1024
         self.header_lines = self._parser.getint("file", "headerlines")
         self.footer_lines = self._parser.getint("file", "footerlines")
         self.freeze_column = self._parser.get("file", "freezecolumn")
+        self.stream_read = self._parser.getboolean("file", "streamread",
+                                                   fallback=True)
+        self.stream_write = self._parser.getboolean("file", "streamwrite",
+                                                    fallback=True)
+        self.patch_write  = self._parser.getboolean("file", "patchwrite",
+                                                    fallback=True)
 
         # parse row config
         #   create dictionary with column objects
@@ -107,6 +138,17 @@ class Settings(object):
             if item.group == "person":
                 self.pers_cols.append((key, item.value))
 
+        #   create list with pairs (key, kind) to sort persons by
+        self.sort_keys = self.parse_sort_keys(
+                self._parser.get("file", "sortby",
+                                 fallback="last_name, id:number"))
+
+    def __getstate__(self):
+        """ state for pickling, the parser is only needed on init """
+        state = self.__dict__.copy()
+        state["_parser"] = None
+        return state
+
     def get_column_key(self, value):
         """ find key for column with given pre-defined value
 
@@ -126,3 +168,95 @@ class Settings(object):
                 return key
         raise ValueError(value+" not found in configuration")
 
+    def parse_sort_keys(self, value):
+        """ parse the columns to sort the persons by
+
+        Parameters
+        ----------
+        value : string
+            comma separated list of entries "<column>[:<kind>]".
+            column is a pre-defined value (e.g. last_name) or a
+            column letter (upper case), kind is one of
+            text (default), nocase or number
+
+        Returns
+        -------
+        keys : list of tuples
+            list of (key, kind) pairs
+
+        Raises
+        ------
+        ValueError
+            if a column or kind is unknown
+
+        """
+        keys = []
+        for entry in value.split(","):
+            name, _, kind = entry.partition(":")
+            name = name.strip()
+            kind = kind.strip() or "text"
+            if len(name) == 0:
+                continue
+            if kind not in SORT_KINDS:
+                raise ValueError("unknown sort type "+kind)
+            if re.fullmatch("[A-Z]{1,3}", name):
+                key = openpyxl.utils.column_index_from_string(name)
+                if key not in self.columns:
+                    raise ValueError(name+" not found in configuration")
+            else:
+                key = self.get_column_key(name)
+            keys.append((key, kind))
+        return keys
+
+
+
+class SettingsRegistry(object):
+    """ registry keeping parsed config files
+
+    each config file is parsed once and only parsed again when its
+    modification time changes. One object can be shared by all
+    threads of a process.
+
+    """
+
+    def __init__(self):
+        """ initialise empty registry """
+        # {filename: (mtime, size, <<Settings Object>>), ...}
+        self._settings = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        """ get settings for config file
+
+        Parameters
+        ----------
+        filename : string
+            path and name of the config file to read
+
+        Raises
+        ------
+        IOError
+            if config file could not be read
+
+        """
+        stat = os.stat(filename)
+        with self._lock:
+            entry = self._settings.get(filename)
+            if entry is not None and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                return entry[2]
+        settings = Settings(filename)
+        with self._lock:
+            self._settings[filename] = (stat.st_mtime_ns, stat.st_size, settings)
+        return settings
+
+    def discard(self, filename):
+        """ forget settings for config file
+
+        Parameters
+        ----------
+        filename : string
+            path and name of the config file
+
+        """
+        with self._lock:
+            self._settings.pop(filename, None)
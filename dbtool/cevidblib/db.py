@@ -12,13 +12,173 @@ db.py -- class to handel connection to CeviDB
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import Timeout, HTTPError
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from http.cookiejar import DefaultCookiePolicy
+import io
+import logging
 import os
+import re
+import threading
+import time
 
 class RequestsError(Exception):
     """ Calls to handel exceptions raised inside requests """
     pass
 
 
+# sessions shared by all CeviDB objects of a process
+#   {(pid, pool_size): <<requests.Session>>, ...}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def create_session(pool_size=10):
+    """ create a new session with a pool of keep-alive connections
+
+    Parameters
+    ----------
+    pool_size : int
+        maximal number of connections kept open per host (default: 10)
+
+    Returns
+    -------
+    session : requests.Session object
+        session accepting compressed json responses, cookies are
+        not stored as the session is shared by all tokens
+
+    """
+    session = requests.Session()
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Accept": "application/json",
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+        })
+    return session
+
+def build_url(db_root, token, endpoint, query_string=None):
+    """ create url for a request including the authentication token
+
+    Parameters
+    ----------
+    db_root : string
+        base url for database with one trailing slash
+    token : string
+        authentication token
+    endpoint : string
+        part of request url between domain (db_root) and query string
+        or url including domain but without query string
+    query_string : string
+        query_string without preceding '?' or '&'
+
+    """
+    if endpoint[:len(db_root)] == db_root:
+        url = endpoint
+    else:
+        url = db_root+endpoint
+    url += "?token={token}".format(
+                token=token
+                )
+    if query_string is not None:
+        url += "&"+query_string
+    return url
+
+def split_link(link):
+    """ split link returned by the DB into url and query string
+
+    authentication parameters the link might contain are dropped
+
+    Parameters
+    ----------
+    link : string
+        full url including query string
+
+    Returns
+    -------
+    url : string
+        url without query string
+    query_string : string or None
+        remaining query string, None if empty
+
+    """
+    parts = urlsplit(link)
+    query = [(key, val) for key, val in parse_qsl(parts.query)
+             if key != "token"]
+    url = urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+    query_string = urlencode(query) if len(query) > 0 else None
+    return url, query_string
+
+def cached_response(res, entry):
+    """ response with the content of a cache entry
+
+    Parameters
+    ----------
+    res : requests.Response object
+        "304 Not Modified" response of the DB
+    entry : cevidblib.httpcache.CacheEntry object
+        stored response the DB refers to
+
+    Returns
+    -------
+    cached : requests.Response object
+        "200 OK" response with the stored body
+
+    """
+    cached = requests.Response()
+    cached.status_code = 200
+    cached.reason = "OK"
+    cached.url = res.url
+    cached.headers.update(res.headers)
+    cached.raw = io.BytesIO(entry.body)
+    return cached
+
+def shared_session(pool_size=10):
+    """ get the session shared inside the current process
+
+    the session is created on first use. Forked processes
+    (e.g. WSGI workers) get their own session.
+
+    Parameters
+    ----------
+    pool_size : int
+        maximal number of connections kept open per host (default: 10)
+
+    """
+    key = (os.getpid(), pool_size)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = create_session(pool_size)
+        return _sessions[key]
+
+def observe_request(hook, url, status, seconds):
+    """ pass a finished request to a request hook
+
+    the hook is called as hook(endpoint, status, seconds) with the
+    path of the url (ids replaced by {id}), the http status (0 if
+    no response was received) and the duration of the request.
+    Errors of the hook are logged, they never fail the request.
+
+    Parameters
+    ----------
+    hook : callable or None
+        request hook of a CeviDB object, None to do nothing
+
+    """
+    if hook is None:
+        return
+    endpoint = re.sub(r"/\d+(?=/|\.|$)", "/{id}", urlsplit(url).path)
+    try:
+        hook(endpoint, status, seconds)
+    except Exception:
+        logging.getLogger("cevidblib").exception("request hook failed")
+
+
 class TokenAction(object):
     """ struct to store action configuration """
 
@@ -45,7 +205,14 @@ class CeviDB(object):
     def __init__(self,
                  token,
                  db_root="https://db.cevi.ch",
-                 cert_file=None
+                 cert_file=None,
+                 session=None,
+                 timeout=(5, 30),
+                 pool_size=10,
+                 max_workers=4,
+                 retries=2,
+                 cache=None,
+                 request_hook=None
                  ):
         """ initialise basic connection settings
 
@@ -58,6 +225,31 @@ class CeviDB(object):
         cert_file : string
             certificate file used for SSL verification including path
             see set_cert_file() for details
+        session : requests.Session object
+            session used for all requests. If None, the session shared
+            inside the process is used (see shared_session())
+            (default: None)
+        timeout : float or tuple
+            timeout in seconds for requests, either one value or a
+            tuple (connect timeout, read timeout) (default: (5, 30))
+        pool_size : int
+            size of connection pool for the shared session (default: 10)
+        max_workers : int
+            maximal number of requests sent concurrently (default: 4)
+        retries : int
+            number of times a failed request for person details
+            is repeated (default: 2)
+        cache : cevidblib.httpcache.HttpCache object
+            cache used to revalidate responses, None to disable caching
+            (default: None)
+        request_hook : callable
+            function called after every request, e.g. to collect
+            metrics, see observe_request() (default: None)
+
+        Raises
+        ------
+        ValueError
+            if retries is negative
 
         """
         # ensure one trailing slash for db url
@@ -65,6 +257,19 @@ class CeviDB(object):
         self._token      = token
         self._id         = None
         self._cert_file  = None
+        self._timeout    = timeout
+        self._max_workers = max(1, max_workers)
+        if retries < 0:
+            raise ValueError("retries must not be negative")
+        self._retries    = retries
+        self._cache      = cache
+        self._request_hook = request_hook
+        # person details already fetched {pers_id: {...}, ...}
+        self._persons    = {}
+        self._persons_lock = threading.Lock()
+        if session is None:
+            session = shared_session(pool_size)
+        self._session    = session
         self.set_cert_file(cert_file)
 
     def set_cert_file(self, filename=None):
@@ -92,6 +297,9 @@ class CeviDB(object):
     def get_group_members(self, group_id):
         """ get list with all members of given group
 
+        if the result is paginated, the remaining pages are fetched
+        concurrently (see max_workers) and merged in order.
+
         Parameters
         ----------
         group_id : int
@@ -100,7 +308,57 @@ class CeviDB(object):
         """
         endpoint = "groups/{gid}/people.json".format(gid=group_id)
         json = self.get_request(endpoint).json()
-        return json['people']
+        people = list(json['people'])
+        total_pages = json.get("total_pages")
+        if total_pages is not None:
+            pages = ["page={nr}".format(nr=nr)
+                     for nr in range(2, int(total_pages)+1)]
+            for page in self.map(
+                    lambda query: self.get_request(endpoint, query).json(),
+                    pages):
+                people.extend(page['people'])
+        else:
+            # no page count known, follow the links one by one
+            while json.get("next_page_link"):
+                json = self.get_link(json["next_page_link"]).json()
+                people.extend(json['people'])
+        return people
+
+    def map(self, function, items):
+        """ apply function to all items using a bounded thread pool
+
+        Parameters
+        ----------
+        function : callable
+            function taking a single item, usually sending a request
+        items : list
+            arguments to call function with
+
+        Returns
+        -------
+        results : list
+            results of function in the order of items
+
+        """
+        if len(items) == 0:
+            return []
+        workers = min(self._max_workers, len(items))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(function, items))
+
+    def get_link(self, link):
+        """ get request for a link returned by the DB
+
+        the query string of the link is passed on without
+        any authentication parameters it might contain
+
+        Parameters
+        ----------
+        link : string
+            full url including query string
+
+        """
+        return self.get_request(*split_link(link))
 
     def get_person(self, pers_id):
         """ get details for a given person
@@ -119,6 +377,61 @@ class CeviDB(object):
         endpoint = "people/{pid}.json".format(pid=pers_id)
         return self.get_request(endpoint).json()
 
+    def get_persons(self, pers_ids):
+        """ get details for several persons
+
+        details not fetched before are requested concurrently
+        (see max_workers), failed requests are retried.
+
+        Parameters
+        ----------
+        pers_ids : list
+            ids of persons to retrieve
+
+        Returns
+        -------
+        persons : dict
+            dictionary mapping ids to the person details
+
+        """
+        with self._persons_lock:
+            missing = [pid for pid in set(pers_ids)
+                       if pid not in self._persons]
+        details = self.map(
+                lambda pid: self.retry(self.get_person, pid)['people'][0],
+                missing)
+        with self._persons_lock:
+            self._persons.update(zip(missing, details))
+            return dict((pid, self._persons[pid]) for pid in pers_ids)
+
+    def retry(self, function, *args):
+        """ call function and repeat it on temporary errors
+
+        connection errors, timeouts and http errors with status
+        429 or 5xx are retried with an increasing delay
+
+        Parameters
+        ----------
+        function : callable
+            function sending a request
+        args :
+            arguments passed to function
+
+        """
+        for attempt in range(self._retries+1):
+            try:
+                return function(*args)
+            except (RequestsConnectionError, Timeout) as e:
+                error = e
+            except HTTPError as e:
+                status = e.response.status_code if e.response is not None else 0
+                if status != 429 and status < 500:
+                    raise
+                error = e
+            if attempt < self._retries:
+                time.sleep(0.5*2**attempt)
+        raise error
+
     def get_group(self, group_id):
         """ get info on a given group
 
@@ -170,16 +483,22 @@ class CeviDB(object):
             or the get request gets redirected too often
 
         """
-        if endpoint[:len(self._db_root)] == self._db_root:
-            url = endpoint
-        else:
-            url = self._db_root+endpoint
-        url += "?token={token}".format(
-                    token=self._token
-                    )
-        if query_string is not None:
-            url += "&"+query_string
-        res = requests.get(url, verify=self._cert_file)
+        url = build_url(self._db_root, self._token, endpoint, query_string)
+        headers = {}
+        entry = None
+        if self._cache is not None:
+            entry = self._cache.load(url)
+            headers = self._cache.headers(entry)
+        start = time.perf_counter()
+        try:
+            res = self._session.get(url, verify=self._cert_file,
+                                    timeout=self._timeout, headers=headers)
+        except (RequestsConnectionError, Timeout):
+            observe_request(self._request_hook, url, 0,
+                            time.perf_counter()-start)
+            raise
+        observe_request(self._request_hook, url, res.status_code,
+                        time.perf_counter()-start)
         # internal redirects
         #   e.g. people/{pid}.json -> groups/{gid}/people/{pid}.json
         # do not pass the query string on and therefore result in
@@ -189,6 +508,12 @@ class CeviDB(object):
                 res = self.get_request(res.url, redirect=redirect-1)
             else:
                 raise RuntimeError("Too many redirects")
+        elif self._cache is not None:
+            if res.status_code == 304 and entry is not None:
+                # not modified, use content from cache
+                res = cached_response(res, entry)
+            elif res.status_code == 200:
+                self._cache.store(url, res)
         res.raise_for_status()
         return res
 
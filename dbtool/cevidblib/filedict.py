@@ -11,15 +11,22 @@ filedict.py -- classes to read and write xlsx files
 
 """
 
+import copy
 import openpyxl
+from .persontable import PersonTable
 
-def row2person(row):
+def row2person(row, first_col=None):
     """ create data dict from list of Cells
 
     Parameters
     ----------
     row : list of Cell objects
         cells from a row single row
+    first_col : int
+        column number of the first cell in row. If given, the column
+        numbers are counted from here instead of being read from the
+        cells (needed for the empty cells of read-only worksheets)
+        (default: None)
 
     Returns
     -------
@@ -28,13 +35,20 @@ def row2person(row):
 
     """
     data      = {}
-    for c in row:
-        data[c.column] = c.value
+    if first_col is None:
+        for c in row:
+            data[c.column] = c.value
+    else:
+        for col, c in enumerate(row, first_col):
+            data[col] = c.value
     return data
 
 def to_coord(col, row):
     """ create coordinate string from column letter/number and row number
 
+    only used for backward compatibility and for openpyxl attributes
+    requiring strings, cells are addressed with (row, col) integers
+
     Parameters
     ----------
     col : string or int
@@ -52,59 +66,254 @@ def to_coord(col, row):
         col = openpyxl.utils.get_column_letter(col)
     return "{0}{1}".format(col, row)
 
+def to_index(cell):
+    """ (row, col) integers for a cell
+
+    Parameters
+    ----------
+    cell : tuple or string
+        (row, col) integers, or coordinate string ("A1") for
+        backward compatibility
+
+    Returns
+    -------
+    index : tuple
+        (row, col) integers
+
+    """
+    if isinstance(cell, str):
+        return openpyxl.utils.cell.coordinate_to_tuple(cell)
+    return tuple(cell)
+
+def as_table(config, persons):
+    """ person data as PersonTable
+
+    Parameters
+    ----------
+    config : cevidblib.config.Settings object
+        configuration defining the columns
+    persons: PersonTable or dict
+        person data, dictionaries {id: {col: value}} are converted
+
+    """
+    if isinstance(persons, PersonTable):
+        return persons
+    return PersonTable.from_dict(persons, config.column_keys)
+
+def collation_keys(values, kind):
+    """ keys to sort the values of a column by
+
+    Parameters
+    ----------
+    values : list
+        values of a column
+    kind : string
+        "text", "nocase" (case-insensitive) or "number"
+
+    Returns
+    -------
+    missing : list of bool
+        True for empty values (and non-numbers if kind is "number"),
+        so they are sorted last
+    keys : list
+        comparable key for each value
+
+    """
+    missing = []
+    keys = []
+    for value in values:
+        if kind == "number":
+            try:
+                key = float(value)
+            except (TypeError, ValueError):
+                key = None
+        elif value is None or value == "":
+            key = None
+        elif kind == "nocase":
+            key = str(value).casefold()
+        else:
+            key = str(value)
+        missing.append(key is None)
+        keys.append(0 if key is None else key)
+    return missing, keys
+
+def sort_persons(config, persons):
+    """ list of person ids sorted by the configured sort keys
+
+    persons with equal keys keep their order
+
+    Parameters
+    ----------
+    config : cevidblib.config.Settings object
+        configuration for file to write
+    persons: PersonTable or dict
+        person data
+
+    """
+    persons = as_table(config, persons)
+    columns = []
+    for col, kind in config.sort_keys:
+        columns.extend(collation_keys(persons.column(col), kind))
+    ids = persons.ids
+    if len(columns) == 0:
+        return list(ids)
+    keys = list(zip(*columns))
+    order = sorted(range(len(ids)), key=keys.__getitem__)
+    return [ids[index] for index in order]
+
+class CellSnapshot(object):
+    """ value and style of a cell
+
+    used by the streaming reader to keep header and footer cells
+    available after the read-only workbook has been closed
+    """
+
+    __slots__ = ("value", "style")
+
+    def __init__(self, value, style):
+        self.value = value
+        self.style = style
+
+
 class XlsxReader(object):
     """ Class to read xlsx file with person data from CeviDB """
 
-    def __init__(self, config, filename):
+    def __init__(self, config, filename, streaming=False):
         """ initialise reader object
 
         Parameters
         ----------
         config : cevidblib.config.Settings object
             configuration for file to read
-        filename : string
+        filename : string or file-like object
             filename to load (including path)
+        streaming : bool
+            if True, the file is opened read-only and parsed in a
+            single pass. Only person data and the header and footer
+            cells of the configured columns are kept. (default: False)
 
         """
         self._cfg = config
-        self._wb = openpyxl.load_workbook(filename)
+        self._filename = filename
+        self._streaming = streaming
         self._start_persons = self._cfg.header_lines+1
-
-        col_key = self._cfg.get_column_key("id")
-        self._persons = {}
-        row = self._start_persons
-        while True:
-            pers_id = str(self.active[to_coord(col_key, row)].value)
+        self._persons = PersonTable(self._cfg.column_keys)
+        self._cells = {}
+        if streaming:
+            self._wb = openpyxl.load_workbook(filename, read_only=True)
             try:
-                int(pers_id)
-            except (ValueError, TypeError):
+                self._read_rows()
+            finally:
+                self._wb.close()
+        else:
+            self._wb = openpyxl.load_workbook(filename)
+            self._read_rows()
+
+    def _read_rows(self):
+        """ read header, persons and footer in one pass over the sheet
+
+        persons are read from start_persons on until the first row
+        without an integer in the id column. In streaming mode, the
+        header and footer cells are stored for later access.
+
+        """
+        first_col = self._cfg.column_keys[0]
+        id_index = self._cfg.get_column_key("id")-first_col
+        end_footer = None
+        rows = self.active.iter_rows(
+                min_col=first_col,
+                max_col=self._cfg.column_keys[-1],
+                )
+        row_nr = 0
+        for row_nr, row in enumerate(rows, 1):
+            if row_nr < self._start_persons:
+                self._keep_cells(row, row_nr, first_col)
+                continue
+            if end_footer is None:
+                pers_id = str(row[id_index].value)
+                try:
+                    int(pers_id)
+                except (ValueError, TypeError):
+                    self._start_footer = row_nr
+                    end_footer = row_nr+self._cfg.footer_lines
+                else:
+                    self._persons.add_row(pers_id, row, first_col)
+                    continue
+            if row_nr >= end_footer:
                 break
-            selection = {
-                    "min_col": self._cfg.column_keys[0],
-                    "max_col": self._cfg.column_keys[-1],
-                    "min_row": row,
-                    "max_row": row
-                    }
-            person = row2person(next(self.active.iter_rows(**selection)))
-            self._persons[pers_id] = person
-            row += 1
-        self._start_footer = row
+            self._keep_cells(row, row_nr, first_col)
+        if end_footer is None:
+            # sheet ends directly after the last person
+            self._start_footer = max(row_nr+1, self._start_persons)
+
+    def _keep_cells(self, row, row_nr, first_col):
+        """ store header or footer cells when streaming
+
+        Parameters
+        ----------
+        row : list of Cell objects
+            cells of a single row, starting at column first_col
+        row_nr : int
+            number of the row
+        first_col : int
+            column number of the first cell in row
+
+        """
+        if not self._streaming:
+            return
+        for col, c in enumerate(row, first_col):
+            if col not in self._cfg.columns:
+                continue
+            # read-only cells do not provide the name of their style,
+            # empty cells have the default style
+            style_id = 0
+            if hasattr(c, "style_array"):
+                style_id = c.style_array.xfId
+            style = self._wb._named_styles[style_id].name
+            self._cells[(row_nr, col)] = CellSnapshot(c.value, style)
+
+    def get_cell(self, cell):
+        """ get cell object at given coordinates
+
+        in streaming mode only header and footer cells of the
+        configured columns are kept, all other cells are returned empty
+
+        Parameters
+        ----------
+        cell: tuple or string
+            (row, col) integers or coordinate string
+
+        """
+        row, col = to_index(cell)
+        if self._streaming:
+            return self._cells.get((row, col), CellSnapshot(None, None))
+        return self._wb.active.cell(row=row, column=col)
 
     def cell(self, cell):
         """ read value from cell at given coordinates
 
         Parameters
         ----------
-        cell: string
-            cell coordinates
+        cell: tuple or string
+            (row, col) integers or coordinate string
         """
-        return self._wb.active[cell].value
+        return self.get_cell(cell).value
 
     @property
     def active(self):
         """ active sheet """
         return self._wb.active
 
+    @property
+    def filename(self):
+        """ name of (or file-like object for) the file read """
+        return self._filename
+
+    @property
+    def streaming(self):
+        """ True if the file was read in streaming mode """
+        return self._streaming
+
     @property
     def start_persons(self):
         """ row number of first row containing persons """
@@ -117,7 +326,7 @@ class XlsxReader(object):
 
     @property
     def persons(self):
-        """ dictionary with person data """
+        """ PersonTable with person data """
         return self._persons
 
 
@@ -134,7 +343,7 @@ class XlsxWriter(object):
         ----------
         config : cevidblib.config.Settings object
             configuration for file to write (and read)
-        new_name : string
+        new_name : string or file-like object
             filename for new file (including path)
         reader : XlsxReader object
             reader object with  old file loaded
@@ -143,6 +352,8 @@ class XlsxWriter(object):
         self._wb = openpyxl.Workbook()
         self._filename = new_name
         self._old_file = reader
+        # {style name: style array or None}, see apply_style()
+        self._styles = {}
 
         self._start_persons = self._cfg.header_lines+1
         self._start_footer = -1
@@ -152,18 +363,50 @@ class XlsxWriter(object):
 
         Parameters
         ----------
-        src : string
-            coordinates of source cell
-        dst : string
-            coordinates of destination cell
+        src : tuple or string
+            (row, col) integers or coordinates of source cell
+        dst : tuple or string
+            (row, col) integers or coordinates of destination cell
         """
         if dst == None:
             dst = src
-        self._wb.active[dst].value = self._old_file.active[src].value
+        src_cell = self._old_file.get_cell(src)
+        row, col = to_index(dst)
+        cell = self._wb.active.cell(row=row, column=col, value=src_cell.value)
+        self.apply_style(cell, src_cell.style)
+
+    def apply_style(self, cell, style):
+        """ set named style of a cell
+
+        each style name is resolved only once, all later cells with
+        the same style get a copy of the resolved style ids.
+
+        Parameters
+        ----------
+        cell : openpyxl cell
+            cell in the new workbook
+        style : string
+            name of the style, styles unknown to the new workbook
+            are ignored
+
+        """
         try:
-            self._wb.active[dst].style = self._old_file.active[src].style
-        except ValueError:
-            pass
+            style_array = self._styles[style]
+        except KeyError:
+            try:
+                cell.style = style
+                style_array = copy.copy(cell._style)
+            except ValueError:
+                style_array = None
+            self._styles[style] = style_array
+            return
+        if style_array is not None:
+            cell._style = copy.copy(style_array)
+
+    @property
+    def style_count(self):
+        """ number of distinct styles written """
+        return len([s for s in self._styles.values() if s is not None])
 
     def copy_header(self):
         """ copy all header cells
@@ -172,7 +415,7 @@ class XlsxWriter(object):
         """
         for row in range(1,self._start_persons):
             for col in self._cfg.column_keys:
-                self.copy_cell(to_coord(col, row))
+                self.copy_cell((row, col))
 
     def copy_footer(self):
         """ copy all footer cells
@@ -199,46 +442,44 @@ class XlsxWriter(object):
                 self._start_footer+self._cfg.footer_lines))
         for old_row, new_row in zip(old_footer_rows, new_footer_rows):
             for col in self._cfg.column_keys:
-                new_cell = to_coord(col, new_row)
-                old_cell = to_coord(col, old_row)
-                self.copy_cell(old_cell, new_cell)
+                self.copy_cell((old_row, col), (new_row, col))
+
+    def sorted_ids(self, persons):
+        """ list of person ids in the order they are written
+
+        Parameters
+        ----------
+        persons: PersonTable or dict
+            person data
+
+        """
+        return sort_persons(self._cfg, persons)
 
     def write_persons(self, persons):
         """ write person data to file
 
         Parameters
         ----------
-        persons: dict
-            dictionary with person data
+        persons: PersonTable or dict
+            person data
 
         """
-        # create list with sorted names and person ids
-        # entrys have the form "lastname|id"
-        sort_col = self._cfg.get_column_key("last_name")
-        sorted_names = []
-        for p_key, p_person in list(persons.items()):
-            try:
-                sorted_names.append(p_person[sort_col]+"|"+p_key)
-            except TypeError:
-                # entry without a value in the sort_col
-                # -> fake a value that gets sorted last
-                sorted_names.append("zzz|"+p_key)
-        sorted_names.sort()
+        persons = as_table(self._cfg, persons)
+        columns = [(col, persons.column(col), self._cfg.columns[col])
+                   for col in self._cfg.column_keys]
         # write data for all persons to file (sorted)
-        for nr, pers in enumerate(sorted_names):
+        sheet = self._wb.active
+        for nr, pers_id in enumerate(self.sorted_ids(persons)):
             row = nr+self._start_persons
-            pers_id = pers.split("|")[1]
-            pers_data = persons[pers_id]
+            index = persons.position(pers_id)
             # process data columns
-            for col in self._cfg.column_keys:
-                val = pers_data[col]
+            for col, values, col_config in columns:
+                val = values[index]
                 # recreate formulas
-                col_config = self._cfg.columns[col]
                 if col_config.group == "formula":
                     val = col_config.value.format(row=row, col=col)
                 # write data
-                cell_coord = to_coord(col, row)
-                self._wb.active[cell_coord].value = val
+                sheet.cell(row=row, column=col, value=val)
         self._start_footer = self._start_persons+len(persons)
 
     def fill(self, persons):
@@ -249,8 +490,8 @@ class XlsxWriter(object):
 
         Parameters
         ----------
-        persons: dict
-            dictionary with person data
+        persons: PersonTable or dict
+            person data
 
         """
         self.copy_header()
@@ -262,8 +503,140 @@ class XlsxWriter(object):
 
         additionally freezes view below header and after column set in config
         """
-        self._wb.active.freeze_panes = self._wb.active[
-                    to_coord(self._cfg.freeze_column, self._start_persons)
-                ]
+        self._wb.active.freeze_panes = to_coord(self._cfg.freeze_column,
+                                                self._start_persons)
         self._wb.save(self._filename)
 
+
+
+class XlsxStreamWriter(XlsxWriter):
+    """ class to write CeviDB data into xlsx File using a write-only workbook
+
+    rows are streamed to the file in order (header, persons, footer),
+    so the memory used does not grow with the number of persons.
+    Cells can not be accessed after they have been written, use
+    XlsxWriter if random access is needed.
+    """
+
+    def __init__(self, config, new_name, reader):
+        """ initialise writer object
+
+        Parameters
+        ----------
+        config : cevidblib.config.Settings object
+            configuration for file to write (and read)
+        new_name : string or file-like object
+            filename for new file (including path)
+        reader : XlsxReader object
+            reader object with  old file loaded
+        """
+        self._cfg = config
+        self._wb = openpyxl.Workbook(write_only=True)
+        self._ws = self._wb.create_sheet()
+        self._filename = new_name
+        self._old_file = reader
+        self._styles = {}
+
+        self._start_persons = self._cfg.header_lines+1
+        self._start_footer = -1
+        self._next_row = 1
+        # the sheet view is written with the first row
+        self._ws.freeze_panes = to_coord(self._cfg.freeze_column,
+                                         self._start_persons)
+
+    def _append(self, row, values):
+        """ append a row to the sheet
+
+        Parameters
+        ----------
+        row : int
+            row number, must be the next row of the sheet
+        values : list
+            values or cells, starting in column A
+
+        Raises
+        ------
+        RuntimeError
+            if row is not the next row of the sheet
+
+        """
+        if row != self._next_row:
+            raise RuntimeError("rows must be written in order")
+        self._ws.append(values)
+        self._next_row += 1
+
+    def copy_row(self, src_row, dst_row):
+        """ copy content and formating of configured cells in a row
+
+        Parameters
+        ----------
+        src_row : int
+            number of the row in the old file
+        dst_row : int
+            number of the row in the new file
+        """
+        values = [None]*self._cfg.column_keys[-1]
+        for col in self._cfg.column_keys:
+            src_cell = self._old_file.get_cell((src_row, col))
+            cell = openpyxl.cell.WriteOnlyCell(self._ws, src_cell.value)
+            self.apply_style(cell, src_cell.style)
+            values[col-1] = cell
+        self._append(dst_row, values)
+
+    def copy_header(self):
+        """ copy all header cells
+
+        the header cells are defined by the loaded configuration
+        """
+        for row in range(1,self._start_persons):
+            self.copy_row(row, row)
+
+    def copy_footer(self):
+        """ copy all footer cells
+
+        see XlsxWriter.copy_footer()
+
+        Raises
+        ------
+        RuntimeError
+            if start_footer has not been initialised or
+            is invalid (is smaller then start_persons)
+
+        """
+        if self._start_footer < self._start_persons:
+            raise RuntimeError("start of footer not defined")
+        old_footer_start = self._old_file.start_footer
+        for nr in range(self._cfg.footer_lines):
+            self.copy_row(old_footer_start+nr, self._start_footer+nr)
+
+    def write_persons(self, persons):
+        """ write person data to file
+
+        Parameters
+        ----------
+        persons: PersonTable or dict
+            person data
+
+        """
+        persons = as_table(self._cfg, persons)
+        columns = [(col, persons.column(col), self._cfg.columns[col])
+                   for col in self._cfg.column_keys]
+        for nr, pers_id in enumerate(self.sorted_ids(persons)):
+            row = nr+self._start_persons
+            index = persons.position(pers_id)
+            values = [None]*self._cfg.column_keys[-1]
+            for col, column, col_config in columns:
+                val = column[index]
+                # recreate formulas
+                if col_config.group == "formula":
+                    val = col_config.value.format(row=row, col=col)
+                values[col-1] = val
+            self._append(row, values)
+        self._start_footer = self._start_persons+len(persons)
+
+    def save(self):
+        """ save new workbook to file
+
+        the view is frozen when the writer is initialised
+        """
+        self._wb.save(self._filename)
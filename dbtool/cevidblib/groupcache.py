@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+groupcache.py -- in-memory cache for the members of groups
+
+"""
+
+import asyncio
+import collections
+import threading
+import time
+
+
+class GroupCache(object):
+    """ cache for snapshots of group members
+
+    snapshots are stored by key (usually Master.cache_key) and
+    expire after ttl seconds. If more than max_entries snapshots are
+    stored, the least recently used one is dropped. One object can be
+    shared by all threads of a process.
+
+    """
+
+    def __init__(self, ttl=60, max_entries=32):
+        """ initialise cache
+
+        Parameters
+        ----------
+        ttl : float
+            seconds a snapshot is used (default: 60)
+        max_entries : int
+            maximal number of snapshots stored (default: 32)
+
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # {key: (timestamp, members), ...} ordered by last use
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # locks to load each key only once at a time
+        #   {key: [<<threading.Lock>>, number of users], ...}
+        self._loading = {}
+
+    def get(self, key):
+        """ get copy of the stored snapshot
+
+        Parameters
+        ----------
+        key : hashable
+            key of the snapshot
+
+        Returns
+        -------
+        members : list of dicts or None
+            None if no valid snapshot is stored
+
+        """
+        with self._lock:
+            try:
+                stamp, members = self._entries[key]
+            except KeyError:
+                return None
+            if time.monotonic()-stamp > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return [dict(row) for row in members]
+
+    def put(self, key, members):
+        """ store snapshot
+
+        Parameters
+        ----------
+        key : hashable
+            key of the snapshot
+        members : list of dicts
+            members of the group, a copy is stored
+
+        """
+        snapshot = [dict(row) for row in members]
+        with self._lock:
+            self._entries[key] = (time.monotonic(), snapshot)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def fetch(self, key, loader, refresh=False):
+        """ get snapshot, loading it if needed
+
+        concurrent calls for the same key wait for a single load
+
+        Parameters
+        ----------
+        key : hashable
+            key of the snapshot
+        loader : callable
+            function returning the members of the group
+        refresh : bool
+            if True, the snapshot is loaded even if a valid one
+            is stored (default: False)
+
+        Returns
+        -------
+        members : list of dicts
+            copy of the snapshot
+
+        """
+        key_lock = self._lock_key(key)
+        try:
+            with key_lock:
+                if not refresh:
+                    members = self.get(key)
+                    if members is not None:
+                        return members
+                members = loader()
+                self.put(key, members)
+        finally:
+            self._unlock_key(key)
+        return members
+
+    async def fetch_async(self, key, loader, refresh=False):
+        """ get snapshot, loading it with a coroutine if needed
+
+        like fetch(), but loader returns an awaitable. The event loop
+        is not blocked while waiting for a load in another thread.
+
+        """
+        key_lock = self._lock_key(key)
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                    None, key_lock.acquire)
+            try:
+                if not refresh:
+                    members = self.get(key)
+                    if members is not None:
+                        return members
+                members = await loader()
+                self.put(key, members)
+            finally:
+                key_lock.release()
+        finally:
+            self._unlock_key(key)
+        return members
+
+    def _lock_key(self, key):
+        """ get the lock loading key, created for the first user """
+        with self._lock:
+            entry = self._loading.get(key)
+            if entry is None:
+                entry = self._loading[key] = [threading.Lock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _unlock_key(self, key):
+        """ drop the lock loading key after its last user """
+        with self._lock:
+            entry = self._loading[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._loading[key]
+
+    def clear(self):
+        """ drop all snapshots """
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+httpcache.py -- on-disk cache for responses from CeviDB
+
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from urllib.parse import urlsplit, parse_qsl
+from .db import split_link
+
+
+class CacheEntry(object):
+    """ struct to store a cached response """
+
+    def __init__(self, etag, last_modified, body):
+        """ define validators and content of response """
+        self.etag = etag
+        self.last_modified = last_modified
+        self.body = body
+
+
+class HttpCache(object):
+    """ cache storing responses on disk by url
+
+    the key is the url without the authentication token and a hash of
+    the token, so users with different tokens do not share entries,
+    but the token is not stored on disk. Entries are written to a temporary file and renamed,
+    so several processes can share the same directory. If the
+    directory grows larger than max_size, the least recently used
+    entries are deleted.
+
+    """
+
+    suffix = ".cache"
+
+    def __init__(self, directory, max_size=50*1024*1024):
+        """ initialise cache
+
+        Parameters
+        ----------
+        directory : string
+            directory to store the responses in, created if missing
+        max_size : int
+            maximal size of all entries in bytes (default: 50 MB)
+
+        """
+        self._dir = directory
+        self._max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def filename(self, url):
+        """ name of the file storing the response for url
+
+        Parameters
+        ----------
+        url : string
+            url including query string
+
+        """
+        token = dict(parse_qsl(urlsplit(url).query)).get("token", "")
+        url, query_string = split_link(url)
+        if query_string is not None:
+            url += "?"+query_string
+        token = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        key = hashlib.sha256((url+"\n"+token).encode("utf-8")).hexdigest()
+        return os.path.join(self._dir, key+self.suffix)
+
+    def headers(self, entry):
+        """ headers to revalidate a cached response
+
+        Parameters
+        ----------
+        entry : CacheEntry object or None
+            cached response
+
+        """
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def load(self, url):
+        """ read cached response for url
+
+        Parameters
+        ----------
+        url : string
+            url including query string
+
+        Returns
+        -------
+        entry : CacheEntry object or None
+            None if no response is cached
+
+        """
+        filename = self.filename(url)
+        try:
+            with open(filename, "rb") as cache_file:
+                meta = json.loads(cache_file.readline().decode("utf-8"))
+                body = cache_file.read()
+            # mark as recently used for eviction
+            os.utime(filename)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(meta.get("etag"), meta.get("last_modified"), body)
+
+    def store(self, url, res):
+        """ store response if it can be revalidated
+
+        Parameters
+        ----------
+        url : string
+            url including query string
+        res : requests.Response object
+            response with status 200
+
+        """
+        etag = res.headers.get("ETag")
+        last_modified = res.headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        meta = json.dumps({"etag": etag, "last_modified": last_modified})
+        handle, tmp_name = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as cache_file:
+                cache_file.write(meta.encode("utf-8")+b"\n")
+                cache_file.write(res.content)
+            os.replace(tmp_name, self.filename(url))
+        except OSError:
+            try:
+                os.remove(tmp_name)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        """ delete least recently used entries if cache is too large """
+        entries = []
+        total = 0
+        for entry in os.scandir(self._dir):
+            if not entry.name.endswith(self.suffix):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        if total <= self._max_size:
+            return
+        entries.sort()
+        for mtime, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                # already removed by another process
+                pass
+            total -= size
+            if total <= self._max_size:
+                break
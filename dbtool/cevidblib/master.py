@@ -10,15 +10,74 @@ master.py -- main class coordinating db-query and file update
 
 """
 
-from .filedict import XlsxReader, XlsxWriter
+from .filedict import XlsxReader, XlsxWriter, XlsxStreamWriter, as_table
+from .xlsxpatch import XlsxPatcher, UnsupportedWorkbook
 from .db import CeviDB
+from .httpcache import HttpCache
+from .report import RunReport, logging_hook
 import os, time
+import asyncio
+import hashlib
+import io
+import logging
+import shutil
+import tempfile
 from .config import Settings
 
+def same_value(old, new):
+    """ check if a value from the DB matches the value in the file
+
+    empty cells match None and "", numbers read from the file
+    match the same number as string (e.g. ids)
+
+    """
+    if old is None:
+        old = ""
+    if new is None:
+        new = ""
+    if old == new:
+        return True
+    return str(old) == str(new)
+
+
+def saved_size(target):
+    """ size in bytes of a saved file or file-like object """
+    if isinstance(target, (str, bytes, os.PathLike)):
+        return os.path.getsize(target)
+    return target.seek(0, io.SEEK_END)
+
+
+class Changeset(object):
+    """ changes made by Master.update_persons
+
+    Attributes
+    ----------
+    new : list
+        ids of persons added to the file
+    changed : dict
+        dictionary mapping ids of existing persons to the changed
+        cells {col: (old, new), ...}
+
+    """
+
+    def __init__(self):
+        self.new = []
+        self.changed = {}
+
+    def __len__(self):
+        """ number of persons added or changed """
+        return len(self.new)+len(self.changed)
+
+    def __repr__(self):
+        return "Changeset({0} new, {1} changed)".format(len(self.new),
+                                                      len(self.changed))
+
+
 class Master(object):
     """ object to handle backups, and calls to other objects """
 
-    def __init__(self, settings=None):
+    def __init__(self, settings=None, group_cache=None, report_hook=None,
+                 session=None, request_hook=None):
         """ initilise settings and attributes
 
         Parameters
@@ -26,23 +85,57 @@ class Master(object):
         settings : cevidblib.config.Settings object
             configuration for file to process
             if None, default settings are used (default: None)
+        group_cache : cevidblib.groupcache.GroupCache object
+            cache for group members shared between Master objects,
+            if None, the members are always fetched (default: None)
+        report_hook : callable
+            function called with the RunReport object of every update,
+            if None, the report is logged to the cevidblib logger
+            (default: None)
+        session : requests.Session object
+            session used by the CeviDB objects of connect(),
+            if None, the session shared inside the process is used
+            (default: None)
+        request_hook : callable
+            function called after every request to the DB, see
+            cevidblib.db.observe_request() (default: None)
 
         """
         if settings==None:
             self._cfg    = Settings()
         else:
             self._cfg    = settings
+        self._group_cache = group_cache
+        self._session = session
+        self._request_hook = request_hook
         self._reader = None
         self._writer = None
         self._db     = None
         self._filename   = None
         self._backupname = None
+        self._changes    = None
+        self._report     = None
+        # configured attributes neither in the listing nor the details
+        self._unknown_fields = set()
+        if report_hook is None:
+            report_hook = logging_hook()
+        self._report_hook = report_hook
 
     @property
     def cfg(self):
         """ object representing loaded configuration """
         return self._cfg
 
+    @property
+    def changes(self):
+        """ Changeset of the last update, None before the first one """
+        return self._changes
+
+    @property
+    def report(self):
+        """ RunReport of the last update, None before the first one """
+        return self._report
+
     def backup_file(self, filename, protect=True):
         """ move existing data file to backup
 
@@ -61,15 +154,54 @@ class Master(object):
 
         """
         self._filename = filename
-        dirname  = os.path.dirname(filename)
-        basename = os.path.basename(filename)
-        backup_base = time.strftime("%Y-%m-%d_")+basename
-        backupname  = os.path.join(dirname, backup_base)
+        backupname = self.backup_name(filename)
         if protect and os.path.exists(backupname):
             raise RuntimeError("Backup file exists already")
         os.rename(filename, backupname)
         self._backupname = backupname
 
+    def backup_name(self, filename):
+        """ name of the backup file
+
+        Parameters
+        ----------
+        filename : string
+            filename of data file (including path)
+
+        Returns
+        -------
+        backupname : string
+            filename with a YYYY-MM-DD_ prefix in the same directory
+
+        """
+        dirname  = os.path.dirname(filename)
+        basename = os.path.basename(filename)
+        backup_base = time.strftime("%Y-%m-%d_")+basename
+        return os.path.join(dirname, backup_base)
+
+    def keep_backup(self, filename):
+        """ keep the current version of filename as backup
+
+        the backup is a hard link (or a copy, if linking is not
+        supported), so filename stays in place until it is replaced
+
+        Raises
+        ------
+        RuntimeError
+            if the backup-filename exists already
+
+        """
+        self._filename = filename
+        self._backupname = self.backup_name(filename)
+        try:
+            os.link(filename, self._backupname)
+        except FileExistsError:
+            raise RuntimeError("Backup file exists already")
+        except OSError:
+            with open(self._backupname, "xb") as backup_file:
+                with open(filename, "rb") as data_file:
+                    shutil.copyfileobj(data_file, backup_file)
+
     def restore_backup(self):
         """ restore backup file
 
@@ -90,35 +222,399 @@ class Master(object):
 
         updates the data in list_file:
             * update person-fields with latest values from DB
+            * keep person-fields the DB did not return
             * do not change other fields of existing persons
             * add new rows for new persons in DB list_db
             * keep all data on persons not in  list_db anymore
 
         Parameters
         ----------
-        list_file : dict of dicts
-            dictionary with data from file
+        list_file : cevidblib.persontable.PersonTable object or dict
+            table with data from file, or dictionary {id: {col: value}}
         list_db : list of dicts
             list with data from DB query
 
         Returns
         -------
-        Nothing, the list_file object is modified
+        changes : Changeset object
+            persons added and cells changed, the list_file object
+            is modified
 
         """
+        table = as_table(self.cfg, list_file)
+        changes = Changeset()
         for row_db in list_db:
             pers_id = row_db['id']
-            try:
-                row_file = list_file[pers_id]
-            except KeyError:
-                row_file = {}
-                for key in self._cfg.column_keys:
-                    row_file[key] = ""
-                list_file[pers_id] = row_file
+            is_new = pers_id not in table
+            if is_new:
+                row_file = table.add(pers_id)
+                changes.new.append(pers_id)
+            else:
+                row_file = table[pers_id]
             for key, field in self.cfg.pers_cols:
+                if field not in row_db:
+                    # not provided by the DB, keep the value in the file
+                    continue
+                if not is_new \
+                        and not same_value(row_file[key], row_db[field]):
+                    changes.changed.setdefault(pers_id, {})[key] = \
+                            (row_file[key], row_db[field])
                 row_file[key] = row_db[field]
+        if table is not list_file:
+            # dictionaries are updated in place, like before PersonTable
+            for pers_id, row_file in table.items():
+                list_file.setdefault(pers_id, {}).update(row_file.to_dict())
+        return changes
+
+    def add_details(self, list_db):
+        """ add attributes missing in the group listing
+
+        columns can be configured with attributes only available in the
+        details of a person. The details of all persons missing one of
+        the configured attributes are fetched at once.
+
+        Parameters
+        ----------
+        list_db : list of dicts
+            list with data from DB query
+
+        Returns
+        -------
+        list_db : list of dicts
+            list with data from DB query, the completed persons are
+            copies, the dicts passed in are not modified
+
+        """
+        pers_ids = self.detail_ids(list_db)
+        if len(pers_ids) == 0:
+            return list_db
+        return self.merge_details(list_db, self._db.get_persons(pers_ids))
+
+    def incomplete_persons(self, list_db):
+        """ list persons missing one of the configured attributes
+
+        attributes found to be unknown by check_fields() are ignored
+
+        Parameters
+        ----------
+        list_db : list of dicts
+            list with data from DB query
+
+        """
+        fields = [field for key, field in self.cfg.pers_cols
+                  if field not in self._unknown_fields]
+        return [row_db for row_db in list_db
+                if any(field not in row_db for field in fields)]
+
+    def detail_ids(self, list_db):
+        """ ids of the persons whose details are needed
+
+        the details are fetched by the caller (e.g. with
+        CeviDB.get_persons()) and passed to merge_details()
+
+        Parameters
+        ----------
+        list_db : list of dicts
+            list with data from DB query
+
+        """
+        return [row_db['id'] for row_db in self.incomplete_persons(list_db)]
+
+    def check_fields(self, list_db, details):
+        """ find configured attributes the DB does not provide
+
+        attributes neither in the group listing nor in the details
+        of any person (e.g. misspelled in the configuration) are logged
+        and not requested again.
+
+        Parameters
+        ----------
+        list_db : list of dicts
+            list with data from DB query
+        details : dict
+            dictionary mapping ids to the person details
+
+        """
+        for key, field in self.cfg.pers_cols:
+            if field in self._unknown_fields \
+                    or any(field in person for person in details.values()) \
+                    or any(field in row_db for row_db in list_db):
+                continue
+            self._unknown_fields.add(field)
+            logging.getLogger("cevidblib").warning(
+                    "attribute '%s' of column %s not provided by the DB",
+                    field, key)
+
+    def merge_details(self, list_db, details):
+        """ add missing attributes from person details
+
+        attributes missing in the details as well stay missing, so
+        update_persons() keeps the values in the file. Unknown
+        attributes are found with check_fields().
+
+        Parameters
+        ----------
+        list_db : list of dicts
+            list with data from DB query
+        details : dict
+            dictionary mapping ids to the person details
+            of detail_ids(list_db)
+
+        Returns
+        -------
+        list_db : list of dicts
+            list with data from DB query, the completed persons are
+            copies, as the dicts passed in may be shared (e.g. by the
+            group cache)
 
-    def run(self, filename, cert="cacert.pem", backup=True):
+        """
+        self.check_fields(list_db, details)
+        fields = [field for key, field in self.cfg.pers_cols]
+        merged = []
+        for row_db in list_db:
+            person = details.get(row_db['id'], {})
+            missing = [field for field in fields
+                       if field not in row_db and field in person]
+            if len(missing) > 0:
+                row_db = dict(row_db)
+                for field in missing:
+                    row_db[field] = person[field]
+            merged.append(row_db)
+        return merged
+
+    @property
+    def group_key(self):
+        """ key of the configured group in the group cache
+
+        the key contains a hash of the token, as tokens of different
+        users may see different members or attributes
+        """
+        token = hashlib.sha256(self._cfg.api_token.encode("utf-8"))
+        return (self._cfg.db_url, self._cfg.group_id, token.hexdigest())
+
+    @property
+    def cache_key(self):
+        """ key of the members with details in the group cache
+
+        the snapshot contains the details of the configured attributes,
+        so configs with other person-columns do not share it
+        """
+        fields = sorted(set(field for key, field in self.cfg.pers_cols))
+        return self.group_key+(tuple(fields),)
+
+    def connect(self, cert=None):
+        """ create the CeviDB object used for the configured DB
+
+        Parameters
+        ----------
+        cert : string
+            certificate file used for SSL verification including path
+
+        Returns
+        -------
+        db : cevidblib.db.CeviDB object
+            connection with the configured settings
+
+        """
+        cache = None
+        if self._cfg.cache_dir:
+            cache = HttpCache(self._cfg.cache_dir, self._cfg.cache_size)
+        self._db = CeviDB(self._cfg.api_token, self._cfg.db_url, cert,
+                          timeout=self._cfg.timeout,
+                          pool_size=self._cfg.pool_size,
+                          max_workers=self._cfg.max_workers,
+                          retries=self._cfg.retries,
+                          session=self._session,
+                          cache=cache,
+                          request_hook=self._request_hook)
+        return self._db
+
+    def fetch(self, cert=None, refresh=False):
+        """ get group members and missing details
+
+        the group cache stores the members with the details added, so
+        no request is sent while a snapshot is valid
+
+        Parameters
+        ----------
+        cert : string
+            certificate file used for SSL verification including path
+        refresh : bool
+            if True, members stored in the group cache are not used
+            (default: False)
+
+        Returns
+        -------
+        list_db : list of dicts
+            list with data from DB query
+
+        """
+        if self._cfg.async_client:
+            return self.fetch_async(cert, refresh)
+        self.connect(cert)
+        loader = lambda: self.add_details(
+                self._db.get_group_members(self._cfg.group_id))
+        if self._group_cache is None:
+            return loader()
+        return self._group_cache.fetch(self.cache_key, loader, refresh)
+
+    def fetch_async(self, cert=None, refresh=False):
+        """ get group members and missing details using asyncio
+
+        the requests are sent from a single thread using
+        cevidblib.asyncdb.AsyncCeviDB (requires aiohttp)
+
+        Parameters
+        ----------
+        cert : string
+            certificate file used for SSL verification including path
+        refresh : bool
+            if True, members stored in the group cache are not used
+            (default: False)
+
+        Returns
+        -------
+        list_db : list of dicts
+            list with data from DB query
+
+        """
+        from .asyncdb import AsyncCeviDB
+
+        async def fetch():
+            async with AsyncCeviDB(self._cfg.api_token, self._cfg.db_url,
+                                   cert, timeout=self._cfg.timeout,
+                                   limit=self._cfg.pool_size,
+                                   retries=self._cfg.retries,
+                                   request_hook=self._request_hook) as db:
+                async def loader():
+                    list_db = await db.get_group_members(self._cfg.group_id)
+                    pers_ids = self.detail_ids(list_db)
+                    if len(pers_ids) > 0:
+                        list_db = self.merge_details(
+                                list_db, await db.get_persons(pers_ids))
+                    return list_db
+                if self._group_cache is None:
+                    return await loader()
+                return await self._group_cache.fetch_async(
+                        self.cache_key, loader, refresh)
+
+        return asyncio.run(fetch())
+
+    def create_writer(self, filename):
+        """ create writer for the configured write mode
+
+        the patcher is used if enabled and the file supports it,
+        otherwise the streaming or the in-memory writer is used.
+
+        Parameters
+        ----------
+        filename: string
+            file to write (including path)
+
+        """
+        if self._cfg.patch_write:
+            try:
+                return XlsxPatcher(self.cfg, filename, self._reader)
+            except UnsupportedWorkbook:
+                pass
+        if self._cfg.stream_write:
+            return XlsxStreamWriter(self.cfg, filename, self._reader)
+        return XlsxWriter(self.cfg, filename, self._reader)
+
+    def update(self, source, target, cert=None, refresh=False, report=None):
+        """ read file, merge data from DB and write new file
+
+        the duration of the phases read, fetch, update and write
+        and the counters are collected in a RunReport, passed to the
+        report hook at the end. If the update fails, the partial
+        report is passed with its error set.
+
+        Parameters
+        ----------
+        source : string or file-like object
+            file to read (including path)
+        target : string or file-like object
+            file to write (including path), not written if nothing
+            changed
+        cert : string
+            certificate file used for SSL verification including path
+        refresh : bool
+            if True, members stored in the group cache are not used
+            (default: False)
+        report : RunReport object
+            report to add the timings to, the report hook is only
+            called if a new report is created (default: None)
+
+        Returns
+        -------
+        changes : Changeset object
+            changes written to target
+
+        """
+        emit = report is None
+        if emit:
+            report = RunReport()
+        self._report = report
+        try:
+            with report.phase("read"):
+                self._reader = XlsxReader(self.cfg, source,
+                                          streaming=self._cfg.stream_read)
+                persons_file = self._reader.persons
+            report.count("rows_read", len(persons_file))
+
+            with report.phase("fetch"):
+                persons_db = self.fetch(cert, refresh)
+            report.count("persons_fetched", len(persons_db))
+
+            with report.phase("update"):
+                self._changes = self.update_persons(persons_file, persons_db)
+            report.count("persons_new", len(self._changes.new))
+            report.count("persons_changed", len(self._changes.changed))
+            if len(self._changes) > 0:
+                with report.phase("write"):
+                    self._writer = self.create_writer(target)
+                    self._writer.fill(persons_file)
+                    self._writer.save()
+                report.count("cells_written",
+                             len(persons_file)*len(self.cfg.column_keys))
+                report.count("bytes_saved", saved_size(target))
+        except Exception as e:
+            report.fail(e)
+            raise
+        finally:
+            if emit:
+                self._report_hook(report)
+        return self._changes
+
+    def process(self, source, cert=None, refresh=False):
+        """ update a file in memory
+
+        Parameters
+        ----------
+        source : file-like object
+            binary file to update, e.g. an uploaded file
+        cert : string
+            certificate file used for SSL verification including path
+        refresh : bool
+            if True, members stored in the group cache are not used
+            (default: False)
+
+        Returns
+        -------
+        target : file-like object
+            io.BytesIO with the updated file, source itself
+            (rewound) if nothing changed
+
+        """
+        target = io.BytesIO()
+        changes = self.update(source, target, cert, refresh)
+        if len(changes) == 0:
+            source.seek(0)
+            return source
+        target.seek(0)
+        return target
+
+    def run(self, filename, cert="cacert.pem", backup=True, refresh=False):
         """ main function for update
 
         Parameters
@@ -128,26 +624,48 @@ class Master(object):
         cert_file : string
             certificate file used for SSL verification including path
             (default: 'cacert.pem' in the present working directory.)
+        backup : bool
+            if True, the previous version is kept with a YYYY-MM-DD_
+            prefix (default: True)
+        refresh : bool
+            if True, members stored in the group cache are not used
+            (default: False)
 
-        """
-        self.backup_file(filename, protect=backup)
-        try:
-            self._reader = XlsxReader(self.cfg, self._backupname)
-            persons_file = self._reader.persons
-
-            self._db     = CeviDB(self._cfg.api_token, self._cfg.db_url, cert)
-            persons_db   = self._db.get_group_members(self._cfg.group_id)
+        Returns
+        -------
+        changes : Changeset object
+            changes written to the file, if empty the file is left
+            unchanged, the timings are available as report
 
-            self.update_persons(persons_file, persons_db)
+        Raises
+        ------
+        RuntimeError
+            if backup is True and the backup-filename exists already
 
-            self._writer = XlsxWriter(self.cfg, filename, self._reader)
-            self._writer.fill(persons_file)
-            self._writer.save()
+        """
+        self._filename = filename
+        if backup and os.path.exists(self.backup_name(filename)):
+            raise RuntimeError("Backup file exists already")
+        report = RunReport()
+        # write next to the file and move into place when complete,
+        # so the file is never seen half written
+        handle, tmp_name = tempfile.mkstemp(
+                dir=os.path.dirname(filename) or None, suffix=".xlsx")
+        os.close(handle)
+        try:
+            changes = self.update(filename, tmp_name, cert, refresh, report)
+            if len(changes) > 0:
+                shutil.copymode(filename, tmp_name)
+                if backup:
+                    with report.phase("backup"):
+                        self.keep_backup(filename)
+                os.replace(tmp_name, filename)
         except Exception as e:
-            if backup:
-                self.restore_backup()
-            raise e
+            report.fail(e)
+            raise
         finally:
-            if not backup:
-                self.delete_backup()
-
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            # failed runs are reported as well, with their error set
+            self._report_hook(report)
+        return changes
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+persontable.py -- compact table holding the person data of a file
+
+"""
+
+
+class PersonRow(object):
+    """ view on the values of a single person in a PersonTable
+
+    behaves like the dict {col: value, ...} used before, but
+    reads and writes the values in the columns of the table
+    """
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, col):
+        return self._table._data[col][self._index]
+
+    def __setitem__(self, col, value):
+        self._table._data[col][self._index] = value
+
+    def __contains__(self, col):
+        return col in self._table._data
+
+    def __iter__(self):
+        return iter(self._table.column_keys)
+
+    def __len__(self):
+        return len(self._table.column_keys)
+
+    def __eq__(self, other):
+        if isinstance(other, PersonRow):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return "PersonRow({0!r})".format(self.to_dict())
+
+    def get(self, col, default=None):
+        """ value in column col, default if column does not exist """
+        try:
+            return self[col]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """ column keys """
+        return list(self._table.column_keys)
+
+    def items(self):
+        """ list of (col, value) pairs """
+        return [(col, self[col]) for col in self._table.column_keys]
+
+    def to_dict(self):
+        """ values as dictionary {col: value, ...} """
+        return dict(self.items())
+
+
+class PersonTable(object):
+    """ person data stored by column
+
+    each column is a list holding the values of all persons, a single
+    dictionary maps the person ids to the position in these lists.
+    The memory used grows by one reference per cell and one entry
+    per person, instead of a dictionary per person.
+
+    The table can be used like the dictionary {id: {col: value}}
+    it replaces, accessing a person returns a PersonRow view.
+    """
+
+    __slots__ = ("_columns", "_data", "_index", "_ids")
+
+    def __init__(self, column_keys):
+        """ initialise empty table
+
+        Parameters
+        ----------
+        column_keys : list of int
+            numbers of the columns stored
+
+        """
+        self._columns = list(column_keys)
+        self._data = dict((col, []) for col in self._columns)
+        # {id: position, ...}
+        self._index = {}
+        self._ids = []
+
+    @classmethod
+    def from_dict(cls, persons, column_keys):
+        """ create table from dictionary {id: {col: value}}
+
+        Parameters
+        ----------
+        persons : dict
+            dictionary with person data
+        column_keys : list of int
+            numbers of the columns stored
+
+        """
+        table = cls(column_keys)
+        for pers_id, values in persons.items():
+            table.add(pers_id, values)
+        return table
+
+    @property
+    def column_keys(self):
+        """ numbers of the columns stored """
+        return self._columns
+
+    @property
+    def ids(self):
+        """ list of person ids in the order they were added """
+        return self._ids
+
+    def column(self, col):
+        """ list of values in column col, in the order of ids """
+        return self._data[col]
+
+    def position(self, pers_id):
+        """ position of person in the columns """
+        return self._index[pers_id]
+
+    def add(self, pers_id, values=None, default=""):
+        """ add a person, existing persons are overwritten
+
+        Parameters
+        ----------
+        pers_id : string
+            id of person
+        values : dict
+            dictionary {col: value}, missing columns are set to
+            default (default: None)
+        default :
+            value of missing columns (default: "")
+
+        Returns
+        -------
+        row : PersonRow object
+            view on the added person
+
+        """
+        if values is None:
+            values = {}
+        try:
+            index = self._index[pers_id]
+        except KeyError:
+            index = len(self._ids)
+            self._index[pers_id] = index
+            self._ids.append(pers_id)
+            for col in self._columns:
+                self._data[col].append(values.get(col, default))
+        else:
+            for col in self._columns:
+                self._data[col][index] = values.get(col, default)
+        return PersonRow(self, index)
+
+    def add_row(self, pers_id, row, first_col):
+        """ add a person from a row of cells
+
+        Parameters
+        ----------
+        pers_id : string
+            id of person
+        row : list of Cell objects
+            cells of a single row
+        first_col : int
+            column number of the first cell in row
+
+        """
+        values = {}
+        for col in self._columns:
+            try:
+                values[col] = row[col-first_col].value
+            except IndexError:
+                values[col] = None
+        self.add(pers_id, values)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, pers_id):
+        return pers_id in self._index
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, pers_id):
+        return PersonRow(self, self._index[pers_id])
+
+    def get(self, pers_id, default=None):
+        """ view on person, default if id is unknown """
+        try:
+            return self[pers_id]
+        except KeyError:
+            return default
+
+    def keys(self):
+        """ list of person ids """
+        return list(self._ids)
+
+    def items(self):
+        """ list of (id, PersonRow) pairs """
+        return [(pers_id, PersonRow(self, index))
+                for index, pers_id in enumerate(self._ids)]
+
+    def to_dict(self):
+        """ data as dictionary {id: {col: value}} """
+        return dict((pers_id, row.to_dict()) for pers_id, row in self.items())
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+pool.py -- run Master in a pool of worker processes
+
+"""
+
+import io
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from .master import Master
+from .groupcache import GroupCache
+from .report import logging_hook
+
+# group cache and request hook of a worker process, set by _init_worker()
+_group_cache = None
+_request_hook = None
+
+def _init_worker(cache_ttl, request_hook):
+    """ initialise worker process """
+    global _group_cache, _request_hook
+    if cache_ttl > 0:
+        _group_cache = GroupCache(ttl=cache_ttl)
+    _request_hook = request_hook
+
+def _on_timeout(signum, frame):
+    raise TimeoutError("Job timed out")
+
+def _call(method, settings, timeout, *args, **kwargs):
+    """ call a method of a new Master inside a worker process
+
+    the timeout is enforced with an alarm signal, so the job is
+    aborted inside the worker and Master.run removes its temporary
+    file, leaving the original file untouched. This is the only way
+    a running job is cancelled. Exceptions are passed back as their
+    arguments, as not all exceptions raised (e.g. by requests) can be
+    pickled.
+
+    Returns
+    -------
+    result : tuple
+        (return value of the method, RunReport object, process id of
+        the worker, arguments of the exception), the report hook is
+        called in the parent process. If the method failed, the return
+        value is None and the report holds the phases until the error.
+
+    """
+    master = None
+    if timeout is not None:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        master = Master(settings, group_cache=_group_cache,
+                        report_hook=lambda report: None,
+                        request_hook=_request_hook)
+        result = getattr(master, method)(*args, **kwargs)
+        error = None
+    except Exception as e:
+        result = None
+        error = e.args
+    finally:
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    report = master.report if master is not None else None
+    return result, report, os.getpid(), error
+
+def _run(settings, filename, cert, backup, refresh, timeout):
+    """ run Master.run inside a worker process """
+    return _call("run", settings, timeout, filename, cert=cert,
+                 backup=backup, refresh=refresh)
+
+def _process(settings, data, cert, refresh, timeout):
+    """ run Master.process on the bytes of a file in a worker process """
+    target, report, pid, error = _call("process", settings, timeout,
+                                       io.BytesIO(data), cert=cert,
+                                       refresh=refresh)
+    if target is not None:
+        target = target.getvalue()
+    return target, report, pid, error
+
+
+class MasterPool(object):
+    """ pool of processes running Master.run
+
+    reading and writing the xlsx files is CPU bound and holds the GIL,
+    running it in separate processes keeps the threads of a web worker
+    responsive and uses the available cores.
+
+    """
+
+    def __init__(self, max_workers=None, timeout=None, cache_ttl=0,
+                 report_hook=None, request_hook=None):
+        """ initialise pool
+
+        Parameters
+        ----------
+        max_workers : int
+            number of worker processes, None for one per core
+            (default: None)
+        timeout : float
+            seconds a job may run before it is aborted,
+            None for no limit (default: None)
+        cache_ttl : float
+            seconds group members are reused inside a worker process,
+            0 to disable (default: 0)
+        report_hook : callable
+            function called with the RunReport object of every job,
+            if None, the report is logged to the cevidblib logger
+            (default: None)
+        request_hook : callable
+            hook for the requests to the DB sent by the worker processes,
+            see cevidblib.db.observe_request(), must be picklable
+            (default: None)
+
+        """
+        self._timeout = timeout
+        if report_hook is None:
+            report_hook = logging_hook()
+        self._report_hook = report_hook
+        # process ids reported by the workers
+        self._pids = set()
+        self._pids_lock = threading.Lock()
+        # do not fork the (threaded) web worker itself
+        context = None
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+        self._pool = ProcessPoolExecutor(max_workers=max_workers,
+                                         mp_context=context,
+                                         initializer=_init_worker,
+                                         initargs=(cache_ttl, request_hook))
+
+    def run(self, settings, filename, cert=None, backup=False, refresh=False):
+        """ run Master.run in a worker process and wait for it
+
+        see cevidblib.master.Master.run() for the parameters
+
+        Raises
+        ------
+        TimeoutError
+            if the job did not finish within the timeout
+        RuntimeError
+            if the job failed
+
+        """
+        future = self._pool.submit(_run, settings, filename, cert, backup,
+                                   refresh, self._timeout)
+        return self._wait(future)
+
+    def process(self, settings, data, cert=None, refresh=False):
+        """ run Master.process in a worker process and wait for it
+
+        Parameters
+        ----------
+        settings : cevidblib.config.Settings object
+            configuration for file to process
+        data : bytes
+            content of the file to update
+        cert : string
+            certificate file used for SSL verification including path
+        refresh : bool
+            if True, members stored in the group cache are not used
+            (default: False)
+
+        Returns
+        -------
+        data : bytes
+            content of the updated file
+
+        Raises
+        ------
+        TimeoutError
+            if the job did not finish within the timeout
+        RuntimeError
+            if the job failed
+
+        """
+        future = self._pool.submit(_process, settings, data, cert, refresh,
+                                   self._timeout)
+        return self._wait(future)
+
+    def _wait(self, future):
+        """ wait for result of a job, see run() """
+        wait = None
+        if self._timeout is not None:
+            # the job aborts itself, only wait longer if the worker hangs
+            wait = self._timeout+30
+        try:
+            result, report, pid, error = future.result(timeout=wait)
+        except FutureTimeoutError:
+            # a running job cannot be cancelled from here, the worker
+            # stays busy until the alarm signal aborts it
+            raise TimeoutError("Job timed out")
+        with self._pids_lock:
+            self._pids.add(pid)
+        if report is not None:
+            # failed jobs are reported as well, with their error set
+            self._report_hook(report)
+        if error is not None:
+            raise RuntimeError(*error)
+        return result
+
+    def pids(self):
+        """ process ids of the worker processes that finished a job """
+        with self._pids_lock:
+            return sorted(self._pids)
+
+    def shutdown(self):
+        """ stop worker processes """
+        self._pool.shutdown()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+report.py -- duration of the phases and counters of an update
+
+"""
+
+import logging
+import time
+from contextlib import contextmanager
+
+
+class RunReport(object):
+    """ timings and counters of a single update
+
+    Attributes
+    ----------
+    phases : dict
+        seconds spent in each phase {name: seconds, ...}, in the
+        order the phases were entered
+    counters : dict
+        counted quantities {name: value, ...}, Master.update uses
+        rows_read, persons_fetched, persons_new, persons_changed,
+        cells_written and bytes_saved
+    error : string
+        description of the exception the update failed with,
+        None if it succeeded
+
+    """
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.error = None
+
+    @contextmanager
+    def phase(self, name):
+        """ measure the time spent in the with block
+
+        the time is added to the phase, so a phase can be
+        entered more than once
+
+        """
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + \
+                    time.perf_counter()-start
+
+    def count(self, name, value=1):
+        """ add value to counter name """
+        self.counters[name] = self.counters.get(name, 0)+value
+
+    def fail(self, exception):
+        """ mark the update as failed, the first error is kept """
+        if self.error is None:
+            self.error = "{0}: {1}".format(type(exception).__name__,
+                                           exception)
+
+    @property
+    def total(self):
+        """ seconds spent in all phases """
+        return sum(self.phases.values())
+
+    def to_dict(self):
+        """ report as dictionary, e.g. for json """
+        return {"phases": dict(self.phases), "counters": dict(self.counters),
+                "total": self.total, "error": self.error}
+
+    def __str__(self):
+        parts = ["{0}={1:.3f}s".format(name, seconds)
+                 for name, seconds in self.phases.items()]
+        parts += ["{0}={1}".format(name, value)
+                  for name, value in self.counters.items()]
+        if self.error is not None:
+            parts.append("error={0!r}".format(self.error))
+        return " ".join(parts)
+
+    def __repr__(self):
+        return "RunReport({0})".format(self)
+
+
+def logging_hook(logger=None, level=logging.INFO):
+    """ create report hook writing the report to a logger
+
+    Parameters
+    ----------
+    logger : logging.Logger object
+        logger to use, if None the logger of cevidblib is used
+        (default: None)
+    level : int
+        level of the log message (default: logging.INFO)
+
+    Returns
+    -------
+    hook : callable
+        function taking a RunReport object
+
+    """
+    if logger is None:
+        logger = logging.getLogger("cevidblib")
+
+    def hook(report):
+        if report.error is not None:
+            logger.log(max(level, logging.WARNING),
+                       "update failed after %.3fs: %s", report.total, report)
+            return
+        logger.log(level, "update finished in %.3fs: %s", report.total, report)
+    return hook
@@ -0,0 +1,718 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+xlsxpatch.py -- update person rows directly in the xlsx (zip) file
+
+"""
+
+import datetime
+import math
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, unescape
+import openpyxl
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils.datetime import to_excel
+from .filedict import sort_persons, as_table
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+CALC_CHAIN = NS_REL+"/calcChain"
+SHARED_STRINGS = NS_REL+"/sharedStrings"
+
+ROW_RE = re.compile(r'<row\b[^>]*?/>|<row\b.*?</row>', re.S)
+ROW_NR_RE = re.compile(r'^<row\b[^>]*?\br="(\d+)"')
+ROW_ATTRS_RE = re.compile(r'^<row\b([^>]*?)/?>')
+CELL_RE = re.compile(r'<c\b([^>]*?)/?>')
+FULL_CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+FORMULA_RE = re.compile(r'<f\b[^>]*?(?:/>|>.*?</f>)', re.S)
+FORMULA_REF_RE = re.compile(r'(?<![A-Za-z0-9_$])(\$?[A-Z]{1,3})(\d+)(?![\d(A-Za-z_])')
+CELL_REF_RE = re.compile(r'(<c\b[^>]*?\br=")([A-Z]+)(\d+)(")')
+REF_ATTR_RE = re.compile(r'(\b(?:ref|sqref|activeCell|topLeftCell)=")([^"]*)(")')
+COORD_RE = re.compile(r'(\$?[A-Z]{0,3}\$?)(\d+)')
+SHEET_VIEW_RE = re.compile(r'<sheetView\b([^>]*?)(/>|>(.*?)</sheetView>)', re.S)
+PANE_RE = re.compile(r'<(?:pane|selection)\b[^>]*?/>|'
+                     r'<(?:pane|selection)\b.*?</(?:pane|selection)>', re.S)
+SHEET_DATA_RE = re.compile(r'<sheetData\s*/>|<sheetData\b[^>]*>(.*)</sheetData>',
+                           re.S)
+# formulas in the other members of the zip file, group 2 is the formula
+DEFINED_NAME_RE = re.compile(r'(<definedName\b[^>]*>)(.*?)(</definedName>)', re.S)
+SHEET_FORMULA_RE = re.compile(r'(<f\b[^>]*>)(.*?)(</f>)', re.S)
+CHART_FORMULA_RE = re.compile(r'(<c:f>)(.*?)(</c:f>)', re.S)
+WORKSHEET_SOURCE_RE = re.compile(r'<worksheetSource\b[^>]*>')
+CHART_PATH_RE = re.compile(r'(^|/)charts/[^/]*\.xml$')
+
+
+class UnsupportedWorkbook(Exception):
+    """ workbook uses features the patcher can not update """
+    pass
+
+
+def attribute(tag, name):
+    """ read attribute from xml tag string, None if missing """
+    match = re.search(r'\b'+name+r'="([^"]*)"', tag)
+    if match is None:
+        return None
+    return match.group(1)
+
+
+def cell_xml(coord, value, style=None):
+    """ create xml for a single cell
+
+    Parameters
+    ----------
+    coord : string
+        cell coordinates ("A1")
+    value :
+        value of the cell, strings starting with '=' are formulas
+    style : string
+        style id of the cell (default: None)
+
+    Returns
+    -------
+    xml : string
+        xml string, empty if the cell has no value and no style
+
+    """
+    attrs = ' r="{0}"'.format(coord)
+    if style is not None:
+        attrs += ' s="{0}"'.format(style)
+    if isinstance(value, float) and not math.isfinite(value):
+        # nan and inf can not be stored in a cell
+        value = None
+    if value is None or value == "":
+        if style is None:
+            return ""
+        return "<c{0}/>".format(attrs)
+    if isinstance(value, bool):
+        return '<c{0} t="b"><v>{1}</v></c>'.format(attrs, int(value))
+    if isinstance(value, (int, float)):
+        return "<c{0}><v>{1}</v></c>".format(attrs, repr(value))
+    if isinstance(value, (datetime.datetime, datetime.date,
+                          datetime.time, datetime.timedelta)):
+        return "<c{0}><v>{1}</v></c>".format(attrs, repr(to_excel(value)))
+    # control characters are not allowed in xml
+    value = ILLEGAL_CHARACTERS_RE.sub("", str(value))
+    if value == "":
+        return cell_xml(coord, None, style)
+    if value[0] == "=":
+        return "<c{0}><f>{1}</f></c>".format(attrs, escape(value[1:]))
+    space = ""
+    if value != value.strip():
+        space = ' xml:space="preserve"'
+    return '<c{0} t="inlineStr"><is><t{1}>{2}</t></is></c>'.format(
+            attrs, space, escape(value))
+
+
+def sheet_ref_re(name):
+    """ regular expression for references to a sheet in formulas
+
+    matches e.g. Sheet!A1, 'My Sheet'!$A$1:$B$2 or Sheet!3:5 in the
+    (xml escaped) text of a formula, group 1 is the sheet name with
+    the exclamation mark, group 2 the cells. References to whole
+    columns do not need to be moved and are not matched.
+
+    Parameters
+    ----------
+    name : string
+        name of the sheet
+
+    """
+    names = [re.escape(escape("'"+name.replace("'", "''")+"'"))]
+    if re.fullmatch(r'[A-Za-z_][\w.]*', name):
+        names.append(re.escape(name))
+    coord = r'\$?[A-Z]{0,3}\$?\d+'
+    return re.compile(r"(?<![\w.'])((?:{0})!)({1}(?::{1})?)(?![\w(])".format(
+            "|".join(names), coord))
+
+def cell_text(cell, strings):
+    """ value of a cell as string, as read for the person ids
+
+    Parameters
+    ----------
+    cell : tuple
+        (attributes, content) of the cell xml, None for a missing cell
+    strings : list
+        shared strings of the workbook
+
+    """
+    if cell is None or cell[1] is None:
+        return None
+    kind = attribute(cell[0], "t")
+    if kind == "inlineStr":
+        return unescape("".join(re.findall(r'<t\b[^>]*>(.*?)</t>', cell[1],
+                                           re.S)))
+    match = re.search(r'<v>(.*?)</v>', cell[1], re.S)
+    if match is None:
+        return None
+    if kind == "s":
+        return strings[int(match.group(1))]
+    return unescape(match.group(1))
+
+
+def row_attributes(row):
+    """ attributes of a row tag except its number and spans """
+    attrs = ROW_ATTRS_RE.match(row).group(1)
+    return re.sub(r'\s+(?:r|spans)="[^"]*"', "", attrs)
+
+
+def move_cell(attrs, content, old_nr, new_nr):
+    """ xml of a cell moved from row old_nr to new_nr
+
+    relative references to the own row in formulas are moved as well
+
+    """
+    attrs = re.sub(r'(\br="[A-Z]+)\d+(")',
+                   lambda m: m.group(1)+str(new_nr)+m.group(2), attrs)
+    if content is None:
+        return "<c{0}/>".format(attrs)
+
+    def move_ref(match):
+        if int(match.group(2)) == old_nr:
+            return match.group(1)+str(new_nr)
+        return match.group(0)
+
+    def move_formula(match):
+        tag, _, rest = match.group(0).partition(">")
+        tag = re.sub(r'(\bref=")([^"]*)(")', lambda m: m.group(1) +
+                     FORMULA_REF_RE.sub(move_ref, m.group(2))+m.group(3), tag)
+        return tag+">"+FORMULA_REF_RE.sub(move_ref, rest) if rest else tag+">"
+
+    if old_nr != new_nr:
+        content = FORMULA_RE.sub(move_formula, content)
+    return "<c{0}>{1}</c>".format(attrs, content)
+
+class XlsxPatcher(object):
+    """ class to write CeviDB data directly into the xlsx file
+
+    instead of creating a new workbook, the xml of the active sheet
+    is changed: the person rows are replaced and the rows below are
+    moved. References to the moved rows from defined names, other
+    sheets, charts and pivot caches are moved as well. All other
+    members of the zip file (styles, shared strings, ...) are copied
+    unchanged, so formatting and cells outside the configured columns
+    are kept.
+
+    New strings are written as inline strings, so the shared strings
+    do not need to be changed.
+    """
+
+    def __init__(self, config, new_name, reader):
+        """ initialise writer object and analyse old file
+
+        Parameters
+        ----------
+        config : cevidblib.config.Settings object
+            configuration for file to write (and read)
+        new_name : string or file-like object
+            filename for new file (including path)
+        reader : XlsxReader object
+            reader object with  old file loaded
+
+        Raises
+        ------
+        UnsupportedWorkbook
+            if the active sheet can not be updated in place
+
+        """
+        self._cfg = config
+        self._filename = new_name
+        self._old_file = reader
+        self._start_persons = self._cfg.header_lines+1
+        self._start_footer = -1
+        self._old_start_footer = reader.start_footer
+        self._person_rows = []
+
+        try:
+            with zipfile.ZipFile(reader.filename) as zin:
+                self._sheet_path, self._calc_chain, shared_strings = \
+                        self._find_sheet(zin)
+                sheet = zin.read(self._sheet_path).decode("utf-8")
+                strings = []
+                if shared_strings is not None:
+                    strings = self._shared_strings(zin.read(shared_strings))
+                self._check_other_sheets(zin)
+        except (KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+            raise UnsupportedWorkbook("Could not read workbook: "+str(e))
+        match = SHEET_DATA_RE.search(sheet)
+        if match is None:
+            raise UnsupportedWorkbook("No sheetData found")
+        if 't="shared"' in sheet:
+            raise UnsupportedWorkbook("Shared formulas are not supported")
+        if "<tableParts" in sheet:
+            raise UnsupportedWorkbook("Tables are not supported")
+        self._prefix = sheet[:match.start()]
+        self._suffix = sheet[match.end():]
+        self._rows = []
+        for row in ROW_RE.findall(match.group(1) or ""):
+            row_nr = ROW_NR_RE.match(row)
+            if row_nr is None:
+                raise UnsupportedWorkbook("Rows without number")
+            self._rows.append((int(row_nr.group(1)), row))
+            if int(row_nr.group(1)) >= self._old_start_footer \
+                    and FORMULA_RE.search(row) is not None:
+                # the references to the person rows would not be moved
+                raise UnsupportedWorkbook(
+                        "Formulas below the persons are not supported")
+        self._styles = self._column_styles()
+        self._old_persons = self._read_persons(strings)
+
+    def _check_other_sheets(self, zin):
+        """ raise UnsupportedWorkbook if references can not be moved
+
+        shared formulas in other sheets referring to the active sheet
+        can not be moved, as the formulas of the other cells are derived
+        from the first one
+        """
+        for path in self._other_sheets:
+            sheet = zin.read(path).decode("utf-8")
+            if 't="shared"' not in sheet:
+                continue
+            for match in SHEET_FORMULA_RE.finditer(sheet):
+                if 't="shared"' in match.group(1) \
+                        and self._ref_re.search(match.group(2)):
+                    raise UnsupportedWorkbook(
+                            "Shared formulas referring to the sheet are "
+                            "not supported")
+
+    def _find_sheet(self, zin):
+        """ find path of active sheet and of the calculation chain
+
+        Parameters
+        ----------
+        zin : zipfile.ZipFile object
+            opened old file
+
+        Returns
+        -------
+        sheet_path : string
+            path of the active sheet inside the zip file
+        calc_chain : string or None
+            path of the calculation chain, None if there is none
+        shared_strings : string or None
+            path of the shared strings, None if there are none
+
+        The paths of the workbook and the other sheets, the name of the
+        active sheet and a regular expression for references to it (see
+        sheet_ref_re()) are stored in the object.
+
+        """
+        root_rels = ET.fromstring(zin.read("_rels/.rels"))
+        workbook_path = None
+        for rel in root_rels.iter("{%s}Relationship" % NS_PKG_REL):
+            if rel.get("Type") == NS_REL+"/officeDocument":
+                workbook_path = rel.get("Target").lstrip("/")
+        if workbook_path is None:
+            raise UnsupportedWorkbook("No workbook found")
+        base = posixpath.dirname(workbook_path)
+        rels_path = posixpath.join(base, "_rels",
+                                   posixpath.basename(workbook_path)+".rels")
+        targets = {}
+        calc_chain = None
+        shared_strings = None
+        for rel in ET.fromstring(zin.read(rels_path)).iter(
+                "{%s}Relationship" % NS_PKG_REL):
+            target = rel.get("Target")
+            if target.startswith("/"):
+                target = target.lstrip("/")
+            else:
+                target = posixpath.normpath(posixpath.join(base, target))
+            targets[rel.get("Id")] = target
+            if rel.get("Type") == CALC_CHAIN:
+                calc_chain = target
+            elif rel.get("Type") == SHARED_STRINGS:
+                shared_strings = target
+
+        workbook = ET.fromstring(zin.read(workbook_path))
+        active = 0
+        view = workbook.find("{%s}bookViews/{%s}workbookView" % (NS_MAIN, NS_MAIN))
+        if view is not None:
+            active = int(view.get("activeTab", 0))
+        sheets = workbook.findall("{%s}sheets/{%s}sheet" % (NS_MAIN, NS_MAIN))
+        try:
+            rel_id = sheets[active].get("{%s}id" % NS_REL)
+        except IndexError:
+            raise UnsupportedWorkbook("Active sheet not found")
+        self._workbook_path = workbook_path
+        self._sheet_name = sheets[active].get("name")
+        self._ref_re = sheet_ref_re(self._sheet_name)
+        self._other_sheets = [targets[sheet.get("{%s}id" % NS_REL)]
+                              for sheet in sheets
+                              if sheet.get("{%s}id" % NS_REL) != rel_id]
+        return targets[rel_id], calc_chain, shared_strings
+
+    def _shared_strings(self, data):
+        """ list of the shared strings (without formatting) """
+        strings = []
+        for item in ET.fromstring(data).iter("{%s}si" % NS_MAIN):
+            strings.append("".join(
+                    text.text or "" for text in item.iter("{%s}t" % NS_MAIN)))
+        return strings
+
+    def _read_persons(self, strings):
+        """ attributes and cells of the old person rows
+
+        Parameters
+        ----------
+        strings : list
+            shared strings of the workbook
+
+        Returns
+        -------
+        persons : dict
+            dictionary mapping ids to (row number, row attributes,
+            {col: (cell attributes, cell content)})
+
+        """
+        id_col = self._cfg.get_column_key("id")
+        persons = {}
+        for row_nr, row in self._rows:
+            if row_nr < self._start_persons:
+                continue
+            if row_nr >= self._old_start_footer:
+                break
+            cells = {}
+            for match in FULL_CELL_RE.finditer(row):
+                coord = attribute(match.group(1), "r")
+                if coord is None:
+                    raise UnsupportedWorkbook("Cells without reference")
+                col = openpyxl.utils.cell.coordinate_from_string(coord)[0]
+                cells[openpyxl.utils.column_index_from_string(col)] = \
+                        (match.group(1), match.group(2))
+            pers_id = cell_text(cells.get(id_col), strings)
+            if pers_id is not None and pers_id not in persons:
+                persons[pers_id] = (row_nr, row_attributes(row), cells)
+        return persons
+
+    def _column_styles(self):
+        """ style ids of the cells in the first old person row
+
+        Returns
+        -------
+        styles : dict
+            dictionary mapping column numbers to style ids
+
+        """
+        styles = {}
+        for row_nr, row in self._rows:
+            if row_nr < self._start_persons:
+                continue
+            if row_nr < self._old_start_footer:
+                for match in CELL_RE.finditer(row):
+                    coord = attribute(match.group(1), "r")
+                    style = attribute(match.group(1), "s")
+                    if coord is None or style is None:
+                        continue
+                    col = openpyxl.utils.cell.coordinate_from_string(coord)[0]
+                    styles[openpyxl.utils.column_index_from_string(col)] = style
+            break
+        return styles
+
+    @property
+    def style_count(self):
+        """ number of distinct styles written in the person rows """
+        return len(set(self._styles.values()))
+
+    def _shift_row(self, row_nr, end=False):
+        """ new number of a row from the old file
+
+        rows below the persons are moved by the change in the number
+        of persons. The end of a range ending on the last person row
+        is moved as well, so ranges covering all persons grow.
+
+        Parameters
+        ----------
+        row_nr : int
+            number of row in old file
+        end : bool
+            True if row_nr is the end of a range (default: False)
+
+        """
+        delta = self._start_footer-self._old_start_footer
+        if row_nr >= self._old_start_footer:
+            return row_nr+delta
+        if end and row_nr == self._old_start_footer-1 \
+                and row_nr >= self._start_persons:
+            return row_nr+delta
+        return row_nr
+
+    def _shift_ref(self, ref):
+        """ move all rows in a reference (e.g. "A1:B9 D3") """
+        ranges = []
+        for part in ref.split(" "):
+            coords = part.split(":")
+            shifted = []
+            for nr, coord in enumerate(coords):
+                match = COORD_RE.fullmatch(coord)
+                if match is None:
+                    shifted.append(coord)
+                    continue
+                row_nr = self._shift_row(int(match.group(2)),
+                                         end=(nr == len(coords)-1 and nr > 0))
+                shifted.append(match.group(1)+str(row_nr))
+            ranges.append(":".join(shifted))
+        return " ".join(ranges)
+
+    def _shift_refs(self, xml):
+        """ move rows in all references of a xml string """
+        return REF_ATTR_RE.sub(
+                lambda m: m.group(1)+self._shift_ref(m.group(2))+m.group(3),
+                xml)
+
+    def _shift_formulas(self, xml, formula_re):
+        """ move rows in references to the active sheet in formulas
+
+        Parameters
+        ----------
+        xml : string
+            content of a member of the zip file
+        formula_re : regular expression
+            matches the formulas in xml, group 2 is the formula
+
+        """
+        def shift_sheet_ref(match):
+            return match.group(1)+self._shift_ref(match.group(2))
+
+        return formula_re.sub(
+                lambda m: m.group(1)+self._ref_re.sub(shift_sheet_ref,
+                                                      m.group(2))+m.group(3),
+                xml)
+
+    def _shift_sources(self, xml):
+        """ move rows in pivot cache sources on the active sheet """
+        def shift_source(match):
+            tag = match.group(0)
+            if unescape(attribute(tag, "sheet") or "") != self._sheet_name:
+                return tag
+            return self._shift_refs(tag)
+        return WORKSHEET_SOURCE_RE.sub(shift_source, xml)
+
+    def _patch_member(self, path, data):
+        """ move references to the active sheet in another member
+
+        Returns
+        -------
+        data : bytes
+            updated content, data itself if nothing needs to be moved
+
+        """
+        if self._start_footer == self._old_start_footer:
+            return data
+        if path == self._workbook_path:
+            formula_re = DEFINED_NAME_RE
+        elif path in self._other_sheets:
+            formula_re = SHEET_FORMULA_RE
+        elif CHART_PATH_RE.search(path):
+            formula_re = CHART_FORMULA_RE
+        elif "pivotCacheDefinition" in path and not path.endswith(".rels"):
+            return self._shift_sources(data.decode("utf-8")).encode("utf-8")
+        else:
+            return data
+        return self._shift_formulas(data.decode("utf-8"),
+                                    formula_re).encode("utf-8")
+
+    def _move_row(self, row_nr, row):
+        """ xml of row from old file at its new position """
+        new_nr = self._shift_row(row_nr)
+        if new_nr == row_nr:
+            return row
+        row = re.sub(r'^(<row\b[^>]*?\br=")\d+(")',
+                     lambda m: m.group(1)+str(new_nr)+m.group(2), row)
+        row = CELL_REF_RE.sub(
+                lambda m: m.group(1)+m.group(2)+str(new_nr)+m.group(4), row)
+        return self._shift_refs(row)
+
+    def pane_xml(self):
+        """ xml for the frozen pane below header and after freeze column
+
+        see openpyxl.worksheet.worksheet.Worksheet.freeze_panes
+        """
+        col = openpyxl.utils.column_index_from_string(self._cfg.freeze_column)
+        row = self._start_persons
+        top_left = self._cfg.freeze_column+str(row)
+        if col == 1 and row == 1:
+            return ""
+        attrs = ""
+        if col > 1:
+            attrs += ' xSplit="{0}"'.format(col-1)
+        if row > 1:
+            attrs += ' ySplit="{0}"'.format(row-1)
+        selection = '<selection pane="{0}" activeCell="{1}" sqref="{1}"/>'
+        if col > 1 and row > 1:
+            active = "bottomRight"
+            selections = ('<selection pane="topRight"/>'
+                          '<selection pane="bottomLeft"/>')
+        elif col > 1:
+            active = "topRight"
+            selections = ""
+        else:
+            active = "bottomLeft"
+            selections = ""
+        selections += selection.format(active, top_left)
+        return ('<pane{0} topLeftCell="{1}" activePane="{2}" state="frozen"/>'
+                .format(attrs, top_left, active)+selections)
+
+    def _freeze(self, prefix):
+        """ replace pane of the first sheet view with the frozen pane
+
+        like the other writers, the view is frozen below the header
+        and after the column set in the configuration
+        """
+        pane = self.pane_xml()
+        match = SHEET_VIEW_RE.search(prefix)
+        if match is None:
+            view = '<sheetViews><sheetView workbookViewId="0">{0}' \
+                   '</sheetView></sheetViews>'.format(pane)
+            # sheetViews comes before sheetFormatPr and cols
+            pos = len(prefix)
+            for tag in ("<sheetFormatPr", "<cols"):
+                found = prefix.find(tag)
+                if found >= 0:
+                    pos = min(pos, found)
+            return prefix[:pos]+view+prefix[pos:]
+        content = PANE_RE.sub("", match.group(3) or "")
+        view = "<sheetView{0}>{1}{2}</sheetView>".format(
+                match.group(1), pane, content)
+        return prefix[:match.start()]+view+prefix[match.end():]
+
+    def sorted_ids(self, persons):
+        """ list of person ids in the order they are written
+
+        Parameters
+        ----------
+        persons: PersonTable or dict
+            person data
+
+        """
+        return sort_persons(self._cfg, persons)
+
+    def write_persons(self, persons):
+        """ create xml for the person rows
+
+        existing persons keep the attributes of their old row (e.g.
+        height or hidden) and the cells outside the configured columns,
+        new persons get the height and style of the first old row
+
+        Parameters
+        ----------
+        persons: PersonTable or dict
+            person data
+
+        """
+        persons = as_table(self._cfg, persons)
+        columns = [(col, persons.column(col), self._cfg.columns[col])
+                   for col in self._cfg.column_keys]
+        self._person_rows = []
+        letters = dict((col, openpyxl.utils.get_column_letter(col))
+                       for col in self._cfg.column_keys)
+        new_attrs = self._new_row_attributes()
+        for nr, pers_id in enumerate(self.sorted_ids(persons)):
+            row = nr+self._start_persons
+            index = persons.position(pers_id)
+            old_nr, attrs, old_cells = self._old_persons.get(
+                    pers_id, (None, new_attrs, {}))
+            cells = {}
+            for col, (cell_attrs, content) in old_cells.items():
+                if col not in self._cfg.columns:
+                    cells[col] = move_cell(cell_attrs, content, old_nr, row)
+            for col, column, col_config in columns:
+                val = column[index]
+                # recreate formulas
+                if col_config.group == "formula":
+                    val = col_config.value.format(row=row, col=col)
+                style = self._styles.get(col)
+                if col in old_cells:
+                    style = attribute(old_cells[col][0], "s")
+                coord = letters[col]+str(row)
+                cells[col] = cell_xml(coord, val, style)
+            self._person_rows.append('<row r="{0}"{1}>{2}</row>'.format(
+                    row, attrs, "".join(cells[col] for col in sorted(cells))))
+        self._start_footer = self._start_persons+len(persons)
+
+    def _new_row_attributes(self):
+        """ height and style of the first old person row for new rows """
+        for row_nr, attrs, cells in sorted(self._old_persons.values()):
+            return "".join(" "+match.group(0) for match in re.finditer(
+                    r'\b(?:ht|customHeight|s|customFormat)="[^"]*"', attrs))
+        return ""
+
+    def fill(self, persons):
+        """ helper function to fill a file
+
+        the header and footer are kept from the old file,
+        only the person rows are created
+
+        Parameters
+        ----------
+        persons: PersonTable or dict
+            person data
+
+        """
+        self.write_persons(persons)
+
+    def sheet_xml(self):
+        """ xml of the updated sheet """
+        if self._start_footer < self._start_persons:
+            raise RuntimeError("start of footer not defined")
+        rows = []
+        persons_written = False
+        for row_nr, row in self._rows:
+            if row_nr < self._start_persons:
+                rows.append(row)
+                continue
+            if not persons_written:
+                rows.extend(self._person_rows)
+                persons_written = True
+            if row_nr >= self._old_start_footer:
+                rows.append(self._move_row(row_nr, row))
+        if not persons_written:
+            rows.extend(self._person_rows)
+        return "".join([
+                self._freeze(self._shift_refs(self._prefix)),
+                "<sheetData>", "".join(rows), "</sheetData>",
+                self._shift_refs(self._suffix),
+                ])
+
+    def save(self):
+        """ save updated file
+
+        references to moved rows in other members are moved (see
+        _patch_member()), all other members are copied unchanged. The
+        calculation chain is dropped as it lists the old cells
+        """
+        sheet = self.sheet_xml().encode("utf-8")
+        with zipfile.ZipFile(self._old_file.filename) as zin, \
+                zipfile.ZipFile(self._filename, "w",
+                                zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                if info.filename == self._calc_chain:
+                    continue
+                data = zin.read(info)
+                if info.filename == self._sheet_path:
+                    data = sheet
+                else:
+                    data = self._patch_member(info.filename, data)
+                if self._calc_chain is not None and \
+                        (info.filename == "[Content_Types].xml" or
+                         info.filename.endswith(".rels")):
+                    data = self._drop_calc_chain(data)
+                zout.writestr(info, data)
+
+    def _drop_calc_chain(self, data):
+        """ remove references to the calculation chain """
+        text = data.decode("utf-8")
+        name = posixpath.basename(self._calc_chain)
+        text = re.sub(r'<Override\b[^>]*PartName="/' +
+                      re.escape(self._calc_chain)+r'"[^>]*/>', "", text)
+        text = re.sub(r'<Relationship\b[^>]*Target="[^"]*' +
+                      re.escape(name)+r'"[^>]*/>', "", text)
+        return text.encode("utf-8")
@@ -0,0 +1,296 @@
+""" background jobs for uploads
+
+uploads are stored as jobs in a SQLite database in the instance
+folder and processed by a bounded pool of worker threads. The
+state of the jobs survives restarts of the WSGI processes.
+"""
+
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .cevidblib.master import Master
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+# (pid, token) of the current process, see process_token()
+_process_token = None
+
+
+def pid_alive(pid):
+    """ check if a process with the given pid is running """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def process_start(pid):
+    """ start time of a process in clock ticks after boot
+
+    None if it cannot be read (e.g. not on Linux)
+    """
+    try:
+        with open("/proc/{0}/stat".format(pid)) as stat:
+            # the name in parentheses may contain spaces, the
+            # start time is the 22nd field
+            return stat.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def process_token():
+    """ token identifying the current process
+
+    the token is "pid:start time" (a random id if the start time
+    is unknown), so a later process with the same pid (e.g. pid 1
+    after a restart of a container) gets a different token
+    """
+    global _process_token
+    pid = os.getpid()
+    if _process_token is None or _process_token[0] != pid:
+        start = process_start(pid) or uuid.uuid4().hex
+        _process_token = (pid, "{0}:{1}".format(pid, start))
+    return _process_token[1]
+
+
+def process_alive(token):
+    """ check if the process identified by token is running
+
+    Parameters
+    ----------
+    token : string
+        token returned by process_token() in the process, a bare pid
+        for jobs stored by earlier versions
+    """
+    if token == process_token():
+        return True
+    pid, _, start = token.partition(":")
+    pid = int(pid)
+    if pid == os.getpid() or not pid_alive(pid):
+        return False
+    current = process_start(pid)
+    return start == "" or current is None or current == start
+
+
+class Job(object):
+    """ struct representing a row from the jobs table """
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.user = row["user"]
+        self.config = row["config"]
+        self.status = row["status"]
+        self.message = row["message"]
+        self.filename = row["filename"]
+        self.download_name = row["download_name"]
+        self.refresh = bool(row["refresh"])
+        self.pid = row["pid"]
+        self.owner = row["owner"]
+        self.created = row["created"]
+        self.updated = row["updated"]
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+
+class JobStore(object):
+    """ jobs stored in a SQLite database
+
+    every call opens its own connection, so the store can be
+    used from several threads and processes
+    """
+
+    def __init__(self, path):
+        self._path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user TEXT NOT NULL,
+                config TEXT NOT NULL,
+                status TEXT NOT NULL,
+                message TEXT NOT NULL DEFAULT '',
+                filename TEXT NOT NULL,
+                download_name TEXT NOT NULL,
+                refresh INTEGER NOT NULL DEFAULT 0,
+                pid INTEGER NOT NULL,
+                owner TEXT NOT NULL DEFAULT '',
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+                )""")
+            columns = [row["name"] for row
+                       in conn.execute("PRAGMA table_info(jobs)")]
+            if "owner" not in columns:
+                # stores created before the owner token was added
+                conn.execute("ALTER TABLE jobs"
+                             " ADD COLUMN owner TEXT NOT NULL DEFAULT ''")
+
+    def _connect(self):
+        conn = sqlite3.connect(self._path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, user, config, filename, download_name, refresh=False,
+               job_id=None):
+        """ add a new queued job and return it """
+        if job_id is None:
+            job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, user, config, status, filename,"
+                " download_name, refresh, pid, owner, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, user, config, QUEUED, filename, download_name,
+                 int(refresh), os.getpid(), process_token(), now, now))
+        return self.get(job_id)
+
+    def get(self, job_id):
+        """ get job by id, None if it does not exist """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?",
+                               (job_id,)).fetchone()
+        if row is None:
+            return None
+        return Job(row)
+
+    def update(self, job_id, status, message=""):
+        """ set status and message of a job """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, updated = ?"
+                " WHERE id = ?", (status, message, time.time(), job_id))
+
+    def claim_orphans(self):
+        """ take over unfinished jobs of processes no longer running
+
+        the owner is compared by process_token(), so the jobs of an
+        earlier process with the same pid are taken over as well
+
+        Returns
+        -------
+        jobs : list of Job objects
+            jobs now belonging to the current process
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id, pid, owner FROM jobs WHERE status IN (?, ?)",
+                (QUEUED, RUNNING)).fetchall()
+        claimed = []
+        for row in rows:
+            if process_alive(row["owner"] or str(row["pid"])):
+                continue
+            with self._connect() as conn:
+                cur = conn.execute(
+                    "UPDATE jobs SET pid = ?, owner = ?, status = ?,"
+                    " updated = ? WHERE id = ? AND pid = ? AND owner = ?",
+                    (os.getpid(), process_token(), QUEUED, time.time(),
+                     row["id"], row["pid"], row["owner"]))
+            if cur.rowcount == 1:
+                claimed.append(self.get(row["id"]))
+        return claimed
+
+    def count_by_status(self):
+        """ number of jobs per status {status: count, ...} """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict((row[0], row[1]) for row in rows)
+
+    def expired(self, max_age):
+        """ finished jobs last updated more than max_age seconds ago """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) AND updated < ?",
+                (DONE, FAILED, time.time()-max_age)).fetchall()
+        return [Job(row) for row in rows]
+
+    def delete(self, job_id):
+        """ remove job from store """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+class JobQueue(object):
+    """ bounded pool of worker threads processing jobs """
+
+    def __init__(self, store, settings, group_cache=None, max_workers=2,
+                 logger=None, master_pool=None, report_hook=None,
+                 request_hook=None):
+        """ initialise queue
+
+        Parameters
+        ----------
+        store : JobStore object
+            store holding the jobs
+        settings : cevidblib.config.SettingsRegistry object
+            registry used to load the config of a job
+        group_cache : cevidblib.groupcache.GroupCache object
+            cache passed to Master (default: None)
+        max_workers : int
+            number of jobs processed at the same time (default: 2)
+        logger : logging.Logger object
+            logger for failed jobs (default: None)
+        master_pool : cevidblib.pool.MasterPool object
+            if given, Master runs in a worker process of this pool
+            instead of the worker thread (default: None)
+        report_hook : callable
+            function called with the RunReport object of every job
+            run in a worker thread (default: None)
+        request_hook : callable
+            function called after every request to the DB sent by a
+            worker thread (default: None)
+        """
+        self._store = store
+        self._settings = settings
+        self._group_cache = group_cache
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._logger = logger
+        self._master_pool = master_pool
+        self._report_hook = report_hook
+        self._request_hook = request_hook
+
+    def submit(self, job):
+        """ queue job for processing """
+        return self._pool.submit(self.process, job.id)
+
+    def recover(self):
+        """ queue unfinished jobs of processes no longer running """
+        for job in self._store.claim_orphans():
+            self.submit(job)
+
+    def process(self, job_id):
+        """ run Master for a job and store the result """
+        job = self._store.get(job_id)
+        if job is None or job.finished:
+            return
+        self._store.update(job_id, RUNNING)
+        try:
+            settings = self._settings.get(job.config)
+            if self._master_pool is not None:
+                self._master_pool.run(settings, job.filename,
+                                      refresh=job.refresh)
+            else:
+                master = Master(settings=settings,
+                                group_cache=self._group_cache,
+                                report_hook=self._report_hook,
+                                request_hook=self._request_hook)
+                master.run(job.filename, cert=None, backup=False,
+                           refresh=job.refresh)
+        except Exception as e:
+            if self._logger is not None:
+                self._logger.exception("job %s failed", job_id)
+            self._store.update(job_id, FAILED, str(e.args))
+        else:
+            self._store.update(job_id, DONE)
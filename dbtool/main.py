@@ -6,17 +6,25 @@ from flask import (
     url_for,
     flash,
     current_app,
-    send_file
+    send_file,
+    abort,
+    jsonify,
+    g,
+    Response
 )
 from flask_login import login_user, login_required, current_user, UserMixin
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileRequired, FileAllowed
-from wtforms import FileField, StringField, PasswordField
+from wtforms import FileField, StringField, PasswordField, BooleanField
 from wtforms.validators import DataRequired
+from . import jobs
 from .cevidblib.master import Master
-from .cevidblib.config import Settings
+import io
 import os
+import shutil
+import time
 import datetime
+import uuid
 import requests
 import json
 
@@ -28,11 +36,29 @@ class FileForm(FlaskForm):
     #user_ = StringField("User", validators=[DataRequired()])
     #pass_ = PasswordField("Pass", validators=[DataRequired()])
     file_ = FileField("Datei", validators=[FileRequired(), FileAllowed(['xlsx'], "Nur XLSX Dateien erlaubt")])
+    refresh = BooleanField("Daten neu aus der CeviDB laden")
 
 
 class User(UserMixin):
     pass
 
+@bp.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@bp.after_app_request
+def record_duration(response):
+    """ add duration of request to the metrics of its route """
+    start = g.get("request_start")
+    if start is not None:
+        route = "unmatched"
+        if request.url_rule is not None:
+            route = request.url_rule.rule
+        current_app.config["METRICS"].observe(
+                "dbtool_request_duration_seconds",
+                time.perf_counter()-start, {"route": route})
+    return response
+
 @bp.route('/login')
 def oauth_login():
     provider = current_app.config["OAUTH"]["provider"]
@@ -83,7 +109,6 @@ def handle_callback():
     current_app.logger.warning("login failed")
     return render_template('main/denied.html', user=user.id), 403
 
-
 @bp.route('/', methods=('GET', 'POST'))
 @login_required
 def index():
@@ -94,20 +119,84 @@ def index():
         if user_ in current_app.config["USER"]:
             current_app.logger.debug("user ok")
             file_ = form.file_.data
-            filename = f"{user_}.xlsx"
-            fullname = os.path.join(current_app.config["TMP_PATH"], filename)
+            if current_app.config["IN_MEMORY"]:
+                response = process_upload(file_, current_app.config["USER"][user_],
+                                          f"{user_}.xlsx", form.refresh.data)
+                if response is not None:
+                    return response
+                return render_template('main/page.html', form=form)
+            job_id = uuid.uuid4().hex
+            # every job works in its own directory, so uploads of the
+            # same user can be processed at the same time
+            workdir = os.path.join(current_app.config["JOB_PATH"], job_id)
+            os.makedirs(workdir)
+            fullname = os.path.join(workdir, "upload.xlsx")
             file_.save(fullname)
-            try:
-                master = Master(settings=Settings(current_app.config["USER"][user_]))
-                master.run(fullname, cert=None, backup=False)
-                return send_file(fullname, as_attachment=True, download_name=filename)
-            except Exception as e:
-                flash("Error: "+str(e.args), "danger")
-            return redirect(url_for('main.index'))
+            current_app.config["METRICS"].observe(
+                    "dbtool_upload_bytes", os.path.getsize(fullname))
+            job = current_app.config["JOB_STORE"].create(
+                    user_, current_app.config["USER"][user_], fullname,
+                    f"{user_}.xlsx", refresh=form.refresh.data, job_id=job_id)
+            current_app.config["JOB_QUEUE"].submit(job)
+            return redirect(url_for('main.job', job_id=job.id))
     else:
         current_app.logger.error("invalid from submission")
     return render_template('main/page.html', form=form)
 
+def process_upload(file_, config, download_name, refresh=False):
+    """ update uploaded file in memory and send it back
+
+    returns None if the update failed
+    """
+    data = file_.read()
+    current_app.config["METRICS"].observe("dbtool_upload_bytes", len(data))
+    try:
+        settings = current_app.config["SETTINGS"].get(config)
+        pool = current_app.config["MASTER_POOL"]
+        if pool is not None:
+            output = io.BytesIO(pool.process(settings, data, refresh=refresh))
+        else:
+            master = Master(settings=settings,
+                            group_cache=current_app.config["GROUP_CACHE"],
+                            report_hook=current_app.config["REPORT_HOOK"],
+                            request_hook=current_app.config["METRICS"].db_request)
+            output = master.process(io.BytesIO(data), cert=None,
+                                    refresh=refresh)
+    except Exception as e:
+        current_app.logger.exception("processing upload failed")
+        flash("Error: "+str(e.args), "danger")
+        return None
+    return send_file(output, as_attachment=True, download_name=download_name)
+
+def get_job(job_id):
+    """ load job of current user or abort with 404 """
+    job = current_app.config["JOB_STORE"].get(job_id)
+    if job is None or job.user != current_user.id:
+        abort(404)
+    return job
+
+@bp.route('/job/<job_id>')
+@login_required
+def job(job_id):
+    return render_template('main/job.html', job=get_job(job_id))
+
+@bp.route('/job/<job_id>/status')
+@login_required
+def job_status(job_id):
+    job = get_job(job_id)
+    status = {"status": job.status, "message": job.message}
+    if job.status == jobs.DONE:
+        status["download"] = url_for('main.job_download', job_id=job.id)
+    return jsonify(status)
+
+@bp.route('/job/<job_id>/download')
+@login_required
+def job_download(job_id):
+    job = get_job(job_id)
+    if job.status != jobs.DONE:
+        abort(404)
+    return send_file(job.filename, as_attachment=True, download_name=job.download_name)
+
 @bp.route('/cleanup')
 def cleanup():
     """ cleanup old datafiles
@@ -120,8 +209,31 @@ def cleanup():
         if datetime.datetime.fromtimestamp(os.path.getctime(fullfile)) < ref_time:
             os.remove(fullfile)
 
+    store = current_app.config["JOB_STORE"]
+    for job in store.expired(current_app.config["JOB_MAX_AGE"]):
+        workdir = os.path.dirname(job.filename)
+        if os.path.basename(workdir) == job.id:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            # job created before the per-job directories
+            try:
+                os.remove(job.filename)
+            except FileNotFoundError:
+                pass
+        store.delete(job.id)
+
+    current_app.config["METRICS"].compact()
     return "OK"
 
+@bp.route('/metrics')
+def metrics():
+    """ metrics of all processes in the Prometheus text format """
+    counts = current_app.config["JOB_STORE"].count_by_status()
+    gauges = dict((("dbtool_jobs", (("status", status),)), counts.get(status, 0))
+                  for status in (jobs.QUEUED, jobs.RUNNING))
+    return Response(current_app.config["METRICS"].render(gauges),
+                    mimetype="text/plain; version=0.0.4")
+
 #TODO:
 #  - propper layout/css
 
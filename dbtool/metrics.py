@@ -0,0 +1,313 @@
+""" metrics of the web app in the Prometheus text format
+
+every process keeps its own samples in memory and a background thread
+writes them to a file in a shared directory every few seconds. The
+/metrics endpoint adds up the files of all processes, so every WSGI
+process answers a scrape with the same values.
+"""
+
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from .jobs import process_alive, process_token
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                30, 60)
+SIZE_BUCKETS = (10000, 30000, 100000, 300000, 1000000, 3000000, 10000000)
+
+# {name: (type, help, buckets), ...}
+METRICS = {
+    "dbtool_request_duration_seconds": (
+        "histogram", "Duration of HTTP requests by route", TIME_BUCKETS),
+    "dbtool_upload_bytes": (
+        "histogram", "Size of uploaded files", SIZE_BUCKETS),
+    "dbtool_phase_duration_seconds": (
+        "histogram", "Duration of the phases of an update", TIME_BUCKETS),
+    "dbtool_updates_total": (
+        "counter", "Updates by result (ok or failed)", None),
+    "cevidb_requests_total": (
+        "counter", "Requests sent to the CeviDB by endpoint and status", None),
+    "cevidb_request_duration_seconds": (
+        "histogram", "Duration of requests sent to the CeviDB", TIME_BUCKETS),
+    "dbtool_jobs": (
+        "gauge", "Upload jobs by status", None),
+}
+
+# file holding the samples of processes no longer running
+ARCHIVE = "archive.json"
+
+# seconds between two writes of the samples of a process
+FLUSH_INTERVAL = 5
+
+logger = logging.getLogger(__name__)
+
+
+def label_key(labels):
+    """ hashable key for a dictionary of labels """
+    return tuple(sorted((labels or {}).items()))
+
+
+def format_labels(labels):
+    """ labels in the text format, e.g. {route="/",status="200"} """
+    if len(labels) == 0:
+        return ""
+    escaped = ['{0}="{1}"'.format(key, str(value).replace("\\", "\\\\")
+                                  .replace('"', '\\"').replace("\n", "\\n"))
+               for key, value in labels]
+    return "{"+",".join(escaped)+"}"
+
+
+def format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def merge(samples, other):
+    """ add the samples in other to samples """
+    for key, value in other.items():
+        if key not in samples:
+            samples[key] = value
+        elif isinstance(value, list):
+            samples[key] = [a+b for a, b in zip(samples[key], value)]
+        else:
+            samples[key] += value
+
+
+class Metrics(object):
+    """ counters and histograms shared by the processes of the app
+
+    Samples are stored as {(name, labels): value}, the value of a
+    histogram is the list [count per bucket..., sum, count].
+    Recording a sample never writes to disk and never raises, errors
+    are logged. Samples recorded in the last flush_interval seconds
+    are lost if a process is killed.
+    """
+
+    def __init__(self, directory, flush_interval=FLUSH_INTERVAL):
+        self._dir = directory
+        self._interval = flush_interval
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError:
+            logger.exception("cannot create metrics directory %s", directory)
+        self._lock = threading.Lock()
+        # only one thread at a time writes the file
+        self._flush_lock = threading.Lock()
+        self._samples = {}
+        self._changed = False
+        # process the samples and flush thread belong to
+        self._pid = None
+        self._token = None
+        self._stop = threading.Event()
+
+    def __getstate__(self):
+        # worker processes start with their own samples
+        return {"directory": self._dir, "flush_interval": self._interval}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"], state["flush_interval"])
+
+    @property
+    def directory(self):
+        return self._dir
+
+    def _check_process(self):
+        """ start the flush thread of the current process
+
+        called with the lock held. In a forked process, the samples
+        belong to the parent and are dropped.
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        if self._pid is None:
+            atexit.register(self.close)
+        self._samples = {}
+        self._changed = False
+        self._pid = pid
+        self._token = process_token()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self._interval):
+            self.flush()
+
+    def _change(self, name, labels, update):
+        try:
+            with self._lock:
+                self._check_process()
+                key = (name, label_key(labels))
+                self._samples[key] = update(self._samples.get(key))
+                self._changed = True
+        except Exception:
+            logger.exception("recording metric %s failed", name)
+
+    def flush(self):
+        """ replace the file of this process with the current samples
+
+        does nothing if no samples changed since the last flush
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._changed or self._pid != os.getpid():
+                    return
+                data = [[name, list(labels), value]
+                        for (name, labels), value in self._samples.items()]
+                self._changed = False
+            filename = os.path.join(self._dir, "{0}.json".format(
+                self._token.replace(":", "-")))
+            try:
+                handle, tmp_name = tempfile.mkstemp(dir=self._dir,
+                                                    suffix=".tmp")
+                with os.fdopen(handle, "w") as tmp_file:
+                    json.dump(data, tmp_file)
+                os.replace(tmp_name, filename)
+            except Exception:
+                logger.exception("writing metrics to %s failed", filename)
+                if not self._stop.is_set():
+                    # try again with the next flush
+                    with self._lock:
+                        self._changed = True
+
+    def close(self):
+        """ stop the flush thread and write the samples a last time """
+        self._stop.set()
+        self.flush()
+
+    def inc(self, name, labels=None, value=1):
+        """ increase a counter """
+        self._change(name, labels, lambda old: (old or 0)+value)
+
+    def observe(self, name, value, labels=None):
+        """ add a value to a histogram """
+        def update(old):
+            buckets = METRICS[name][2]
+            if old is None:
+                old = [0]*(len(buckets)+2)
+            new = list(old)
+            for nr, bound in enumerate(buckets):
+                if value <= bound:
+                    new[nr] += 1
+            new[-2] += value
+            new[-1] += 1
+            return new
+        self._change(name, labels, update)
+
+    def observe_report(self, report):
+        """ add the phases and the result of a cevidblib.report.RunReport """
+        for phase, seconds in report.phases.items():
+            self.observe("dbtool_phase_duration_seconds", seconds,
+                         {"phase": phase})
+        result = "ok" if report.error is None else "failed"
+        self.inc("dbtool_updates_total", {"result": result})
+
+    def db_request(self, endpoint, status, seconds):
+        """ record a request to the CeviDB, see cevidblib.db """
+        self.inc("cevidb_requests_total",
+                 {"endpoint": endpoint, "status": str(status)})
+        self.observe("cevidb_request_duration_seconds", seconds,
+                     {"endpoint": endpoint})
+
+    @staticmethod
+    def _load(filename):
+        try:
+            with open(filename) as data_file:
+                data = json.load(data_file)
+        except (OSError, ValueError):
+            return {}
+        return dict(((name, tuple(tuple(pair) for pair in labels)), value)
+                    for name, labels, value in data)
+
+    def _files(self):
+        return glob.glob(os.path.join(self._dir, "*.json"))
+
+    def collect(self):
+        """ samples of all processes added up """
+        samples = {}
+        for filename in self._files():
+            merge(samples, self._load(filename))
+        return samples
+
+    def compact(self):
+        """ merge the files of processes no longer running into one
+
+        errors are logged, they do not fail the caller
+        """
+        try:
+            self._compact()
+        except OSError:
+            logger.exception("compacting metrics failed")
+
+    def _compact(self):
+        archive = os.path.join(self._dir, ARCHIVE)
+        with open(os.path.join(self._dir, "compact.lock"), "w") as lock:
+            # only one process at a time may merge the files
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            samples = self._load(archive)
+            dead = []
+            for filename in self._files():
+                # "pid-start.json" (see jobs.process_token()),
+                # "pid.json" for files of earlier versions
+                name = os.path.basename(filename)[:-len(".json")]
+                if not name.partition("-")[0].isdigit() \
+                        or process_alive(name.replace("-", ":", 1)):
+                    continue
+                merge(samples, self._load(filename))
+                dead.append(filename)
+            if len(dead) == 0:
+                return
+            handle, tmp_name = tempfile.mkstemp(dir=self._dir, suffix=".tmp")
+            with os.fdopen(handle, "w") as tmp_file:
+                json.dump([[name, list(labels), value]
+                           for (name, labels), value in samples.items()],
+                          tmp_file)
+            os.replace(tmp_name, archive)
+            for filename in dead:
+                os.remove(filename)
+
+    def render(self, gauges=None):
+        """ samples of all processes in the text exposition format
+
+        Parameters
+        ----------
+        gauges : dict
+            current values not stored in the files
+            {(name, labels): value, ...} (default: None)
+
+        """
+        self.flush()
+        samples = self.collect()
+        samples.update(gauges or {})
+        lines = []
+        for name in sorted(METRICS):
+            kind, help_text, buckets = METRICS[name]
+            series = sorted((labels, value)
+                            for (sample, labels), value in samples.items()
+                            if sample == name)
+            if len(series) == 0:
+                continue
+            lines.append("# HELP {0} {1}".format(name, help_text))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            for labels, value in series:
+                if kind != "histogram":
+                    lines.append("{0}{1} {2}".format(
+                        name, format_labels(labels), format_value(value)))
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append("{0}_bucket{1} {2}".format(
+                        name, format_labels(labels+(("le", str(bound)),)),
+                        count))
+                lines.append("{0}_bucket{1} {2}".format(
+                    name, format_labels(labels+(("le", "+Inf"),)), value[-1]))
+                lines.append("{0}_sum{1} {2}".format(
+                    name, format_labels(labels), format_value(value[-2])))
+                lines.append("{0}_count{1} {2}".format(
+                    name, format_labels(labels), value[-1]))
+        return "\n".join(lines)+"\n"
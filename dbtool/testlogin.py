@@ -0,0 +1,23 @@
+""" login without OAuth for load tests
+
+the blueprint is only registered by create_app() with TEST_LOGIN = True,
+never enable this on a public server.
+"""
+
+from flask import Blueprint, current_app, abort
+from flask_login import login_user
+
+from .main import User
+
+
+bp = Blueprint('test_login', __name__)
+
+@bp.route('/test-login/<email>')
+def test_login(email):
+    """ log in a configured user """
+    if email not in current_app.config["USER"]:
+        abort(404)
+    user = User()
+    user.id = email
+    login_user(user)
+    return "OK"
@@ -7,3 +7,25 @@ OAUTH = {
         "id": "replace-with-id",
         "secret": "replace-with-secret",
         }
+
+# seconds the members of a group are reused for further uploads
+GROUP_CACHE_TTL = 60
+# maximal number of groups kept in memory
+GROUP_CACHE_SIZE = 32
+
+# number of uploads processed at the same time per process
+JOB_WORKERS = 2
+# seconds finished uploads are kept for download (removed by /cleanup)
+JOB_MAX_AGE = 3600
+
+# number of processes reading and writing files, 0 to use the job threads
+PROCESS_WORKERS = 0
+# seconds an upload may take in a worker process
+JOB_TIMEOUT = 300
+
+# process uploads in memory and answer with the updated file directly,
+# instead of storing them as background jobs
+IN_MEMORY = False
+
+# directory shared by all processes to collect the data for /metrics
+#METRICS_PATH = "/var/www/db2excel_flask/instance/metrics"
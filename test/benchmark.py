@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+benchmark.py -- time and memory of the update pipeline on synthetic data
+
+usage:
+    python benchmark.py [--sizes 100,1000,10000] [--output baseline.json]
+                        [--compare baseline.json] [--threshold 1.25]
+
+For every size a synthetic workbook and DB are generated and the phases
+reading, updating the persons, writing and the full Master.run are
+measured. The results are written as json, so later runs can be
+compared with them.
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import argparse
+import copy
+import datetime
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import openpyxl
+import synthetic
+from cevidblib.config import Settings
+from cevidblib.filedict import XlsxReader, XlsxWriter, XlsxStreamWriter
+from cevidblib.xlsxpatch import XlsxPatcher
+from cevidblib.master import Master
+
+DEFAULT_SIZES = [100, 1000, 10000]
+
+
+def measure(function, repeat, setup=None):
+    """ run function repeatedly, measuring time and peak memory
+
+    the time is measured without tracing memory, the peak memory
+    in a separate run with tracemalloc.
+
+    Parameters
+    ----------
+    function : callable
+        function to measure, takes no arguments or the result
+        of setup
+    repeat : int
+        number of timed runs
+    setup : callable
+        if given, called before every run, its result is passed to
+        function. Neither its time nor its memory is measured
+        (default: None)
+
+    Returns
+    -------
+    seconds : float
+        fastest of the timed runs
+    peak_kib : int
+        peak of memory allocated by python during one run in KiB
+
+    """
+    times = []
+    for nr in range(repeat):
+        args = () if setup is None else (setup(),)
+        gc.collect()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter()-start)
+    args = () if setup is None else (setup(),)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak//1024
+
+
+class Bench(object):
+    """ phases of the pipeline for one synthetic workload """
+
+    def __init__(self, directory, workload):
+        """ create files and DB for workload in directory """
+        self.dir = directory
+        self.workload = workload
+        self.ini = os.path.join(directory, "bench.ini")
+        self.xlsx = os.path.join(directory, "bench.xlsx")
+        self.out = os.path.join(directory, "out.xlsx")
+        synthetic.write_config(self.ini, workload)
+        file_people, self.db_people = synthetic.make_people(workload)
+        synthetic.write_workbook(self.xlsx, workload, file_people)
+        # the patcher does not support formulas below the persons,
+        # it is measured on the same persons without footer
+        self.plain_xlsx = os.path.join(directory, "plain.xlsx")
+        plain = copy.copy(workload)
+        plain.footer_lines = 0
+        synthetic.write_workbook(self.plain_xlsx, plain, file_people)
+        self.cfg = Settings(self.ini)
+        self.session = synthetic.SyntheticDB(self.db_people, per_page=100)
+
+    def db_rows(self):
+        """ fresh copy of the DB result, update_persons changes it """
+        return [dict(row) for row in self.db_people]
+
+    def read(self, filename=None):
+        return XlsxReader(self.cfg, filename or self.xlsx,
+                          streaming=self.cfg.stream_read)
+
+    def master(self):
+        """ Master object fetching from the synthetic DB """
+        return Master(self.cfg, session=self.session)
+
+    def phases(self):
+        """ list of (name, function, setup) to measure
+
+        see measure() for function and setup
+        """
+        persons = self.read().persons
+
+        def fresh_lists():
+            # update_persons changes both lists
+            return copy.deepcopy(persons), self.db_rows()
+
+        def update(lists):
+            Master(self.cfg).update_persons(*lists)
+
+        def merged(filename=None):
+            reader = self.read(filename)
+            Master(self.cfg).update_persons(reader.persons, self.db_rows())
+            return reader
+
+        def write(writer_class, reader):
+            def run():
+                writer = writer_class(self.cfg, self.out, reader)
+                writer.fill(reader.persons)
+                writer.save()
+            return run
+
+        def master_run():
+            shutil.copy(self.xlsx, self.out)
+            self.master().run(self.out, cert=None, backup=False)
+
+        reader = merged()
+        return [
+            ("read", self.read, None),
+            ("update_persons", update, fresh_lists),
+            ("write_full", write(XlsxWriter, reader), None),
+            ("write_stream", write(XlsxStreamWriter, reader), None),
+            ("write_patch", write(XlsxPatcher, merged(self.plain_xlsx)),
+             None),
+            ("master_run", master_run, None),
+        ]
+
+
+def run_benchmarks(sizes, repeat, log=sys.stderr):
+    """ measure all phases for all sizes
+
+    Returns
+    -------
+    results : list of dicts
+        {"size": ..., "phase": ..., "seconds": ..., "peak_kib": ...}
+
+    """
+    results = []
+    for size in sizes:
+        directory = tempfile.mkdtemp()
+        try:
+            bench = Bench(directory, synthetic.Workload(persons=size))
+            for name, function, setup in bench.phases():
+                seconds, peak = measure(function, repeat, setup)
+                results.append({"size": size, "phase": name,
+                                "seconds": round(seconds, 6),
+                                "peak_kib": peak})
+                log.write("{0:>7} {1:<20} {2:9.4f} s {3:9d} KiB\n".format(
+                    size, name, seconds, peak))
+        finally:
+            shutil.rmtree(directory)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ compare results with a baseline
+
+    Returns
+    -------
+    regressions : list of strings
+        descriptions of phases slower or using more memory than
+        threshold times the baseline
+
+    """
+    old = dict(((row["size"], row["phase"]), row)
+               for row in baseline["results"])
+    regressions = []
+    print("{0:>7} {1:<20} {2:>10} {3:>10}".format("size", "phase",
+                                                  "time", "memory"))
+    for row in results:
+        ref = old.get((row["size"], row["phase"]))
+        if ref is None:
+            continue
+        time_ratio = row["seconds"]/max(ref["seconds"], 1e-9)
+        mem_ratio = row["peak_kib"]/max(ref["peak_kib"], 1)
+        print("{0:>7} {1:<20} {2:>9.2f}x {3:>9.2f}x".format(
+            row["size"], row["phase"], time_ratio, mem_ratio))
+        if time_ratio > threshold or mem_ratio > threshold:
+            regressions.append("{0} {1}".format(row["size"], row["phase"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="time and memory of the update pipeline on synthetic data")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma separated numbers of persons")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="timed runs per phase (fastest is kept)")
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--compare", help="baseline json file to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="ratio to the baseline reported as regression")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = run_benchmarks(sizes, args.repeat)
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "openpyxl": openpyxl.__version__,
+        "machine": platform.machine(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json.dump(report, out_file, indent=1)
+    if args.compare:
+        with open(args.compare) as base_file:
+            regressions = compare(results, json.load(base_file),
+                                  args.threshold)
+        if len(regressions) > 0:
+            print("regressions: "+", ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
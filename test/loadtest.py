@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+loadtest.py -- concurrent uploads against the web app
+
+usage:
+    python loadtest.py [--users 20] [--uploads 5] [--persons 500]
+                       [--processes 2] [--threads 8] [--in-memory]
+                       [--latency 0.05] [--output result.json]
+
+The app is started with create_app() in --processes server processes
+with --threads request threads each (like a mod_wsgi daemon), all
+sharing a temporary instance folder. CeviDB is replaced by the local
+stand-in server (see standin.py) and the users log in through the
+/test-login hook (TEST_LOGIN = True). Every user uploads generated
+workbooks one after the other, the requests are distributed over the
+server processes in turn. Throughput, latency percentiles, error rate
+and the peak RSS of every server process are reported.
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import synthetic
+from standin import start_server
+
+
+def peak_rss(pid):
+    """ peak RSS of a running process in KiB (Linux only) """
+    with open("/proc/{0}/status".format(pid)) as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return None
+
+
+def serve(instance_path, config, threads, conn):
+    """ run the app in a server process
+
+    the port is sent through conn, the server stops when anything
+    is received and sends the peak RSS of the process and of the
+    workers of the MasterPool back
+    """
+    from werkzeug.serving import BaseWSGIServer
+    from dbtool import create_app
+
+    class PoolServer(BaseWSGIServer):
+        """ server handling requests with a fixed number of threads """
+
+        def __init__(self, host, port, app, threads):
+            BaseWSGIServer.__init__(self, host, port, app)
+            self._pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self._pool.submit(self._handle, request, client_address)
+
+        def _handle(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    app = create_app(config, instance_path)
+    # failed uploads are counted by the client
+    app.logger.setLevel(logging.CRITICAL)
+    server = PoolServer("127.0.0.1", 0, app, threads)
+    conn.send(server.server_port)
+
+    def stop():
+        conn.recv()
+        server.shutdown()
+    threading.Thread(target=stop, daemon=True).start()
+    server.serve_forever()
+    server._pool.shutdown()
+    result = {"pid": os.getpid(), "peak_rss_kib": peak_rss(os.getpid()),
+              "pool_peak_rss_kib": []}
+    pool = app.config["MASTER_POOL"]
+    if pool is not None:
+        result["pool_peak_rss_kib"] = [peak_rss(pid) for pid in pool.pids()]
+        pool.shutdown()
+    conn.send(result)
+
+
+def percentile(values, fraction):
+    """ nearest-rank percentile of a list of numbers """
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    index = max(0, int(-(-fraction*len(values)//1))-1)
+    return values[index]
+
+
+class LoadTest(object):
+    """ instance folder, stand-in DB and server processes of a run """
+
+    def __init__(self, directory, users=20, persons=500, groups=1,
+                 processes=2, threads=8, in_memory=False, job_workers=2,
+                 process_workers=0, latency=0, error_rate=0, rate_limit=0):
+        """ prepare configs and workbooks of all users in directory
+
+        see main() for the meaning of the parameters
+        """
+        self.dir = directory
+        self.processes = processes
+        self.threads = threads
+        self.in_memory = in_memory
+        self.standin = start_server(persons=persons, per_page=100,
+                                    latency=latency, error_rate=error_rate,
+                                    rate_limit=rate_limit)
+        self.instance = os.path.join(directory, "instance")
+        os.makedirs(self.instance)
+        self.users = []
+        for nr in range(users):
+            email = "user{0}@example.org".format(nr)
+            # own names for every user, so the file is rewritten
+            workload = synthetic.Workload(persons=persons, seed=1000+nr)
+            synthetic.write_config(
+                    os.path.join(self.instance, "user{0}.ini".format(nr)),
+                    workload,
+                    db_options={"url": self.standin.url,
+                                "api_token": self.standin.token,
+                                "groupid": 1+nr % groups,
+                                "allowed_users": email})
+            xlsx = os.path.join(directory, "user{0}.xlsx".format(nr))
+            file_people, db_people = synthetic.make_people(workload)
+            synthetic.write_workbook(xlsx, workload, file_people)
+            with open(xlsx, "rb") as xlsx_file:
+                self.users.append((email, xlsx_file.read()))
+        self.config = {
+            "SECRET_KEY": "loadtest",
+            "WTF_CSRF_ENABLED": False,
+            "TEST_LOGIN": True,
+            "IN_MEMORY": in_memory,
+            "JOB_WORKERS": job_workers,
+            "PROCESS_WORKERS": process_workers,
+        }
+        self._servers = []
+        self.urls = []
+
+    def start(self):
+        """ start the server processes """
+        context = multiprocessing.get_context("spawn")
+        for nr in range(self.processes):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=serve, args=(
+                self.instance, self.config, self.threads, child_conn))
+            process.start()
+            port = conn.recv()
+            self._servers.append((process, conn))
+            self.urls.append("http://127.0.0.1:{0}/".format(port))
+
+    def stop(self):
+        """ stop the server processes
+
+        Returns
+        -------
+        workers : list of dicts
+            pid and peak RSS of every server process and the
+            workers of its MasterPool
+        """
+        workers = []
+        for process, conn in self._servers:
+            conn.send("stop")
+            workers.append(conn.recv())
+            process.join()
+        self._servers = []
+        self.standin.shutdown()
+        self.standin.server_close()
+        return workers
+
+    def upload(self, session, url, data, timeout=120):
+        """ upload a workbook and wait for the updated file
+
+        Returns
+        -------
+        error : string
+            description of the error, None if the upload succeeded
+        """
+        res = session.post(url, files={"file_": ("upload.xlsx", data)},
+                           allow_redirects=False, timeout=timeout)
+        if self.in_memory:
+            if res.status_code != 200 or \
+                    "attachment" not in res.headers.get("Content-Disposition", ""):
+                return "upload: status {0}".format(res.status_code)
+            return None
+        if res.status_code != 302:
+            return "upload: status {0}".format(res.status_code)
+        status_url = requests.compat.urljoin(url, res.headers["Location"]) \
+            + "/status"
+        deadline = time.monotonic()+timeout
+        while time.monotonic() < deadline:
+            status = session.get(status_url, timeout=timeout).json()
+            if status["status"] == "failed":
+                return "job: {0}".format(status["message"])
+            if status["status"] == "done":
+                res = session.get(requests.compat.urljoin(
+                    url, status["download"]), timeout=timeout)
+                if res.status_code != 200:
+                    return "download: status {0}".format(res.status_code)
+                return None
+            time.sleep(0.05)
+        return "job: timeout"
+
+    def run_user(self, nr, uploads):
+        """ log in and upload the workbook of a user several times
+
+        Returns
+        -------
+        results : list of tuples
+            (seconds, error) of every upload
+        """
+        email, data = self.users[nr]
+        session = requests.Session()
+        results = []
+        try:
+            session.get(self.urls[nr % len(self.urls)]+"test-login/"+email,
+                        timeout=30).raise_for_status()
+        except requests.RequestException as e:
+            return [(0, "login: {0}".format(e))]*uploads
+        for upload in range(uploads):
+            # distribute the requests over the processes in turn
+            url = self.urls[(nr+upload) % len(self.urls)]
+            start = time.perf_counter()
+            try:
+                error = self.upload(session, url, data)
+            except requests.RequestException as e:
+                error = str(e)
+            results.append((time.perf_counter()-start, error))
+        return results
+
+    def run(self, uploads):
+        """ let all users upload concurrently
+
+        Returns
+        -------
+        report : dict
+            throughput, latencies and errors of the uploads
+        """
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(self.users)) as pool:
+            per_user = list(pool.map(lambda nr: self.run_user(nr, uploads),
+                                     range(len(self.users))))
+        seconds = time.perf_counter()-start
+        results = [result for user in per_user for result in user]
+        latencies = [latency for latency, error in results if error is None]
+        errors = [error for latency, error in results if error is not None]
+        return {
+            "uploads": len(results),
+            "errors": len(errors),
+            "error_rate": len(errors)/max(1, len(results)),
+            "first_errors": errors[:5],
+            "seconds": round(seconds, 3),
+            "throughput": len(latencies)/seconds,
+            "latency": dict((name, percentile(latencies, fraction))
+                            for name, fraction in (("p50", 0.5), ("p90", 0.9),
+                                                   ("p99", 0.99),
+                                                   ("max", 1.0))),
+            "standin": dict(self.standin.stats),
+        }
+
+
+def run_loadtest(uploads=5, **options):
+    """ prepare, run and clean up a load test
+
+    see LoadTest for the options
+
+    Returns
+    -------
+    report : dict
+        see LoadTest.run(), with the peak RSS of the server
+        processes as "workers"
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        test = LoadTest(directory, **options)
+        test.start()
+        try:
+            report = test.run(uploads)
+        finally:
+            report_workers = test.stop()
+        report["workers"] = report_workers
+        return report
+    finally:
+        shutil.rmtree(directory)
+
+
+def print_report(report, out=sys.stdout):
+    latency = report["latency"]
+    out.write("uploads     {0} ({1} failed, {2:.1%})\n".format(
+        report["uploads"], report["errors"], report["error_rate"]))
+    out.write("throughput  {0:.2f} uploads/s in {1:.1f} s\n".format(
+        report["throughput"], report["seconds"]))
+    if latency["max"] is not None:
+        out.write("latency     p50 {p50:.3f} s  p90 {p90:.3f} s  "
+                  "p99 {p99:.3f} s  max {max:.3f} s\n".format(**latency))
+    for worker in report["workers"]:
+        out.write("worker {0:>6}  peak RSS {1} KiB".format(
+            worker["pid"], worker["peak_rss_kib"]))
+        if len(worker["pool_peak_rss_kib"]) > 0:
+            out.write(", MasterPool {0} KiB".format(
+                " / ".join(map(str, worker["pool_peak_rss_kib"]))))
+        out.write("\n")
+    for error in report["first_errors"]:
+        out.write("error       {0}\n".format(error))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="concurrent uploads against the web app")
+    parser.add_argument("--users", type=int, default=20,
+                        help="number of concurrent users")
+    parser.add_argument("--uploads", type=int, default=5,
+                        help="uploads per user")
+    parser.add_argument("--persons", type=int, default=500,
+                        help="persons per workbook and group")
+    parser.add_argument("--groups", type=int, default=1,
+                        help="number of distinct groups of the users")
+    parser.add_argument("--processes", type=int, default=2,
+                        help="server processes")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="request threads per server process")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="answer uploads directly (IN_MEMORY = True)")
+    parser.add_argument("--job-workers", type=int, default=2,
+                        help="JOB_WORKERS of the app")
+    parser.add_argument("--process-workers", type=int, default=0,
+                        help="PROCESS_WORKERS of the app")
+    parser.add_argument("--latency", type=float, default=0,
+                        help="latency of the stand-in DB in seconds")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="error rate of the stand-in DB")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="requests per second of the stand-in DB")
+    parser.add_argument("--output", help="write report to this json file")
+    parser.add_argument("--max-error-rate", type=float,
+                        help="fail if more uploads failed")
+    parser.add_argument("--max-p90", type=float,
+                        help="fail if the p90 latency is higher (seconds)")
+    args = parser.parse_args(argv)
+
+    report = run_loadtest(
+            uploads=args.uploads, users=args.users, persons=args.persons,
+            groups=args.groups, processes=args.processes,
+            threads=args.threads, in_memory=args.in_memory,
+            job_workers=args.job_workers,
+            process_workers=args.process_workers, latency=args.latency,
+            error_rate=args.error_rate, rate_limit=args.rate_limit)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as out_file:
+            json.dump(report, out_file, indent=1)
+    failed = False
+    if args.max_error_rate is not None:
+        failed |= report["error_rate"] > args.max_error_rate
+    if args.max_p90 is not None:
+        p90 = report["latency"]["p90"]
+        failed |= p90 is None or p90 > args.max_p90
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
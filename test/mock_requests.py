@@ -11,6 +11,8 @@ mock_requests.py -- Mock Objects to test without connecting to the DB
 
 """
 
+import threading
+
 class MockRequestsCall(object):
     """ structure to store info on function calls """
 
@@ -22,7 +24,8 @@ class MockRequestsCall(object):
 class MockRequestsResult(object):
     """ mock object for the results returned by requests """
 
-    def __init__(self, json=None, url=None):
+    def __init__(self, json=None, url=None, status_code=200, headers=None,
+                 content=b""):
         """ initialise result object
 
         Parameter
@@ -31,10 +34,24 @@ class MockRequestsResult(object):
             dictionary representing result json
         url : string
             content of url attribute
+        status_code : int
+            content of status_code attribute
+        headers : dict
+            content of headers attribute
+        content : bytes
+            content of content attribute
 
         """
         self._json = json
         self.url = url
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self._content = content
+
+    @property
+    def content(self):
+        """ mock attribute """
+        return self._content
 
     def raise_for_status(self):
         """ mock function """
@@ -58,12 +75,17 @@ class MockRequests(object):
         list with objects representing calls to get/post
     results : list
         list with result objects to be returned on calls
+    url_results : dict
+        result objects to be returned for calls to a given url,
+        these are used before the ones from results
 
     """
 
     def __init__(self):
         self.calls = []
         self.results = []
+        self.url_results = {}
+        self._lock = threading.Lock()
 
     def _process_call(self, *args, **kwargs):
         """ helper implementing main logic
@@ -73,11 +95,15 @@ class MockRequests(object):
         object is configured, a default object is created.
 
         """
-        self.calls.append(MockRequestsCall(args, kwargs))
-        try:
-            ret = self.results.pop(0)
-        except IndexError:
-            ret = MockRequestsResult()
+        with self._lock:
+            self.calls.append(MockRequestsCall(args, kwargs))
+            try:
+                if args[0] in self.url_results:
+                    ret = self.url_results[args[0]]
+                else:
+                    ret = self.results.pop(0)
+            except IndexError:
+                ret = MockRequestsResult()
         if ret.url == None:
             ret.url = args[0]
         return ret
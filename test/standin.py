@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+standin.py -- local stand-in for the CeviDB (hitobito) json api
+
+usage:
+    python standin.py [--port 8000] [--persons 1000] [--per-page 50]
+                      [--latency 0.05] [--error-rate 0.01] [--rate-limit 20]
+
+The server answers the endpoints used by cevidblib.db.CeviDB:
+    groups/{gid}/people.json    paginated group listing
+    groups/{gid}.json           group info
+    people/{pid}.json           redirect to the person in its group
+    groups/{gid}/people/{pid}.json
+                                person details
+All requests need the token as query parameter. Responses carry an
+ETag and are answered with 304 if it matches If-None-Match.
+
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl
+from synthetic import make_person
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """ answer requests like the CeviDB """
+
+    def do_GET(self):
+        server = self.server
+        server.count("requests")
+        if not server.acquire():
+            server.count("throttled")
+            self.send_json(429, {"error": "rate limit"},
+                           {"Retry-After": "1"})
+            return
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if server.fail():
+            server.count("errors")
+            self.send_json(500, {"error": "synthetic error"})
+            return
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        match = re.fullmatch(r"/people/(\d+)\.json", parts.path)
+        if match is not None:
+            # like the DB, the redirect drops the query string
+            self.send_response(302)
+            self.send_header("Location", "/groups/{0}/people/{1}.json".format(
+                server.group_id, match.group(1)))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if query.get("token") != server.token:
+            self.send_json(401, {"error": "token missing or invalid"})
+            return
+        match = re.fullmatch(r"/groups/(\d+)/people\.json", parts.path)
+        if match is not None:
+            try:
+                page = int(query.get("page", 1))
+            except ValueError:
+                self.send_json(400, {"error": "invalid page"})
+                return
+            self.send_json(200, server.group_page(
+                int(match.group(1)), page, self.headers.get("Host")))
+            return
+        match = re.fullmatch(r"/groups/(\d+)/people/(\d+)\.json", parts.path)
+        if match is not None and match.group(2) in server.details:
+            self.send_json(200, {"people": [server.details[match.group(2)]]})
+            return
+        match = re.fullmatch(r"/groups/(\d+)\.json", parts.path)
+        if match is not None:
+            self.send_json(200, {"groups": [{
+                "id": match.group(1),
+                "name": "Gruppe {0}".format(match.group(1))}]})
+            return
+        self.send_json(404, {"error": "not found"})
+
+    def send_json(self, status, data, headers=None):
+        """ send data as json, 304 if the ETag matches """
+        body = json.dumps(data).encode("utf-8")
+        etag = '"{0}"'.format(hashlib.sha1(body).hexdigest())
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status = 304
+            body = b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+
+class StandinServer(ThreadingHTTPServer):
+    """ http server holding the synthetic data and the settings """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), persons=1000, per_page=50,
+                 latency=0, error_rate=0, rate_limit=0, token="standin",
+                 group_id=1, seed=42, verbose=False):
+        """ initialise server
+
+        Parameters
+        ----------
+        address : tuple
+            (host, port) to listen on, port 0 for any free port
+            (default: ("127.0.0.1", 0))
+        persons : int
+            number of members in every group (default: 1000)
+        per_page : int
+            persons per page of the group listing (default: 50)
+        latency : float
+            seconds every request is delayed (default: 0)
+        error_rate : float
+            fraction of requests answered with status 500 (default: 0)
+        rate_limit : float
+            requests per second answered, further requests get status
+            429, 0 for no limit (default: 0)
+        token : string
+            token expected in the query string (default: "standin")
+        group_id : int
+            group persons are redirected to (default: 1)
+        seed : int
+            seed of the random generator (default: 42)
+        verbose : bool
+            if True, requests are logged (default: False)
+
+        """
+        ThreadingHTTPServer.__init__(self, address, StandinHandler)
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.token = token
+        self.group_id = group_id
+        self.verbose = verbose
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        # token bucket for the rate limit, holding at least one request
+        # so rates below 1 per second are possible
+        self._capacity = max(1, rate_limit)
+        self._tokens = self._capacity
+        self._refilled = time.monotonic()
+
+        rnd = random.Random(seed)
+        self.people = [make_person(rnd, nr) for nr in range(1, persons+1)]
+        # details contain attributes missing in the group listing
+        self.details = {}
+        for person in self.people:
+            details = dict(person)
+            details["email"] = "p{0}@example.org".format(person["id"])
+            details["birthday"] = "2000-01-{0:02d}".format(
+                    int(person["id"]) % 28+1)
+            details["address"] = "Weg {0}".format(person["id"])
+            details["zip_code"] = str(8000+int(person["id"]) % 1000)
+            self.details[person["id"]] = details
+
+    @property
+    def url(self):
+        """ base url of the server, as used for Settings.db_url """
+        host, port = self.server_address[:2]
+        return "http://{0}:{1}/".format(host, port)
+
+    def count(self, key):
+        """ increase counter in stats """
+        with self._lock:
+            self.stats[key] += 1
+
+    def acquire(self):
+        """ check the rate limit, False if the request is rejected """
+        if self.rate_limit <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._capacity, self._tokens +
+                               (now-self._refilled)*self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def fail(self):
+        """ True if the request should be answered with an error """
+        if self.error_rate <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def group_page(self, group_id, page, host):
+        """ json of a page of the group listing """
+        total_pages = max(1, -(-len(self.people)//self.per_page))
+        start = (page-1)*self.per_page
+        data = {
+            "people": self.people[start:start+self.per_page],
+            "current_page": page,
+            "total_pages": total_pages,
+        }
+        if page < total_pages:
+            data["next_page_link"] = \
+                "http://{0}/groups/{1}/people.json?page={2}".format(
+                    host, group_id, page+1)
+        return data
+
+
+def start_server(**options):
+    """ start server in a background thread
+
+    see StandinServer for the options, call shutdown() on the
+    returned server to stop it.
+
+    """
+    server = StandinServer(**options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+            description="local stand-in for the CeviDB (hitobito) json api")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--persons", type=int, default=1000)
+    parser.add_argument("--per-page", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0,
+                        help="seconds every request is delayed")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="fraction of requests failing with status 500")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="requests per second, 0 for no limit")
+    parser.add_argument("--token", default="standin")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    server = StandinServer((args.host, args.port), persons=args.persons,
+                           per_page=args.per_page, latency=args.latency,
+                           error_rate=args.error_rate,
+                           rate_limit=args.rate_limit, token=args.token,
+                           verbose=args.verbose)
+    print("serving on {0} (token {1})".format(server.url, args.token))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+synthetic.py -- generate synthetic workbooks, configs and DB responses
+
+"""
+
+import random
+import re
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from urllib.parse import urlsplit, parse_qsl
+from mock_requests import MockRequests, MockRequestsResult, MockRequestsCall
+
+# person columns, in this order starting at column A
+PERSON_FIELDS = ["id", "last_name", "first_name", "nickname", "town"]
+
+LAST_NAMES = ["Muster", "Meier", "Müller", "Schmid", "Keller", "Weber",
+              "Huber", "Schneider", "Meyer", "Steiner", "Fischer", "Gerber"]
+FIRST_NAMES = ["Anna", "Beat", "Carla", "Dario", "Eva", "Fabio", "Gina",
+               "Hans", "Ines", "Jonas", "Katrin", "Luca"]
+TOWNS = ["Zürich", "Bern", "Basel", "Luzern", "Chur", "Aarau"]
+
+
+class Workload(object):
+    """ parameters of a synthetic workload """
+
+    def __init__(self, persons=1000, data_columns=12, header_lines=4,
+                 footer_lines=2, formula=True, styles=True, changed=0.1,
+                 new=0.05, seed=42):
+        """ define workload
+
+        Parameters
+        ----------
+        persons : int
+            number of persons in the workbook (default: 1000)
+        data_columns : int
+            number of columns without pre-defined value (default: 12)
+        header_lines : int
+            number of rows before the persons (default: 4)
+        footer_lines : int
+            number of rows after the persons (default: 2)
+        formula : bool
+            if True, a column with a sum over the data columns
+            is added (default: True)
+        styles : bool
+            if True, header and footer cells use named styles
+            (default: True)
+        changed : float
+            fraction of persons with a changed name in the DB
+            (default: 0.1)
+        new : float
+            persons only in the DB, as fraction of persons
+            (default: 0.05)
+        seed : int
+            seed of the random generator (default: 42)
+
+        """
+        self.persons = persons
+        self.data_columns = data_columns
+        self.header_lines = header_lines
+        self.footer_lines = footer_lines
+        self.formula = formula
+        self.styles = styles
+        self.changed = changed
+        self.new = new
+        self.seed = seed
+
+    @property
+    def first_data_column(self):
+        """ column number of the first data column """
+        return len(PERSON_FIELDS)+1
+
+    @property
+    def last_column(self):
+        """ column number of the last configured column """
+        return len(PERSON_FIELDS)+self.data_columns+int(self.formula)
+
+    def formula_value(self):
+        """ value of the formula column in the config """
+        first = openpyxl.utils.get_column_letter(self.first_data_column)
+        last = openpyxl.utils.get_column_letter(self.last_column-1)
+        return "=SUM({0}{{row}}:{1}{{row}})".format(first, last)
+
+
+def write_config(filename, workload, options=None, db_options=None):
+    """ write config file for a workload
+
+    Parameters
+    ----------
+    filename : string
+        name of the ini file to write
+    workload : Workload object
+        parameters of the workload
+    options : dict
+        additional options for the [file] section (default: None)
+    db_options : dict
+        options of the [db] section replacing or added to the
+        defaults (default: None)
+
+    """
+    db_section = {"url": "http://cevidb.invalid/",
+                  "api_token": "synthetic",
+                  "groupid": "1"}
+    db_section.update(db_options or {})
+    lines = ["[db]"]
+    for key, value in db_section.items():
+        lines.append("{0} = {1}".format(key, value))
+    lines += ["",
+              "[file]",
+              "headerlines = {0}".format(workload.header_lines),
+              "footerlines = {0}".format(workload.footer_lines),
+              "freezecolumn = {0}".format(
+                  openpyxl.utils.get_column_letter(workload.first_data_column)),
+              ]
+    for key, value in (options or {}).items():
+        lines.append("{0} = {1}".format(key, value))
+    lines += ["", "[rows]"]
+    for nr, field in enumerate(PERSON_FIELDS, 1):
+        lines.append("{0} = {1}".format(
+            openpyxl.utils.get_column_letter(nr), field))
+    for col in range(workload.first_data_column, workload.last_column+1):
+        value = ""
+        if workload.formula and col == workload.last_column:
+            value = workload.formula_value()
+        lines.append("{0} = {1}".format(
+            openpyxl.utils.get_column_letter(col), value))
+    with open(filename, "w", encoding="utf-8") as ini_file:
+        ini_file.write("\n".join(lines)+"\n")
+
+
+def make_person(rnd, pers_id):
+    """ person as returned by the DB """
+    return {
+        "id": str(pers_id),
+        "last_name": rnd.choice(LAST_NAMES),
+        "first_name": rnd.choice(FIRST_NAMES),
+        "nickname": "N{0}".format(pers_id),
+        "town": rnd.choice(TOWNS),
+    }
+
+
+def make_people(workload):
+    """ people in the file and in the DB
+
+    Returns
+    -------
+    file_people : list of dicts
+        persons written to the workbook
+    db_people : list of dicts
+        persons returned by the DB, a fraction of them changed
+        and some of them new
+
+    """
+    rnd = random.Random(workload.seed)
+    file_people = [make_person(rnd, nr) for nr in range(1, workload.persons+1)]
+    db_people = []
+    for person in file_people:
+        person = dict(person)
+        if rnd.random() < workload.changed:
+            person["last_name"] = rnd.choice(LAST_NAMES)+"-"+person["id"]
+        db_people.append(person)
+    new = int(workload.persons*workload.new)
+    db_people += [make_person(rnd, nr) for nr in
+                  range(workload.persons+1, workload.persons+new+1)]
+    return file_people, db_people
+
+
+def write_workbook(filename, workload, people):
+    """ write synthetic workbook
+
+    Parameters
+    ----------
+    filename : string
+        name of the xlsx file to write
+    workload : Workload object
+        parameters of the workload
+    people : list of dicts
+        persons written to the workbook
+
+    """
+    rnd = random.Random(workload.seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    def cell(value, style=None):
+        cell = WriteOnlyCell(ws, value)
+        if style is not None and workload.styles:
+            cell.style = style
+        return cell
+
+    for nr in range(1, workload.header_lines+1):
+        if nr == 1:
+            ws.append([cell("Synthetic list", "Title")])
+        elif nr == workload.header_lines:
+            ws.append([cell(name, "Headline 3") for name in PERSON_FIELDS] +
+                      [cell("Data {0}".format(col), "Headline 3")
+                       for col in range(workload.data_columns)] +
+                      [cell("Total", "Headline 3")]*int(workload.formula))
+        else:
+            ws.append([cell(None, "Note")])
+    for nr, person in enumerate(people):
+        row = nr+workload.header_lines+1
+        values = [person[field] for field in PERSON_FIELDS]
+        # ids are stored as numbers, like in exported lists
+        values[0] = int(values[0])
+        values += [rnd.randint(0, 100) for col in range(workload.data_columns)]
+        if workload.formula:
+            values.append(workload.formula_value().format(row=row))
+        ws.append(values)
+    first_person = workload.header_lines+1
+    last_person = workload.header_lines+len(people)
+    for nr in range(workload.footer_lines):
+        if nr == 0:
+            values = [cell("Total", "Total")]
+            values += [cell(None, "Total")]*(len(PERSON_FIELDS)-1)
+            for col in range(workload.first_data_column, workload.last_column+1):
+                letter = openpyxl.utils.get_column_letter(col)
+                values.append(cell("=SUM({0}{1}:{0}{2})".format(
+                    letter, first_person, last_person), "Total"))
+            ws.append(values)
+        else:
+            ws.append([cell("Footer {0}".format(nr), "Explanatory Text")])
+    wb.save(filename)
+
+
+class SyntheticDB(MockRequests):
+    """ mock session answering requests like the CeviDB
+
+    answers the group listing (paginated if per_page is set), the
+    details of persons and the group info from a list of people
+
+    """
+
+    def __init__(self, people, per_page=None):
+        """ initialise responder
+
+        Parameters
+        ----------
+        people : list of dicts
+            members of every group
+        per_page : int
+            persons per page of the group listing, None to return
+            all persons at once (default: None)
+
+        """
+        MockRequests.__init__(self)
+        self.people = people
+        self.per_page = per_page
+        self._by_id = dict((person["id"], person) for person in people)
+
+    def _process_call(self, *args, **kwargs):
+        """ create result for the requested url """
+        url = args[0]
+        with self._lock:
+            self.calls.append(MockRequestsCall(args, kwargs))
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query))
+        match = re.search(r"groups/(\d+)/people\.json$", parts.path)
+        if match is not None:
+            return MockRequestsResult(self.group_page(int(query.get("page", 1))),
+                                      url)
+        match = re.search(r"people/(\d+)\.json$", parts.path)
+        if match is not None and match.group(1) in self._by_id:
+            return MockRequestsResult(
+                    {"people": [self._by_id[match.group(1)]]}, url)
+        match = re.search(r"groups/(\d+)\.json$", parts.path)
+        if match is not None:
+            return MockRequestsResult(
+                    {"groups": [{"id": match.group(1)}]}, url)
+        return MockRequestsResult({}, url, status_code=404)
+
+    def group_page(self, page):
+        """ json of a page of the group listing """
+        if self.per_page is None:
+            return {"people": self.people}
+        start = (page-1)*self.per_page
+        total_pages = max(1, -(-len(self.people)//self.per_page))
+        return {"people": self.people[start:start+self.per_page],
+                "total_pages": total_pages}
+
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_asyncdb.py -- test cases for cevidblib.asyncdb using a local server
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import aiohttp
+from aiohttp import web
+from cevidblib.asyncdb import AsyncCeviDB
+
+TOKEN = "abc"
+PAGES = 3
+PER_PAGE = 2
+
+def check_token(request):
+    """ raise 401 if the token is missing """
+    if request.query.get("token") != TOKEN:
+        raise web.HTTPUnauthorized()
+
+async def group_people(request):
+    check_token(request)
+    page = int(request.query.get("page", 1))
+    people = [{"id": str((page-1)*PER_PAGE+i)} for i in range(PER_PAGE)]
+    return web.json_response({"people": people, "total_pages": PAGES})
+
+async def group(request):
+    check_token(request)
+    return web.json_response({"groups": [{"id": request.match_info["gid"]}]})
+
+async def person_redirect(request):
+    # like the DB, the redirect drops the query string
+    raise web.HTTPFound("/groups/1/people/{pid}.json".format(
+        pid=request.match_info["pid"]))
+
+async def person(request):
+    check_token(request)
+    pid = request.match_info["pid"]
+    return web.json_response({"people": [{"id": pid, "nickname": "N"+pid}]})
+
+
+class TestsLocalServer(unittest.IsolatedAsyncioTestCase):
+    """ test AsyncCeviDB against a local stand-in for the DB """
+
+    async def asyncSetUp(self):
+        app = web.Application()
+        app.router.add_get("/groups/{gid}/people.json", group_people)
+        app.router.add_get("/groups/{gid}.json", group)
+        app.router.add_get("/people/{pid}.json", person_redirect)
+        app.router.add_get("/groups/{gid}/people/{pid}.json", person)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.db = AsyncCeviDB(TOKEN, "http://127.0.0.1:{0}".format(port),
+                              limit=2)
+
+    async def asyncTearDown(self):
+        await self.db.close()
+        await self.runner.cleanup()
+
+    async def test_get_group_members(self):
+        """ all pages are fetched and merged in order """
+        res = await self.db.get_group_members(42)
+        self.assertListEqual([p["id"] for p in res],
+                             [str(i) for i in range(PAGES*PER_PAGE)])
+
+    async def test_get_group(self):
+        """ group info is returned """
+        res = await self.db.get_group(42)
+        self.assertEqual(res["groups"][0]["id"], "42")
+
+    async def test_get_person_redirect(self):
+        """ token is passed on after redirect """
+        res = await self.db.get_person(7)
+        self.assertEqual(res["people"][0]["nickname"], "N7")
+
+    async def test_get_persons(self):
+        """ details for several persons are fetched and cached """
+        res = await self.db.get_persons(["1", "2", "3"])
+        self.assertEqual(res["3"]["nickname"], "N3")
+        self.assertEqual(sorted(self.db._persons.keys()), ["1", "2", "3"])
+
+    async def test_wrong_token(self):
+        """ http errors are raised """
+        self.db._token = "wrong"
+        with self.assertRaises(aiohttp.ClientResponseError) as cm:
+            await self.db.get_group(42)
+        self.assertEqual(cm.exception.status, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_batch.py -- test cases for cevidblib.batch using the stand-in server
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import os
+import shutil
+import tempfile
+import openpyxl
+import synthetic
+from cevidblib.batch import (read_manifest, find_pairs, run_batch,
+                             format_table)
+from standin import start_server
+
+
+class TestsBatch(unittest.TestCase):
+    """ update several files with a shared fetch per group """
+
+    @classmethod
+    def setUpClass(self):
+        self.server = start_server(persons=30)
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.server.stats["requests"] = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_pair(self, name, group, options=None, token=None):
+        workload = synthetic.Workload(persons=20, seed=len(name))
+        config = os.path.join(self.dir, name+".ini")
+        xlsx = os.path.join(self.dir, name+".xlsx")
+        synthetic.write_config(config, workload, options,
+                               db_options={"url": self.server.url,
+                                           "api_token": token
+                                           or self.server.token,
+                                           "groupid": group})
+        file_people, db_people = synthetic.make_people(workload)
+        synthetic.write_workbook(xlsx, workload, file_people)
+        return config, xlsx
+
+    def test_pairs(self):
+        """ pairs are read from a manifest or a directory """
+        config, xlsx = self.write_pair("a", 1)
+        self.write_pair("b", 1)
+        open(os.path.join(self.dir, "c.xlsx"), "w").close()
+        self.assertEqual(find_pairs(self.dir)[0], (config, xlsx))
+        self.assertEqual(len(find_pairs(self.dir)), 2)
+        manifest = os.path.join(self.dir, "manifest.txt")
+        with open(manifest, "w") as manifest_file:
+            manifest_file.write("# lists\na.ini a.xlsx\n\nb.ini, b.xlsx # b\n")
+        self.assertEqual(read_manifest(manifest), find_pairs(self.dir))
+        with open(manifest, "a") as manifest_file:
+            manifest_file.write("c.xlsx\n")
+        with self.assertRaises(ValueError):
+            read_manifest(manifest)
+
+    def test_run(self):
+        """ every group is fetched once, failures are reported """
+        pairs = [self.write_pair("a", 1), self.write_pair("bb", 2),
+                 self.write_pair("ccc", 1),
+                 (os.path.join(self.dir, "missing.ini"),
+                  os.path.join(self.dir, "a.xlsx")),
+                 (os.path.join(self.dir, "a.ini"),
+                  os.path.join(self.dir, "missing.xlsx"))]
+        results = run_batch(pairs, workers=2, backup=False)
+        self.assertEqual([result.ok for result in results],
+                         [True, True, True, False, False])
+        self.assertTrue(results[3].error.startswith("config:"))
+        self.assertTrue(results[4].error.startswith("update:"))
+        # one listing per group, no details needed
+        self.assertEqual(self.server.stats["requests"], 2)
+        self.assertEqual(results[0].new, 10)
+        self.assertIn("write", results[0].phases)
+        ws = openpyxl.load_workbook(pairs[0][1]).active
+        self.assertEqual(ws.max_row, 4+30+2)
+        table = format_table(results)
+        self.assertIn("5 files, 2 failed", table)
+        self.assertEqual(len(table.splitlines()), 7)
+
+    def test_tokens(self):
+        """ configs of a group with another token are fetched separately """
+        pairs = [self.write_pair("a", 1), self.write_pair("bb", 1),
+                 self.write_pair("ccc", 1, token="other")]
+        results = run_batch(pairs, workers=2, backup=False)
+        self.assertEqual([result.ok for result in results],
+                         [True, True, False])
+        self.assertTrue(results[2].error.startswith("fetch:"))
+        self.assertEqual(self.server.stats["requests"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_benchmark.py -- test cases for the synthetic workload and benchmarks
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import io
+import os
+import shutil
+import tempfile
+import benchmark
+import synthetic
+from cevidblib.config import Settings
+from cevidblib.db import CeviDB
+from cevidblib.filedict import XlsxReader
+
+
+class SyntheticTester(unittest.TestCase):
+    """ generated files can be read """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.workload = synthetic.Workload(persons=30, data_columns=3)
+        self.ini = os.path.join(self.dir, "bench.ini")
+        self.xlsx = os.path.join(self.dir, "bench.xlsx")
+        synthetic.write_config(self.ini, self.workload)
+        self.file_people, self.db_people = synthetic.make_people(self.workload)
+        synthetic.write_workbook(self.xlsx, self.workload, self.file_people)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_workbook(self):
+        """ persons, header and footer are found by the reader """
+        cfg = Settings(self.ini)
+        self.assertEqual(cfg.column_keys, list(range(1, 10)))
+        reader = XlsxReader(cfg, self.xlsx, streaming=True)
+        self.assertEqual(len(reader.persons), 30)
+        self.assertEqual(reader.start_footer, 35)
+        self.assertEqual(reader.cell((35, 6)), "=SUM(F5:F34)")
+        self.assertEqual(reader.get_cell((4, 1)).style, "Headline 3")
+
+    def test_people(self):
+        """ DB contains all persons of the file and new ones """
+        self.assertEqual(len(self.db_people), 31)
+        self.assertEqual([p["id"] for p in self.db_people[:30]],
+                         [p["id"] for p in self.file_people])
+
+    def test_responder(self):
+        """ CeviDB reads all pages from the responder """
+        session = synthetic.SyntheticDB(self.db_people, per_page=7)
+        cevi_db = CeviDB("synthetic", "http://cevidb.invalid/",
+                         session=session)
+        self.assertEqual(cevi_db.get_group_members(1), self.db_people)
+        self.assertEqual(len(session.calls), 5)
+        self.assertEqual(cevi_db.get_person(3)["people"][0]["nickname"], "N3")
+
+
+class BenchmarkTester(unittest.TestCase):
+
+    def test_run(self):
+        """ all phases are measured and can be compared """
+        results = benchmark.run_benchmarks([20], 1, log=io.StringIO())
+        self.assertEqual(len(results), 6)
+        for row in results:
+            self.assertGreater(row["seconds"], 0)
+            self.assertGreater(row["peak_kib"], 0)
+        baseline = {"results": [dict(row, seconds=row["seconds"]/2)
+                                for row in results]}
+        regressions = benchmark.compare(results, baseline, 1.25)
+        self.assertEqual(len(regressions), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -16,6 +16,10 @@ add_path()
 add_path("../dbtool")
 
 import unittest
+import os
+import pickle
+import shutil
+import tempfile
 import cevidblib.config as cfg
 
 class ConfigTesterNoFixture(unittest.TestCase):
@@ -55,10 +59,57 @@ class ConfigTesterFixture(unittest.TestCase):
         for pair in self.settings.pers_cols:
             self.assertEqual(pair[1], value_expected[pair[0]])
 
+    def test_pickle(self):
+        copy = pickle.loads(pickle.dumps(self.settings))
+        self.assertEqual(copy.group_id, self.settings.group_id)
+        self.assertEqual(copy.column_keys, self.settings.column_keys)
+        self.assertEqual(copy.columns[7].value, "=SUM(D{row}:F{row})")
+
     def test_get_column_key(self):
         self.assertEqual(self.settings.get_column_key("id"), 3)
         with self.assertRaises(ValueError):
             self.settings.get_column_key("town")
 
+    def test_sort_keys(self):
+        self.assertEqual(self.settings.sort_keys, [(1, "text"), (3, "number")])
+        keys = self.settings.parse_sort_keys("first_name:nocase, F, ")
+        self.assertEqual(keys, [(2, "nocase"), (6, "text")])
+        with self.assertRaises(ValueError):
+            self.settings.parse_sort_keys("last_name:reverse")
+        with self.assertRaises(ValueError):
+            self.settings.parse_sort_keys("Z")
+
+class RegistryTester(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.ini")
+        shutil.copy("test.ini", self.filename)
+        self.registry = cfg.SettingsRegistry()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_cached(self):
+        """ unchanged files are parsed once """
+        first = self.registry.get(self.filename)
+        self.assertIs(self.registry.get(self.filename), first)
+
+    def test_reload(self):
+        """ files are parsed again after a change """
+        first = self.registry.get(self.filename)
+        with open(self.filename, "a", encoding="utf-8") as ini:
+            ini.write("h = nickname\n")
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns+10**9))
+        second = self.registry.get(self.filename)
+        self.assertIsNot(second, first)
+        self.assertEqual(second.get_column_key("nickname"), 8)
+
+    def test_missing(self):
+        """ missing files raise an error """
+        with self.assertRaises(IOError):
+            self.registry.get(os.path.join(self.dir, "missing.ini"))
+
 if __name__ == "__main__":
     unittest.main()
@@ -16,6 +16,7 @@ add_path()
 add_path("../dbtool")
 
 import unittest
+import email.message
 import cevidblib.db as cdb
 from mock_requests import MockRequests, MockRequestsResult
 
@@ -39,9 +40,10 @@ class TestsWithoutDB(unittest.TestCase):
         cdb.requests = self.orig_requests
 
     def setUp(self):
-        self.db = cdb.CeviDB(self.user, self.url, self.cert)
         self.mock = MockRequests()
         cdb.requests = self.mock
+        self.db = cdb.CeviDB(self.user, self.url, self.cert,
+                             session=self.mock)
 
     def tearDown(self):
         del self.db
@@ -102,7 +104,7 @@ class TestsWithoutDB(unittest.TestCase):
         """ check initialsing certificate to None works """
         del self.db
         # create new db object with None as certificate argument
-        self.db = cdb.CeviDB(self.user, self.url, None)
+        self.db = cdb.CeviDB(self.user, self.url, None, session=self.mock)
         # do usual config
         self.db.set_auth_token("abc")
         calls = self.mock.calls
@@ -140,6 +142,146 @@ class TestsWithoutDB(unittest.TestCase):
             res = self.db.get_request("groups.json")
         self.assertEqual(len(self.mock.calls), 2)
 
+class TestsSession(unittest.TestCase):
+    """ test the use of a shared session for requests """
+
+    url = "https://test.example.com"
+
+    def test_shared_session(self):
+        """ CeviDB objects share one session per process and pool size """
+        db1 = cdb.CeviDB("abc", self.url)
+        db2 = cdb.CeviDB("def", self.url)
+        db3 = cdb.CeviDB("abc", self.url, pool_size=2)
+        self.assertIs(db1._session, db2._session)
+        self.assertIsNot(db1._session, db3._session)
+        adapter = db1._session.get_adapter(self.url)
+        self.assertEqual(adapter._pool_maxsize, 10)
+        self.assertIn("gzip", db1._session.headers["Accept-Encoding"])
+
+    def test_no_cookies(self):
+        """ the shared session does not store cookies """
+        session = cdb.create_session()
+        headers = email.message.Message()
+        headers["Set-Cookie"] = "_session_id=secret; path=/"
+        response = type("Response", (object,), {"info": lambda self: headers})
+        request = cdb.requests.Request("GET", self.url+"/groups/42.json")
+        session.cookies.extract_cookies(
+                response(), cdb.requests.cookies.MockRequest(request.prepare()))
+        self.assertEqual(len(session.cookies), 0)
+
+    def test_session_request(self):
+        """ get_request() uses the session and passes the timeout """
+        mock = MockRequests()
+        db = cdb.CeviDB("abc", self.url, session=mock, timeout=(1, 2))
+        db.get_request("groups/42.json")
+        self.assertEqual(mock.calls[0].args[0],
+                         self.url+"/groups/42.json?token=abc")
+        self.assertEqual(mock.calls[0].kwargs["timeout"], (1, 2))
+
+    def test_request_hook(self):
+        """ the hook of the object gets every request, errors are logged """
+        calls = []
+        def hook(endpoint, status, seconds):
+            calls.append((endpoint, status))
+            raise OSError("metrics directory missing")
+        db = cdb.CeviDB("abc", self.url, session=MockRequests(),
+                        request_hook=hook)
+        with self.assertLogs("cevidblib"):
+            db.get_request("groups/42.json")
+        self.assertEqual(calls, [("/groups/{id}.json", 200)])
+        # other objects do not share the hook
+        cdb.CeviDB("abc", self.url, session=MockRequests()).get_request(
+                "groups/42.json")
+        self.assertEqual(len(calls), 1)
+
+
+class TestsPagination(unittest.TestCase):
+    """ test fetching paginated group members """
+
+    url = "https://test.example.com/"
+    endpoint = url+"groups/42/people.json?token=abc"
+
+    def setUp(self):
+        self.mock = MockRequests()
+        self.db = cdb.CeviDB("abc", self.url, session=self.mock,
+                             max_workers=3)
+
+    def add_page(self, nr, people, **links):
+        url = self.endpoint
+        if nr > 1:
+            url += "&page={nr}".format(nr=nr)
+        json = {"people": people}
+        json.update(links)
+        self.mock.url_results[url] = MockRequestsResult(json)
+
+    def test_single_page(self):
+        """ results without pagination are returned unchanged """
+        self.add_page(1, [{"id": "1"}])
+        self.assertListEqual(self.db.get_group_members(42), [{"id": "1"}])
+        self.assertEqual(len(self.mock.calls), 1)
+
+    def test_total_pages(self):
+        """ all pages are fetched and merged in order """
+        for nr in range(1, 6):
+            self.add_page(nr, [{"id": str(2*nr)}, {"id": str(2*nr+1)}],
+                          total_pages=5)
+        res = self.db.get_group_members(42)
+        self.assertListEqual([p["id"] for p in res],
+                             [str(i) for i in range(2, 12)])
+        self.assertEqual(len(self.mock.calls), 5)
+
+    def test_next_page_link(self):
+        """ next_page_link is followed if the page count is missing """
+        link = self.url+"groups/42/people.json?page=2&token=abc"
+        self.add_page(1, [{"id": "1"}], next_page_link=link)
+        self.add_page(2, [{"id": "2"}], next_page_link=None)
+        res = self.db.get_group_members(42)
+        self.assertListEqual(res, [{"id": "1"}, {"id": "2"}])
+        self.assertEqual(self.mock.calls[1].args[0], self.endpoint+"&page=2")
+
+
+class TestsPersons(unittest.TestCase):
+    """ test fetching details for several persons """
+
+    url = "https://test.example.com/"
+
+    def setUp(self):
+        self.mock = MockRequests()
+        self.db = cdb.CeviDB("abc", self.url, session=self.mock,
+                             max_workers=3, retries=1)
+        for pid in range(1, 5):
+            url = self.url+"people/{pid}.json?token=abc".format(pid=pid)
+            json = {"people": [{"id": str(pid), "birthday": pid}]}
+            self.mock.url_results[url] = MockRequestsResult(json)
+
+    def test_get_persons(self):
+        """ details are fetched for all ids and cached """
+        res = self.db.get_persons(["1", "2", "3"])
+        self.assertEqual(sorted(res.keys()), ["1", "2", "3"])
+        self.assertEqual(res["2"]["birthday"], 2)
+        self.assertEqual(len(self.mock.calls), 3)
+        res = self.db.get_persons(["3", "4"])
+        self.assertEqual(res["4"]["birthday"], 4)
+        self.assertEqual(len(self.mock.calls), 4)
+
+    def test_retry(self):
+        """ temporary errors are retried, others are raised """
+        calls = []
+        def flaky(arg):
+            calls.append(arg)
+            if len(calls) == 1:
+                raise cdb.Timeout()
+            return arg
+        self.assertEqual(self.db.retry(flaky, 42), 42)
+        self.assertEqual(len(calls), 2)
+        def broken():
+            raise cdb.RequestsConnectionError()
+        with self.assertRaises(cdb.RequestsConnectionError):
+            self.db.retry(broken)
+        with self.assertRaises(ValueError):
+            cdb.CeviDB("abc", self.url, session=self.mock, retries=-1)
+
+
 if __name__ == "__main__":
     unittest.main()
 
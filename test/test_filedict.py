@@ -16,6 +16,7 @@ add_path()
 add_path("../dbtool")
 
 import unittest
+import os
 import cevidblib.filedict as fd
 from cevidblib.config import Settings
 from random import randint
@@ -48,6 +49,12 @@ class MockCell(object):
 class HelperTests(unittest.TestCase):
     """ test helper functions from filedict module """
 
+    def test_to_index(self):
+        """ coordinate strings are converted to (row, col) """
+        self.assertEqual(fd.to_index("A1"), (1, 1))
+        self.assertEqual(fd.to_index("AB12"), (12, 28))
+        self.assertEqual(fd.to_index([3, 4]), (3, 4))
+
     def test_to_coord(self):
         """ coordinate strings are built correctly """
         self.assertEqual(fd.to_coord("A", "1"), "A1")
@@ -63,6 +70,46 @@ class HelperTests(unittest.TestCase):
         self.assertDictEqual(fd.row2person(value), expect)
 
 
+class SortTests(unittest.TestCase):
+    """ test sorting persons by configured keys """
+
+    @classmethod
+    def setUpClass(self):
+        self.cfg = Settings("test.ini")
+        self.persons = {
+            "10": {1: "Jemand", 2: "anna", 3: 10},
+            "9": {1: "Jemand", 2: "Bert", 3: 9},
+            "4": {1: None, 2: "Carl", 3: "4"},
+            "3": {1: "Anders", 2: "Dora", 3: "x"},
+        }
+
+    def tearDown(self):
+        self.cfg.sort_keys = self.cfg.parse_sort_keys("last_name, id:number")
+
+    def test_default(self):
+        """ sorted by last name and numeric id, empty names last """
+        self.assertEqual(fd.sort_persons(self.cfg, self.persons),
+                         ["3", "9", "10", "4"])
+
+    def test_nocase(self):
+        """ case-insensitive keys """
+        self.cfg.sort_keys = self.cfg.parse_sort_keys("first_name")
+        self.assertEqual(fd.sort_persons(self.cfg, self.persons),
+                         ["9", "4", "3", "10"])
+        self.cfg.sort_keys = self.cfg.parse_sort_keys("first_name:nocase")
+        self.assertEqual(fd.sort_persons(self.cfg, self.persons),
+                         ["10", "9", "4", "3"])
+
+    def test_stable(self):
+        """ equal keys keep their order, non-numbers are sorted last """
+        self.cfg.sort_keys = self.cfg.parse_sort_keys("id:number, F")
+        self.assertEqual(fd.sort_persons(self.cfg, self.persons),
+                         ["4", "9", "10", "3"])
+        self.cfg.sort_keys = []
+        self.assertEqual(fd.sort_persons(self.cfg, self.persons),
+                         ["10", "9", "4", "3"])
+
+
 class TestReader(unittest.TestCase):
     """ test loading test.xlsx """
 
@@ -81,7 +128,7 @@ class TestReader(unittest.TestCase):
 
     def test_init_persons2(self):
         """ person data is read correctly """
-        self.assertDictEqual(self.reader.persons, PERSONS)
+        self.assertDictEqual(self.reader.persons.to_dict(), PERSONS)
 
     def test_cellaccess(self):
         """ cells can be accessed correctly """
@@ -93,6 +140,45 @@ class TestReader(unittest.TestCase):
         for val, exp in tests:
             self.assertEqual(self.reader.cell(val), exp)
 
+    def test_index_access(self):
+        """ cells can be accessed with (row, col) integers """
+        self.assertEqual(self.reader.cell((4, 6)), "Posten 3")
+        self.assertEqual(self.reader.cell((6, 4)), self.reader.cell("D6"))
+
+
+class TestStreamingReader(unittest.TestCase):
+    """ test loading test.xlsx in streaming mode """
+
+    @classmethod
+    def setUpClass(self):
+        self.cfg = Settings("test.ini")
+        self.reader = fd.XlsxReader(self.cfg, "test.xlsx", streaming=True)
+        self.full_reader = fd.XlsxReader(self.cfg, "test.xlsx")
+
+    def test_init_attributes(self):
+        """ initialising the general attributes works """
+        self.assertTrue(self.reader.streaming)
+        self.assertEqual(self.reader.start_persons, 5)
+        self.assertEqual(self.reader.start_footer, 8)
+
+    def test_init_persons(self):
+        """ person data is read correctly """
+        self.assertDictEqual(self.reader.persons.to_dict(), PERSONS)
+
+    def test_header_cells(self):
+        """ header cells match the ones from a fully loaded file """
+        for row in range(1, self.reader.start_persons):
+            for col in self.cfg.column_keys:
+                cell = fd.to_coord(col, row)
+                self.assertEqual(self.reader.cell(cell),
+                                 self.full_reader.cell(cell))
+                self.assertEqual(self.reader.get_cell(cell).style,
+                                 self.full_reader.get_cell(cell).style)
+
+    def test_person_cells_not_kept(self):
+        """ cells with person data are not kept """
+        self.assertIsNone(self.reader.cell("D6"))
+
 
 class TestCopyWriter(unittest.TestCase):
     """ create copy of test.xlsx
@@ -148,6 +234,68 @@ class TestCopyWriter(unittest.TestCase):
             cell = fd.to_coord(i, 6)
             self.compare_cell(cell)
 
+    def test_styles(self):
+        """ header styles are resolved once and shared """
+        self.assertEqual(self.writer.style_count, 1)
+        for col in self.cfg.column_keys:
+            cell = self.writer._wb.active[fd.to_coord(col, 1)]
+            self.assertEqual(cell.style, self.reader.active["A1"].style)
+
+
+class TestStreamWriter(unittest.TestCase):
+    """ create copy of test.xlsx using the write-only workbook
+
+    the saved file is loaded again and compared to test.xlsx
+
+    """
+
+    filename = "test_stream.xlsx"
+
+    @classmethod
+    def setUpClass(self):
+        self.cfg = Settings("test.ini")
+        self.reader = fd.XlsxReader(self.cfg, "test.xlsx", streaming=True)
+        self.writer = fd.XlsxStreamWriter(self.cfg, self.filename,
+                                          self.reader)
+        self.writer.fill(PERSONS)
+        self.writer.save()
+        self.orig = fd.openpyxl.load_workbook("test.xlsx").active
+        self.new = fd.openpyxl.load_workbook(self.filename).active
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.filename)
+
+    def test_attributes(self):
+        """ general attributes correct after filling """
+        self.assertEqual(self.writer._start_persons, 5)
+        self.assertEqual(self.writer._start_footer, 8)
+        self.assertEqual(self.new.freeze_panes, "D5")
+
+    def test_cells(self):
+        """ all configured cells are written correctly """
+        for row in range(1, 11):
+            for col in self.cfg.column_keys:
+                cell = fd.to_coord(col, row)
+                self.assertEqual(self.new[cell].value, self.orig[cell].value,
+                                 "Difference in cell "+cell)
+
+    def test_header_style(self):
+        """ header cells keep their style """
+        for col in self.cfg.column_keys:
+            cell = fd.to_coord(col, 1)
+            self.assertEqual(self.new[cell].style, self.orig[cell].style)
+
+    def test_style_count(self):
+        """ every distinct style is resolved once """
+        self.assertEqual(self.writer.style_count, 1)
+        self.assertEqual(list(self.writer._styles.keys()), ["Normal"])
+
+    def test_write_order(self):
+        """ rows can not be written out of order """
+        with self.assertRaises(RuntimeError):
+            self.writer._append(1, [])
+
 
 class TestWriterSimple(unittest.TestCase):
     """ tests for XlsxWriter using mock objects
@@ -184,8 +332,8 @@ class TestWriterSimple(unittest.TestCase):
         self.writer._cfg.footer_lines = 2
         self.writer.copy_footer()
         self.assertEqual(len(copy_calls), 14)
-        self.assertEqual(copy_calls[0], ("A2", "A8"))
-        self.assertEqual(copy_calls[-1], ("G3", "G9"))
+        self.assertEqual(copy_calls[0], ((2, 1), (8, 1)))
+        self.assertEqual(copy_calls[-1], ((3, 7), (9, 7)))
 
     def test_copyfooter_negative(self):
         """ copy_footer handles negativ numnber of footer lines correctly """
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_groupcache.py -- test cases for cevidblib.groupcache
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import asyncio
+import threading
+import cevidblib.groupcache as gc
+from constants import RESULT_DB
+
+class TestsGroupCache(unittest.TestCase):
+    """ test storing and expiring snapshots """
+
+    key = ("https://db.example.com/", 42)
+
+    def setUp(self):
+        self.cache = gc.GroupCache(ttl=60, max_entries=2)
+        self.loads = 0
+
+    def loader(self):
+        self.loads += 1
+        return [dict(row) for row in RESULT_DB]
+
+    def test_fetch(self):
+        """ members are loaded once and copies are returned """
+        first = self.cache.fetch(self.key, self.loader)
+        first[0]["last_name"] = "Changed"
+        second = self.cache.fetch(self.key, self.loader)
+        self.assertEqual(self.loads, 1)
+        self.assertListEqual(second, RESULT_DB)
+
+    def test_single_load(self):
+        """ concurrent fetches wait for one load, locks are dropped """
+        started = threading.Event()
+        release = threading.Event()
+        def slow_loader():
+            started.set()
+            release.wait(5)
+            return self.loader()
+        thread = threading.Thread(
+                target=self.cache.fetch, args=(self.key, slow_loader))
+        thread.start()
+        started.wait(5)
+        async def fetch():
+            return await self.cache.fetch_async(self.key, self.async_loader)
+        release.set()
+        self.assertListEqual(asyncio.run(fetch()), RESULT_DB)
+        thread.join()
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.cache._loading, {})
+
+    async def async_loader(self):
+        return self.loader()
+
+    def test_refresh(self):
+        """ refresh forces a new load """
+        self.cache.fetch(self.key, self.loader)
+        self.cache.fetch(self.key, self.loader, refresh=True)
+        self.assertEqual(self.loads, 2)
+
+    def test_ttl(self):
+        """ expired snapshots are not used """
+        self.cache.ttl = -1
+        self.cache.fetch(self.key, self.loader)
+        self.assertIsNone(self.cache.get(self.key))
+        self.cache.fetch(self.key, self.loader)
+        self.assertEqual(self.loads, 2)
+
+    def test_lru(self):
+        """ least recently used snapshot is dropped """
+        self.cache.put(1, RESULT_DB)
+        self.cache.put(2, RESULT_DB)
+        self.cache.get(1)
+        self.cache.put(3, RESULT_DB)
+        self.assertIsNotNone(self.cache.get(1))
+        self.assertIsNone(self.cache.get(2))
+        self.assertIsNotNone(self.cache.get(3))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_httpcache.py -- test cases for cevidblib.httpcache
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import os
+import shutil
+import tempfile
+import cevidblib.db as cdb
+from cevidblib.httpcache import HttpCache
+from mock_requests import MockRequests, MockRequestsResult
+
+class TestsCache(unittest.TestCase):
+    """ test storing and revalidating responses """
+
+    url = "https://test.example.com/"
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = HttpCache(self.dir, max_size=100)
+        self.mock = MockRequests()
+        self.db = cdb.CeviDB("abc", self.url, session=self.mock,
+                             cache=self.cache)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def result(self, body, etag="v1"):
+        return MockRequestsResult(headers={"ETag": etag}, content=body)
+
+    def test_key_by_token(self):
+        """ entries are not shared by tokens, the token is not stored """
+        self.assertNotEqual(self.cache.filename(self.url+"a.json?token=abc"),
+                            self.cache.filename(self.url+"a.json?token=def"))
+        self.assertEqual(self.cache.filename(self.url+"a.json?token=abc"),
+                         self.cache.filename(self.url+"a.json?token=abc"))
+        self.assertNotIn("abc", self.cache.filename(self.url+"a.json?token=abc"))
+        self.assertNotEqual(
+                self.cache.filename(self.url+"a.json?token=abc&page=2"),
+                self.cache.filename(self.url+"a.json?token=abc"))
+
+    def test_revalidate(self):
+        """ stored responses are revalidated and reused on 304 """
+        self.mock.results.append(self.result(b'{"people": []}'))
+        self.db.get_request("groups/42/people.json")
+        self.assertEqual(self.mock.calls[0].kwargs["headers"], {})
+        self.mock.results.append(MockRequestsResult(status_code=304))
+        res = self.db.get_request("groups/42/people.json")
+        self.assertEqual(self.mock.calls[1].kwargs["headers"],
+                         {"If-None-Match": "v1"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.content, b'{"people": []}')
+        self.assertEqual(res.json(), {"people": []})
+
+    def test_not_cacheable(self):
+        """ responses without validators are not stored """
+        self.mock.results.append(MockRequestsResult(content=b"{}"))
+        self.db.get_request("groups/42.json")
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_evict(self):
+        """ least recently used entries are deleted """
+        for nr in range(3):
+            self.mock.results.append(self.result(b"x"*40))
+            self.db.get_request("groups/{0}.json".format(nr))
+            os.utime(self.cache.filename(
+                    self.url+"groups/{0}.json?token=abc".format(nr)), (nr, nr))
+        files = os.listdir(self.dir)
+        self.assertEqual(len(files), 1)
+        self.assertIsNotNone(
+                self.cache.load(self.url+"groups/2.json?token=abc"))
+
+
+if __name__ == "__main__":
+    unittest.main()
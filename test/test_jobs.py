@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_jobs.py -- test cases for dbtool.jobs
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("..")
+
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import dbtool.jobs as jobs
+
+class MockRegistry(object):
+
+    def get(self, filename):
+        return filename
+
+class MockMaster(object):
+    runs = []
+
+    def __init__(self, settings=None, group_cache=None, report_hook=None,
+                 request_hook=None):
+        self.settings = settings
+
+    def run(self, filename, cert=None, backup=True, refresh=False):
+        MockMaster.runs.append((self.settings, filename, refresh))
+        if filename == "broken.xlsx":
+            raise RuntimeError("broken")
+
+
+class TestsJobs(unittest.TestCase):
+    """ test storing and processing jobs """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "jobs.sqlite")
+        self.store = jobs.JobStore(self.path)
+        self.orig_master = jobs.Master
+        jobs.Master = MockMaster
+        MockMaster.runs = []
+        self.queue = jobs.JobQueue(self.store, MockRegistry(), max_workers=1)
+
+    def tearDown(self):
+        jobs.Master = self.orig_master
+        shutil.rmtree(self.dir)
+
+    def test_store(self):
+        """ jobs are stored and updated """
+        job = self.store.create("user", "test.ini", "a.xlsx", "user.xlsx")
+        self.assertEqual(job.status, jobs.QUEUED)
+        self.assertEqual(job.pid, os.getpid())
+        self.store.update(job.id, jobs.FAILED, "error")
+        job = jobs.JobStore(self.path).get(job.id)
+        self.assertEqual(job.status, jobs.FAILED)
+        self.assertEqual(job.message, "error")
+        self.assertTrue(job.finished)
+        self.assertEqual(len(self.store.expired(-1)), 1)
+        self.store.delete(job.id)
+        self.assertIsNone(self.store.get(job.id))
+
+    def test_process(self):
+        """ jobs are run with their config and the status is set """
+        good = self.store.create("user", "test.ini", "a.xlsx", "user.xlsx",
+                                 refresh=True)
+        bad = self.store.create("user", "test.ini", "broken.xlsx", "user.xlsx")
+        self.queue.submit(good).result()
+        self.queue.submit(bad).result()
+        self.assertEqual(MockMaster.runs[0], ("test.ini", "a.xlsx", True))
+        self.assertEqual(self.store.get(good.id).status, jobs.DONE)
+        self.assertEqual(self.store.get(bad.id).status, jobs.FAILED)
+        self.assertIn("broken", self.store.get(bad.id).message)
+
+    def test_recover(self):
+        """ jobs of processes no longer running are taken over """
+        orphan = self.store.create("user", "test.ini", "a.xlsx", "user.xlsx")
+        own = self.store.create("user", "test.ini", "b.xlsx", "user.xlsx")
+        with sqlite3.connect(self.path) as conn:
+            # pid above the default maximum on linux
+            conn.execute("UPDATE jobs SET pid = ?, owner = ?, status = ?"
+                         " WHERE id = ?", (2**22+1, "{0}:1".format(2**22+1),
+                                           jobs.RUNNING, orphan.id))
+        claimed = self.store.claim_orphans()
+        self.assertEqual([job.id for job in claimed], [orphan.id])
+        self.assertEqual(self.store.get(orphan.id).pid, os.getpid())
+        self.assertEqual(self.store.claim_orphans(), [])
+
+    def test_recover_same_pid(self):
+        """ jobs of an earlier process with the same pid are taken over """
+        orphan = self.store.create("user", "test.ini", "a.xlsx", "user.xlsx")
+        with sqlite3.connect(self.path) as conn:
+            # e.g. pid 1 before a restart of the container
+            conn.execute("UPDATE jobs SET owner = ?, status = ? WHERE id = ?",
+                         ("{0}:0".format(os.getpid()), jobs.RUNNING,
+                          orphan.id))
+        claimed = self.store.claim_orphans()
+        self.assertEqual([job.id for job in claimed], [orphan.id])
+        self.assertEqual(claimed[0].owner, jobs.process_token())
+        self.assertEqual(claimed[0].status, jobs.QUEUED)
+
+    def test_process_alive(self):
+        """ processes are identified by pid and start time """
+        self.assertTrue(jobs.process_alive(jobs.process_token()))
+        parent = os.getppid()
+        self.assertTrue(jobs.process_alive(
+                "{0}:{1}".format(parent, jobs.process_start(parent))))
+        self.assertFalse(jobs.process_alive("{0}:0".format(os.getpid())))
+        self.assertFalse(jobs.process_alive(str(2**22+1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_loadtest.py -- test cases for the test login and the load test harness
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import os
+import shutil
+import tempfile
+import synthetic
+from dbtool import create_app
+from loadtest import run_loadtest, percentile
+
+
+class TestsLogin(unittest.TestCase):
+    """ /test-login is only available with TEST_LOGIN """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        synthetic.write_config(os.path.join(self.dir, "user.ini"),
+                               synthetic.Workload(persons=1),
+                               db_options={"allowed_users": "a@example.org"})
+        self.apps = []
+
+    def tearDown(self):
+        for app in self.apps:
+            app.config["METRICS"].close()
+        shutil.rmtree(self.dir)
+
+    def client(self, **config):
+        config.update({"SECRET_KEY": "test"})
+        self.apps.append(create_app(config, self.dir))
+        return self.apps[-1].test_client()
+
+    def test_disabled(self):
+        client = self.client()
+        self.assertEqual(client.get("/test-login/a@example.org").status_code,
+                         404)
+        self.assertEqual(client.get("/").status_code, 302)
+        # the route is not registered at all
+        self.assertNotIn("test_login.test_login", self.apps[-1].view_functions)
+
+    def test_enabled(self):
+        client = self.client(TEST_LOGIN=True)
+        self.assertEqual(client.get("/test-login/b@example.org").status_code,
+                         404)
+        self.assertEqual(client.get("/test-login/a@example.org").status_code,
+                         200)
+        self.assertEqual(client.get("/").status_code, 200)
+
+
+class TestsLoadTest(unittest.TestCase):
+    """ run a small load test """
+
+    def test_percentile(self):
+        values = [0.4, 0.1, 0.3, 0.2]
+        self.assertEqual(percentile(values, 0.5), 0.2)
+        self.assertEqual(percentile(values, 0.9), 0.4)
+        self.assertEqual(percentile(values, 1.0), 0.4)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_run(self):
+        report = run_loadtest(uploads=2, users=2, persons=30, processes=1,
+                              threads=2)
+        self.assertEqual(report["uploads"], 4)
+        self.assertEqual(report["errors"], 0, report["first_errors"])
+        self.assertGreater(report["throughput"], 0)
+        self.assertLessEqual(report["latency"]["p50"],
+                             report["latency"]["max"])
+        self.assertEqual(len(report["workers"]), 1)
+        self.assertGreater(report["workers"][0]["peak_rss_kib"], 0)
+        self.assertGreater(report["standin"]["requests"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
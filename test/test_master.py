@@ -16,15 +16,38 @@ add_path()
 add_path("../dbtool")
 
 import unittest
+import io
 import os
+import shutil
+import tempfile
 import time
+import openpyxl
 from cevidblib.master import Master
+from cevidblib.config import Settings
+from cevidblib.persontable import PersonTable
+from cevidblib.groupcache import GroupCache
 from constants import PERSONS, RESULT_DB
+from standin import start_server
 
 class MockCfg(object):
       column_keys = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
       pers_cols = [("A", "last_name"), ("B", "first_name"), ("C", "id")]
 
+class MockDB(object):
+
+    def __init__(self, without_nickname=()):
+        self.calls = []
+        self.without_nickname = without_nickname
+
+    def get_persons(self, pers_ids):
+        self.calls.append(pers_ids)
+        details = {}
+        for pid in pers_ids:
+            details[pid] = {"id": pid}
+            if pid not in self.without_nickname:
+                details[pid]["nickname"] = "N"+pid
+        return details
+
 class ConfigTesterFixture(unittest.TestCase):
 
     def setUp(self):
@@ -49,12 +72,270 @@ class ConfigTesterFixture(unittest.TestCase):
 
     def test_updatepersons(self):
         """ update_persons joins test lists correctly """
-        values = dict(PERSONS)
-        expect = dict(PERSONS)
+        persons = dict((pid, {"A": p[1], "B": p[2], "C": p[3], "D": p[4]})
+                       for pid, p in PERSONS.items())
+        values = PersonTable.from_dict(persons, MockCfg.column_keys)
+        expect = PersonTable.from_dict(persons, MockCfg.column_keys).to_dict()
+        expect["1"]["C"] = "1"
+        expect["3"]["C"] = "3"
         expect["4"] = {"A": "Neue", "B": "Eine", "C": "4",
          "D": "", "E": "", "F": "", "G": ''}
-        self.master.update_persons(values, RESULT_DB)
-        self.assertDictEqual(values, expect)
+        changes = self.master.update_persons(values, RESULT_DB)
+        self.assertDictEqual(values.to_dict(), expect)
+        self.assertEqual(changes.new, ["4"])
+
+    def test_updatepersons_dict(self):
+        """ update_persons still accepts a plain dictionary """
+        persons = dict((pid, {"A": p[1], "B": p[2], "C": p[3], "D": p[4]})
+                       for pid, p in PERSONS.items())
+        row = persons["1"]
+        changes = self.master.update_persons(persons, RESULT_DB)
+        self.assertEqual(changes.new, ["4"])
+        self.assertIs(persons["1"], row)
+        self.assertEqual(row["C"], "1")
+        self.assertEqual(row["D"], 10)
+        self.assertEqual(persons["4"]["A"], "Neue")
+        self.assertEqual(persons["4"]["G"], "")
+
+    def test_changeset(self):
+        """ changed cells are reported, equal values are ignored """
+        values = PersonTable.from_dict(
+                {"1": {"A": "Jemand", "B": "Irgend", "C": 1},
+                 "3": {"A": "Andres", "B": "Jemand", "C": 3}},
+                MockCfg.column_keys)
+        changes = self.master.update_persons(values, RESULT_DB[:2])
+        self.assertEqual(changes.new, [])
+        self.assertDictEqual(changes.changed, {"3": {"A": ("Andres", "Anders")}})
+        self.assertEqual(len(changes), 1)
+        changes = self.master.update_persons(values, RESULT_DB[:2])
+        self.assertEqual(len(changes), 0)
+
+    def test_add_details(self):
+        """ attributes missing in the listing are added from details """
+        self.master._db = MockDB()
+        values = [dict(row) for row in RESULT_DB]
+        self.master.add_details(values)
+        self.assertEqual(self.master._db.calls, [])
+        self.master.cfg.pers_cols = MockCfg.pers_cols+[("D", "nickname")]
+        values[1]["nickname"] = "Anders"
+        merged = self.master.add_details(values)
+        self.assertEqual(self.master._db.calls, [["1", "4"]])
+        self.assertEqual(merged[0]["nickname"], "N1")
+        self.assertEqual(merged[1]["nickname"], "Anders")
+        # the rows passed in are not modified
+        self.assertNotIn("nickname", values[0])
+        self.assertIs(merged[1], values[1])
+        del self.master.cfg.pers_cols
+
+    def test_group_key(self):
+        """ configs with different tokens do not share members """
+        settings = Settings("test.ini")
+        key = Master(settings).group_key
+        settings.api_token = "other"
+        self.assertNotEqual(Master(settings).group_key, key)
+        self.assertNotIn("other", Master(settings).group_key)
+
+    def test_connect_session(self):
+        """ the session given to Master is used by its CeviDB """
+        session = object()
+        master = Master(Settings("test.ini"), session=session)
+        self.assertIs(master.connect()._session, session)
+
+    def test_unknown_fields(self):
+        """ attributes the DB does not provide are requested only once """
+        self.master._db = MockDB()
+        self.master.cfg.pers_cols = MockCfg.pers_cols+[("D", "nickame")]
+        values = [dict(row) for row in RESULT_DB]
+        with self.assertLogs("cevidblib", "WARNING"):
+            values = self.master.add_details(values)
+        self.assertEqual(self.master._db.calls, [["1", "3", "4"]])
+        self.assertTrue(all("nickame" not in row for row in values))
+        values = [dict(row) for row in RESULT_DB]
+        self.master.add_details(values)
+        self.assertEqual(self.master._db.calls, [["1", "3", "4"]])
+        del self.master.cfg.pers_cols
+
+    def test_partial_details(self):
+        """ attributes missing for some persons do not overwrite the file """
+        self.master._db = MockDB(without_nickname=["1", "3"])
+        self.master.cfg.pers_cols = MockCfg.pers_cols+[("D", "nickname")]
+        values = self.master.add_details([dict(row) for row in RESULT_DB])
+        self.assertEqual([row.get("nickname") for row in values],
+                         [None, None, "N4"])
+        self.assertNotIn("nickname", values[0])
+        persons = PersonTable.from_dict(
+                {"1": {"A": "Jemand", "B": "Irgend", "C": "1", "D": "old"}},
+                MockCfg.column_keys)
+        changes = self.master.update_persons(persons, values)
+        self.assertEqual(persons["1"]["D"], "old")
+        self.assertEqual(persons["4"]["D"], "N4")
+        self.assertEqual(changes.changed, {})
+        # the attribute is provided by the DB, it is requested again
+        self.master.add_details([dict(row) for row in RESULT_DB])
+        self.assertEqual(len(self.master._db.calls), 2)
+        del self.master.cfg.pers_cols
+
+class RunTester(unittest.TestCase):
+    """ run Master on a copy of test.xlsx with a fixed DB result """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.xlsx")
+        shutil.copy("test.xlsx", self.filename)
+        self.master = Master(Settings("test.ini"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_unchanged(self):
+        """ file is not rewritten if the DB has no changes """
+        rows = [{"id": str(i), "last_name": PERSONS[str(i)][1],
+                 "first_name": PERSONS[str(i)][2]} for i in range(1, 4)]
+        self.master.fetch = lambda cert, refresh: rows
+        os.utime(self.filename, ns=(0, 0))
+        changes = self.master.run(self.filename, cert=None)
+        self.assertEqual(len(changes), 0)
+        self.assertIsNone(self.master._writer)
+        self.assertEqual(os.stat(self.filename).st_mtime_ns, 0)
+        self.assertEqual(os.listdir(self.dir), ["test.xlsx"])
+
+    def test_process(self):
+        """ file-like objects are updated in memory """
+        self.master.fetch = lambda cert, refresh: [dict(r) for r in RESULT_DB]
+        with open(self.filename, "rb") as xlsx:
+            source = io.BytesIO(xlsx.read())
+        target = self.master.process(source, cert=None)
+        self.assertIsNot(target, source)
+        self.assertEqual(self.master.changes.new, ["4"])
+        ws = openpyxl.load_workbook(target).active
+        self.assertEqual(ws["A8"].value, "Neue")
+        # unchanged source is returned as it is
+        self.master.fetch = lambda cert, refresh: []
+        self.assertIs(self.master.process(source, cert=None), source)
+        self.assertEqual(source.tell(), 0)
+
+    def test_changed(self):
+        """ file is replaced if a person was added """
+        self.master.fetch = lambda cert, refresh: [dict(r) for r in RESULT_DB]
+        changes = self.master.run(self.filename, cert=None, backup=False)
+        self.assertEqual(changes.new, ["4"])
+        self.assertEqual(os.listdir(self.dir), ["test.xlsx"])
+        ws = openpyxl.load_workbook(self.filename).active
+        self.assertEqual(ws["A8"].value, "Neue")
+
+    def test_backup(self):
+        """ previous version is kept as backup """
+        self.master.fetch = lambda cert, refresh: [dict(r) for r in RESULT_DB]
+        self.master.run(self.filename, cert=None)
+        backupname = self.master.backup_name(self.filename)
+        self.assertCountEqual(os.listdir(self.dir),
+                              ["test.xlsx", os.path.basename(backupname)])
+        ws = openpyxl.load_workbook(backupname).active
+        self.assertIsNone(ws["A8"].value)
+        with self.assertRaises(RuntimeError):
+            self.master.run(self.filename, cert=None)
+
+    def test_report(self):
+        """ phases and counters are passed to the report hook """
+        reports = []
+        self.master = Master(Settings("test.ini"), report_hook=reports.append)
+        self.master.fetch = lambda cert, refresh: [dict(r) for r in RESULT_DB]
+        self.master.run(self.filename, cert=None)
+        self.assertEqual(reports, [self.master.report])
+        report = reports[0]
+        self.assertEqual(list(report.phases),
+                         ["read", "fetch", "update", "write", "backup"])
+        self.assertEqual(report.counters["rows_read"], 3)
+        self.assertEqual(report.counters["persons_fetched"], len(RESULT_DB))
+        self.assertEqual(report.counters["persons_new"], 1)
+        self.assertEqual(report.counters["cells_written"],
+                         4*len(self.master.cfg.column_keys))
+        self.assertEqual(report.counters["bytes_saved"],
+                         os.path.getsize(self.filename))
+        self.assertAlmostEqual(report.total, sum(report.phases.values()))
+        # nothing written, no write phase
+        self.master.fetch = lambda cert, refresh: []
+        with open(self.filename, "rb") as xlsx:
+            self.master.process(io.BytesIO(xlsx.read()), cert=None)
+        self.assertEqual(list(reports[1].phases), ["read", "fetch", "update"])
+        self.assertNotIn("bytes_saved", reports[1].counters)
+
+    def test_failure(self):
+        """ file is left untouched if the update fails """
+        def fail(cert, refresh):
+            raise IOError("DB not reachable")
+        self.master.fetch = fail
+        with self.assertRaises(IOError):
+            self.master.run(self.filename, cert=None)
+        self.assertEqual(os.listdir(self.dir), ["test.xlsx"])
+
+    def test_failure_report(self):
+        """ partial report of a failed update is passed to the hook """
+        def fail(cert, refresh):
+            raise IOError("DB not reachable")
+        reports = []
+        self.master = Master(Settings("test.ini"), report_hook=reports.append)
+        self.master.fetch = fail
+        with self.assertRaises(IOError):
+            self.master.run(self.filename, cert=None)
+        self.assertEqual(reports, [self.master.report])
+        self.assertEqual(list(reports[0].phases), ["read", "fetch"])
+        self.assertEqual(reports[0].error, "OSError: DB not reachable")
+        with open(self.filename, "rb") as xlsx:
+            with self.assertRaises(IOError):
+                self.master.process(io.BytesIO(xlsx.read()), cert=None)
+        self.assertEqual(len(reports), 2)
+        self.assertIn("error='OSError: DB not reachable'", str(reports[1]))
+
+
+
+class FetchTester(unittest.TestCase):
+    """ fetch members from the stand-in server through the group cache """
+
+    @classmethod
+    def setUpClass(self):
+        self.server = start_server(persons=5)
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch_twice(self, async_client):
+        self.server.stats["requests"] = 0
+        settings = Settings("test.ini")
+        settings.db_url = self.server.url
+        settings.api_token = self.server.token
+        settings.async_client = async_client
+        cache = GroupCache()
+        for nr in range(2):
+            list_db = Master(settings, group_cache=cache).fetch(cert=None)
+        self.assertEqual(len(list_db), 5)
+        self.assertEqual(self.server.stats["requests"], 1)
+        # the details are cached with the members
+        settings.pers_cols = settings.pers_cols+[("Z", "email")]
+        list_db = Master(settings, group_cache=cache).fetch(cert=None)
+        requests = self.server.stats["requests"]
+        self.assertGreater(requests, 1)
+        list_db = Master(settings, group_cache=cache).fetch(cert=None)
+        self.assertEqual(self.server.stats["requests"], requests)
+        self.assertEqual(list_db[0]["email"], "p1@example.org")
+
+    def test_fetch(self):
+        """ the second fetch uses the group cache """
+        self.fetch_twice(False)
+
+    def test_fetch_async(self):
+        """ the asyncio client uses the group cache as well """
+        self.fetch_twice(True)
+
+    def test_cache_key(self):
+        """ configs with other person-columns do not share snapshots """
+        settings = Settings("test.ini")
+        key = Master(settings).cache_key
+        self.assertEqual(key[:3], Master(settings).group_key)
+        settings.pers_cols = settings.pers_cols+[("Z", "email")]
+        self.assertNotEqual(Master(settings).cache_key, key)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_metrics.py -- test cases for the metrics shared between processes
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from flask import Flask
+from dbtool.metrics import Metrics, TIME_BUCKETS
+from dbtool.jobs import JobStore, RUNNING, process_token
+from dbtool.cevidblib import db
+from dbtool.cevidblib.report import RunReport
+from dbtool import main
+from standin import start_server
+
+
+def record_in_child(directory):
+    metrics = Metrics(directory)
+    metrics.inc("cevidb_requests_total", {"endpoint": "/x", "status": "200"})
+    metrics.observe("dbtool_upload_bytes", 50000)
+    # the child exits without running atexit
+    metrics.close()
+
+
+def series(text, prefix):
+    """ {sample: value} of the lines starting with prefix """
+    return dict(line.rsplit(" ", 1) for line in text.splitlines()
+                if line.startswith(prefix))
+
+
+class TestsMetrics(unittest.TestCase):
+    """ collect and render samples """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.metrics = Metrics(self.dir)
+
+    def tearDown(self):
+        self.metrics.close()
+        shutil.rmtree(self.dir)
+
+    def run_child(self, target):
+        context = multiprocessing.get_context("fork")
+        child = context.Process(target=target, args=(self.dir,))
+        child.start()
+        child.join()
+        return child.pid
+
+    def test_histogram(self):
+        """ buckets are cumulative and end with +Inf """
+        self.metrics.observe("dbtool_request_duration_seconds", 0.02,
+                             {"route": "/"})
+        self.metrics.observe("dbtool_request_duration_seconds", 100,
+                             {"route": "/"})
+        text = self.metrics.render()
+        self.assertIn("# TYPE dbtool_request_duration_seconds histogram", text)
+        buckets = series(text, "dbtool_request_duration_seconds_bucket")
+        self.assertEqual(len(buckets), len(TIME_BUCKETS)+1)
+        self.assertEqual(buckets[
+            'dbtool_request_duration_seconds_bucket{route="/",le="0.01"}'], "0")
+        self.assertEqual(buckets[
+            'dbtool_request_duration_seconds_bucket{route="/",le="0.025"}'], "1")
+        self.assertEqual(buckets[
+            'dbtool_request_duration_seconds_bucket{route="/",le="+Inf"}'], "2")
+        self.assertIn('dbtool_request_duration_seconds_sum{route="/"} 100.02',
+                      text)
+        self.assertIn('dbtool_request_duration_seconds_count{route="/"} 2',
+                      text)
+
+    def test_labels(self):
+        """ label values are escaped """
+        self.metrics.inc("cevidb_requests_total",
+                         {"endpoint": 'a"b\\c', "status": "200"})
+        self.assertIn('cevidb_requests_total{endpoint="a\\"b\\\\c",'
+                      'status="200"} 1', self.metrics.render())
+
+    def test_processes(self):
+        """ samples of other processes are added up """
+        self.metrics.inc("cevidb_requests_total",
+                         {"endpoint": "/x", "status": "200"})
+        self.run_child(record_in_child)
+        self.run_child(record_in_child)
+        text = self.metrics.render()
+        self.assertIn('cevidb_requests_total{endpoint="/x",status="200"} 3',
+                      text)
+        self.assertIn("dbtool_upload_bytes_count 2", text)
+        # another object on the same directory sees the same values
+        self.assertEqual(Metrics(self.dir).render(), text)
+
+    def test_compact(self):
+        """ files of finished processes are merged """
+        self.run_child(record_in_child)
+        self.metrics.inc("cevidb_requests_total",
+                         {"endpoint": "/x", "status": "200"})
+        text = self.metrics.render()
+        self.metrics.compact()
+        self.assertCountEqual(os.listdir(self.dir),
+                              [process_token().replace(":", "-")+".json",
+                               "archive.json", "compact.lock"])
+        self.assertEqual(self.metrics.render(), text)
+
+    def test_compact_legacy(self):
+        """ files named by pid only are merged as well """
+        self.run_child(record_in_child)
+        name = os.listdir(self.dir)[0]
+        os.rename(os.path.join(self.dir, name),
+                  os.path.join(self.dir, name.split("-")[0]+".json"))
+        self.metrics.compact()
+        self.assertCountEqual(os.listdir(self.dir),
+                              ["archive.json", "compact.lock"])
+        self.assertIn("dbtool_upload_bytes_count 1", self.metrics.render())
+
+    def test_lazy_flush(self):
+        """ samples are written by the flush thread, not when recorded """
+        metrics = Metrics(self.dir, flush_interval=0.05)
+        metrics.inc("cevidb_requests_total",
+                    {"endpoint": "/x", "status": "200"})
+        self.assertEqual(os.listdir(self.dir), [])
+        for nr in range(100):
+            if len(os.listdir(self.dir)) > 0:
+                break
+            time.sleep(0.01)
+        self.assertIn('cevidb_requests_total{endpoint="/x",status="200"} 1',
+                      Metrics(self.dir).render())
+        metrics.close()
+
+    def test_errors(self):
+        """ metrics never raise, even without a writable directory """
+        filename = os.path.join(self.dir, "file")
+        open(filename, "w").close()
+        metrics = Metrics(os.path.join(filename, "metrics"))
+        with self.assertLogs("dbtool.metrics"):
+            metrics.inc("cevidb_requests_total")
+            metrics.observe("no_such_metric", 1)
+            metrics.close()
+
+    def test_pickle(self):
+        """ copies in worker processes start without samples """
+        self.metrics.inc("cevidb_requests_total",
+                         {"endpoint": "/x", "status": "200"})
+        copy = pickle.loads(pickle.dumps(self.metrics))
+        self.assertEqual(copy.directory, self.dir)
+        self.assertEqual(copy._samples, {})
+
+    def test_report(self):
+        """ phases of a RunReport are recorded """
+        report = RunReport()
+        report.phases = {"read": 0.2, "fetch": 1.5}
+        self.metrics.observe_report(report)
+        text = self.metrics.render()
+        self.assertIn('dbtool_phase_duration_seconds_count{phase="fetch"} 1',
+                      text)
+        self.assertIn('dbtool_phase_duration_seconds_sum{phase="read"} 0.2',
+                      text)
+        self.assertIn('dbtool_updates_total{result="ok"} 1', text)
+        # failed updates are counted separately
+        report.fail(IOError("DB not reachable"))
+        self.metrics.observe_report(report)
+        text = self.metrics.render()
+        self.assertIn('dbtool_updates_total{result="failed"} 1', text)
+
+
+class TestsEndpoint(unittest.TestCase):
+    """ /metrics of the main blueprint """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        app = Flask("dbtool")
+        app.config["METRICS"] = Metrics(os.path.join(self.dir, "metrics"))
+        app.config["JOB_STORE"] = JobStore(os.path.join(self.dir, "jobs.sqlite"))
+        app.register_blueprint(main.bp)
+        self.app = app
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.app.config["METRICS"].close()
+        shutil.rmtree(self.dir)
+
+    def test_metrics(self):
+        """ requests and jobs are exposed """
+        store = self.app.config["JOB_STORE"]
+        job = store.create("user", "config.ini", "upload.xlsx", "x.xlsx")
+        store.create("user", "config.ini", "upload.xlsx", "x.xlsx")
+        store.update(job.id, RUNNING)
+        self.client.get("/metrics")
+        res = self.client.get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain"))
+        text = res.get_data(as_text=True)
+        self.assertIn('dbtool_request_duration_seconds_count{route="/metrics"} 1',
+                      text)
+        self.assertIn('dbtool_jobs{status="queued"} 1', text)
+        self.assertIn('dbtool_jobs{status="running"} 1', text)
+
+    def test_db_requests(self):
+        """ requests of CeviDB are counted by endpoint and status """
+        server = start_server(persons=5)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        cevidb = db.CeviDB("standin", server.url, session=db.create_session(),
+                           request_hook=self.app.config["METRICS"].db_request)
+        cevidb.get_group_members(12)
+        cevidb.get_person("3")
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('cevidb_requests_total{endpoint="/groups/{id}/people.json",'
+                      'status="200"} 1', text)
+        # the redirected request first fails without token
+        self.assertIn('cevidb_requests_total{endpoint="/people/{id}.json",'
+                      'status="401"} 1', text)
+        self.assertIn('cevidb_requests_total{endpoint='
+                      '"/groups/{id}/people/{id}.json",status="200"} 1', text)
+        self.assertIn('cevidb_request_duration_seconds_count{endpoint='
+                      '"/groups/{id}/people.json"} 1', text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_persontable.py -- test cases for cevidblib.persontable
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+from cevidblib.persontable import PersonTable, PersonRow
+from constants import PERSONS
+
+COLUMNS = [1, 2, 3, 4, 5, 6, 7]
+
+
+class TableTester(unittest.TestCase):
+
+    def setUp(self):
+        self.table = PersonTable.from_dict(PERSONS, COLUMNS)
+
+    def test_roundtrip(self):
+        """ dictionary is stored and returned unchanged """
+        self.assertEqual(len(self.table), 3)
+        self.assertDictEqual(self.table.to_dict(), PERSONS)
+
+    def test_columns(self):
+        """ values are stored by column in the order of ids """
+        ids = self.table.ids
+        self.assertEqual(self.table.column(1),
+                         [PERSONS[pid][1] for pid in ids])
+        self.assertEqual(self.table.position(ids[1]), 1)
+
+    def test_row_view(self):
+        """ rows read and write the columns of the table """
+        row = self.table["3"]
+        self.assertIsInstance(row, PersonRow)
+        self.assertEqual(row[1], "Anders")
+        row[4] = 99
+        self.assertEqual(self.table["3"][4], 99)
+        self.assertEqual(self.table.column(4)[self.table.position("3")], 99)
+        self.assertEqual(row.get(42, "x"), "x")
+        with self.assertRaises(KeyError):
+            row[42] = 1
+        with self.assertRaises(AttributeError):
+            row.extra = 1
+
+    def test_add(self):
+        """ new persons are appended, existing ones overwritten """
+        row = self.table.add("4")
+        self.assertEqual(row.to_dict(), dict((col, "") for col in COLUMNS))
+        self.assertIn("4", self.table)
+        self.table.add("1", {1: "Neu"}, default=None)
+        self.assertEqual(len(self.table), 4)
+        self.assertEqual(self.table["1"][1], "Neu")
+        self.assertIsNone(self.table["1"][2])
+
+    def test_missing(self):
+        """ unknown ids raise KeyError """
+        self.assertNotIn("9", self.table)
+        self.assertIsNone(self.table.get("9"))
+        with self.assertRaises(KeyError):
+            self.table["9"]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_pool.py -- test cases for cevidblib.pool using a local server
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import openpyxl
+from cevidblib.config import Settings
+from cevidblib.pool import MasterPool
+from constants import RESULT_DB
+
+class GroupHandler(BaseHTTPRequestHandler):
+    """ answer every request with the group from RESULT_DB """
+
+    delay = 0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({"people": RESULT_DB}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestsPool(unittest.TestCase):
+    """ run Master in worker processes """
+
+    @classmethod
+    def setUpClass(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), GroupHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.cfg = Settings("test.ini")
+        self.cfg.db_url = "http://127.0.0.1:{0}/".format(
+                self.server.server_address[1])
+        self.reports = []
+        self.pool = MasterPool(max_workers=1, timeout=1,
+                               report_hook=self.reports.append)
+
+    @classmethod
+    def tearDownClass(self):
+        self.pool.shutdown()
+        self.server.shutdown()
+
+    def setUp(self):
+        GroupHandler.delay = 0
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, "test.xlsx")
+        shutil.copy("test.xlsx", self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_run(self):
+        """ file is updated by the worker process """
+        self.pool.run(self.cfg, self.filename)
+        ws = openpyxl.load_workbook(self.filename).active
+        self.assertEqual(ws["A8"].value, "Neue")
+        self.assertEqual(os.listdir(self.dir), ["test.xlsx"])
+        # report of the worker is passed to the hook in this process
+        self.assertEqual(self.reports[-1].counters["persons_new"], 1)
+        # the worker reports its process id
+        pids = self.pool.pids()
+        self.assertEqual(len(pids), 1)
+        self.assertNotEqual(pids[0], os.getpid())
+
+    def test_process(self):
+        """ file content is updated in memory by the worker process """
+        with open("test.xlsx", "rb") as xlsx:
+            data = self.pool.process(self.cfg, xlsx.read())
+        ws = openpyxl.load_workbook(io.BytesIO(data)).active
+        self.assertEqual(ws["A8"].value, "Neue")
+
+    def test_timeout(self):
+        """ jobs running too long are aborted and the file is restored """
+        GroupHandler.delay = 3
+        with self.assertRaises(RuntimeError) as cm:
+            self.pool.run(self.cfg, self.filename, backup=True)
+        self.assertIn("timed out", str(cm.exception))
+        self.assertEqual(os.listdir(self.dir), ["test.xlsx"])
+        # the partial report is sent back with the error
+        report = self.reports[-1]
+        self.assertIn("timed out", report.error)
+        self.assertIn("fetch", report.phases)
+
+
+if __name__ == "__main__":
+    unittest.main()
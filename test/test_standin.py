@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_standin.py -- test cases for CeviDB against the local stand-in server
+
+"""
+# ensure path is set correctly
+from path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+from requests.exceptions import HTTPError
+from cevidblib.db import CeviDB, create_session
+from standin import start_server
+
+
+class TestsStandin(unittest.TestCase):
+    """ query the stand-in server with CeviDB """
+
+    @classmethod
+    def setUpClass(self):
+        self.server = start_server(persons=25, per_page=10, group_id=7)
+
+    @classmethod
+    def tearDownClass(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def db(self, token="standin", **kwargs):
+        return CeviDB(token, self.server.url, session=create_session(),
+                      **kwargs)
+
+    def test_group_members(self):
+        people = self.db().get_group_members(7)
+        self.assertEqual([p["id"] for p in people],
+                         [str(nr) for nr in range(1, 26)])
+
+    def test_next_page_link(self):
+        page = self.db().get_request("groups/7/people.json").json()
+        self.assertEqual(page["total_pages"], 3)
+        people = self.db().get_link(page["next_page_link"]).json()["people"]
+        self.assertEqual(people[0]["id"], "11")
+
+    def test_person_redirect(self):
+        res = self.db().get_request("people/3.json")
+        self.assertTrue(res.url.split("?")[0].endswith(
+            "groups/7/people/3.json"))
+        person = res.json()["people"][0]
+        self.assertEqual(person["id"], "3")
+        self.assertIn("email", person)
+
+    def test_group(self):
+        self.assertEqual(self.db().get_group(7)["groups"][0]["id"], "7")
+
+    def test_token(self):
+        with self.assertRaises(HTTPError) as cm:
+            self.db(token="wrong").get_group(7)
+        self.assertEqual(cm.exception.response.status_code, 401)
+
+    def test_not_modified(self):
+        res = self.db().get_request("groups/7.json")
+        session = create_session()
+        again = session.get(res.url,
+                            headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(again.status_code, 304)
+
+    def test_invalid_page(self):
+        with self.assertRaises(HTTPError) as cm:
+            self.db().get_request("groups/7/people.json", "page=x")
+        self.assertEqual(cm.exception.response.status_code, 400)
+
+
+class TestsStandinFailures(unittest.TestCase):
+    """ error rate and rate limit of the stand-in server """
+
+    def run_server(self, **options):
+        server = start_server(persons=5, **options)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_errors(self):
+        server = self.run_server(error_rate=1)
+        cevidb = CeviDB("standin", server.url, session=create_session(),
+                        retries=1)
+        with self.assertRaises(HTTPError) as cm:
+            cevidb.get_persons(["1"])
+        self.assertEqual(cm.exception.response.status_code, 500)
+        self.assertEqual(server.stats["errors"], 2)
+
+    def test_rate_limit(self):
+        server = self.run_server(rate_limit=2)
+        cevidb = CeviDB("standin", server.url, session=create_session())
+        with self.assertRaises(HTTPError) as cm:
+            for nr in range(5):
+                cevidb.get_group(1)
+        self.assertEqual(cm.exception.response.status_code, 429)
+        self.assertEqual(server.stats["throttled"], 1)
+
+    def test_slow_rate_limit(self):
+        server = self.run_server(rate_limit=0.5)
+        cevidb = CeviDB("standin", server.url, session=create_session())
+        self.assertEqual(cevidb.get_group(1)["groups"][0]["id"], "1")
+        with self.assertRaises(HTTPError) as cm:
+            cevidb.get_group(1)
+        self.assertEqual(cm.exception.response.status_code, 429)
+
+
+if __name__ == '__main__':
+    unittest.main()
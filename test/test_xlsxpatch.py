@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+""" cevidbtool - manage lists on CeviDB groups
+
+Copyright 2014, Nicola Chiapolini v/o Carbon, carbon@cevi.ch
+
+License: GNU General Public License version 3,
+         or (at your option) any later version.
+
+
+test_xlsxpatch.py -- test cases for cevidblib.xlsxpatch
+
+"""
+# ensure path is set correctly
+from  path_helper import add_path
+add_path()
+add_path("../dbtool")
+
+import unittest
+import os
+import zipfile
+import cevidblib.filedict as fd
+import cevidblib.xlsxpatch as xp
+from cevidblib.config import Settings
+from constants import PERSONS
+
+
+class HelperTests(unittest.TestCase):
+    """ test helper functions from xlsxpatch module """
+
+    def test_cell_xml(self):
+        """ values are written with the correct cell type """
+        self.assertEqual(xp.cell_xml("A1", None), "")
+        self.assertEqual(xp.cell_xml("A1", None, "2"), '<c r="A1" s="2"/>')
+        self.assertEqual(xp.cell_xml("A1", 3), '<c r="A1"><v>3</v></c>')
+        self.assertEqual(xp.cell_xml("A1", True), '<c r="A1" t="b"><v>1</v></c>')
+        self.assertEqual(xp.cell_xml("A1", "=SUM(A2:A3)"),
+                         '<c r="A1"><f>SUM(A2:A3)</f></c>')
+        self.assertEqual(xp.cell_xml("A1", "a<b"),
+                         '<c r="A1" t="inlineStr"><is><t>a&lt;b</t></is></c>')
+        self.assertEqual(xp.cell_xml("A1", "a\x01b"),
+                         '<c r="A1" t="inlineStr"><is><t>ab</t></is></c>')
+        self.assertEqual(xp.cell_xml("A1", float("nan"), "2"),
+                         '<c r="A1" s="2"/>')
+        self.assertEqual(xp.cell_xml("A1", float("inf")), "")
+
+
+class TestPatcher(unittest.TestCase):
+    """ patch copy of test.xlsx with unchanged persons
+
+    the saved file is loaded again and compared to test.xlsx
+
+    """
+
+    filename = "test_patch.xlsx"
+
+    @classmethod
+    def setUpClass(self):
+        self.cfg = Settings("test.ini")
+        self.reader = fd.XlsxReader(self.cfg, "test.xlsx", streaming=True)
+        self.writer = xp.XlsxPatcher(self.cfg, self.filename, self.reader)
+        self.writer.fill(PERSONS)
+        self.writer.save()
+        self.orig = fd.openpyxl.load_workbook("test.xlsx").active
+        self.new = fd.openpyxl.load_workbook(self.filename).active
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.filename)
+
+    def test_cells(self):
+        """ all configured cells are written correctly """
+        for row in range(1, 11):
+            for col in self.cfg.column_keys:
+                cell = fd.to_coord(col, row)
+                self.assertEqual(self.new[cell].value, self.orig[cell].value,
+                                 "Difference in cell "+cell)
+
+    def test_freeze_panes(self):
+        """ view is frozen below header and after freeze column """
+        self.assertEqual(self.new.freeze_panes, "D5")
+
+    def test_styles(self):
+        """ cells keep their style """
+        for row in range(1, 11):
+            for col in self.cfg.column_keys:
+                cell = fd.to_coord(col, row)
+                self.assertEqual(self.new[cell].style, self.orig[cell].style)
+
+    def test_other_members(self):
+        """ members except the active sheet are copied unchanged """
+        with zipfile.ZipFile("test.xlsx") as orig, \
+                zipfile.ZipFile(self.filename) as new:
+            for info in orig.infolist():
+                if info.filename in (self.writer._sheet_path,
+                                     self.writer._calc_chain):
+                    continue
+                self.assertEqual(orig.read(info), new.read(info.filename),
+                                 info.filename)
+
+
+class TestPatcherNewPerson(unittest.TestCase):
+    """ patch copy of test.xlsx with an additional person """
+
+    filename = "test_patch_new.xlsx"
+
+    @classmethod
+    def setUpClass(self):
+        self.cfg = Settings("test.ini")
+        self.reader = fd.XlsxReader(self.cfg, "test.xlsx", streaming=True)
+        self.persons = dict(PERSONS)
+        self.persons["4"] = {1: "Neue", 2: "Eine", 3: "4",
+                             4: "", 5: "", 6: "", 7: "=SUM(D{row}:F{row})"}
+        self.writer = xp.XlsxPatcher(self.cfg, self.filename, self.reader)
+        self.writer.fill(self.persons)
+        self.writer.save()
+        self.new = fd.openpyxl.load_workbook(self.filename).active
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.filename)
+
+    def test_attributes(self):
+        """ footer is moved by one row """
+        self.assertEqual(self.writer._start_footer, 9)
+        self.assertEqual(self.writer._shift_row(8), 9)
+        self.assertEqual(self.writer._shift_ref("A1:G7"), "A1:G8")
+        self.assertEqual(self.writer._shift_ref("A5"), "A5")
+
+    def test_new_row(self):
+        """ new person is written in sorted order with formula """
+        self.assertEqual(self.new["A8"].value, "Neue")
+        self.assertEqual(self.new["G8"].value, "=SUM(D8:F8)")
+
+
+class TestPatcherRows(unittest.TestCase):
+    """ patch rows with attributes and cells outside the configuration
+
+    a new person is sorted before all others, so every old person
+    row is moved down by one
+
+    """
+
+    source = "test_patch_rows_in.xlsx"
+    filename = "test_patch_rows.xlsx"
+
+    @classmethod
+    def setUpClass(self):
+        self.cfg = Settings("test.ini")
+        wb = fd.openpyxl.load_workbook("test.xlsx")
+        ws = wb.active
+        ws.row_dimensions[6].height = 30
+        ws.row_dimensions[7].hidden = True
+        ws["H5"] = "note 3"
+        ws["H6"] = "=D6*2"
+        wb.save(self.source)
+        self.reader = fd.XlsxReader(self.cfg, self.source, streaming=True)
+        self.persons = dict(PERSONS)
+        self.persons["4"] = {1: "Aaa\x01", 2: "Eine", 3: "4",
+                             4: float("nan"), 5: "", 6: "", 7: ""}
+        self.writer = xp.XlsxPatcher(self.cfg, self.filename, self.reader)
+        self.writer.fill(self.persons)
+        self.writer.save()
+        self.new = fd.openpyxl.load_workbook(self.filename).active
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.source)
+        os.remove(self.filename)
+
+    def test_new_row(self):
+        """ illegal characters and nan are not written """
+        self.assertEqual(self.new["A5"].value, "Aaa")
+        self.assertIsNone(self.new["D5"].value)
+
+    def test_row_attributes(self):
+        """ rows keep height and visibility """
+        self.assertEqual(self.new.row_dimensions[7].height, 30)
+        self.assertTrue(self.new.row_dimensions[8].hidden)
+        self.assertFalse(self.new.row_dimensions[6].hidden)
+
+    def test_other_cells(self):
+        """ cells outside the configured columns move with their row """
+        self.assertEqual(self.new["A6"].value, "Anders")
+        self.assertEqual(self.new["H6"].value, "note 3")
+        self.assertEqual(self.new["H7"].value, "=D7*2")
+        self.assertEqual(self.new["G7"].value, "=SUM(D7:F7)")
+
+
+class TestPatcherReferences(unittest.TestCase):
+    """ references from other members to rows moved by new persons """
+
+    source = "test_patch_refs_in.xlsx"
+    filename = "test_patch_refs.xlsx"
+
+    @classmethod
+    def setUpClass(self):
+        self.cfg = Settings("test.ini")
+        wb = fd.openpyxl.load_workbook("test.xlsx")
+        other = wb.create_sheet("Auswertung")
+        other["A1"] = "=SUM(Sheet!G5:G7)"
+        other["A2"] = "=Sheet!B8"
+        other["A3"] = "='Sheet'!$A$5+Auswertung!A8"
+        other["A4"] = "=SUM(Sheet!G:G)"
+        wb.defined_names["Totals"] = fd.openpyxl.workbook.defined_name \
+                .DefinedName("Totals", attr_text="Sheet!$G$5:$G$7")
+        wb.save(self.source)
+        self.reader = fd.XlsxReader(self.cfg, self.source, streaming=True)
+        self.persons = dict(PERSONS)
+        for pers_id in ("4", "5"):
+            self.persons[pers_id] = {1: "Neue", 2: "N"+pers_id, 3: pers_id,
+                                     4: "", 5: "", 6: "", 7: ""}
+        self.writer = xp.XlsxPatcher(self.cfg, self.filename, self.reader)
+        self.writer.fill(self.persons)
+        self.writer.save()
+        self.new = fd.openpyxl.load_workbook(self.filename)
+
+    @classmethod
+    def tearDownClass(self):
+        os.remove(self.source)
+        os.remove(self.filename)
+
+    def test_defined_name(self):
+        """ defined names covering all persons grow """
+        self.assertEqual(self.new.defined_names["Totals"].attr_text,
+                         "Sheet!$G$5:$G$9")
+
+    def test_other_sheet(self):
+        """ formulas of other sheets refer to the moved rows """
+        other = self.new["Auswertung"]
+        self.assertEqual(other["A1"].value, "=SUM(Sheet!G5:G9)")
+        self.assertEqual(other["A2"].value, "=Sheet!B10")
+        self.assertEqual(other["A3"].value, "='Sheet'!$A$5+Auswertung!A8")
+        self.assertEqual(other["A4"].value, "=SUM(Sheet!G:G)")
+
+    def test_sheet_ref_re(self):
+        """ names are quoted if needed, other sheets are not matched """
+        ref_re = xp.sheet_ref_re("It's")
+        self.assertEqual(ref_re.findall("'It''s'!A1:B$2+It's!A1+'X'!A1"),
+                         [("'It''s'!", "A1:B$2")])
+        ref_re = xp.sheet_ref_re("Sheet")
+        self.assertEqual(ref_re.findall("Sheet!A1+MySheet!A2+Sheet!3:5"),
+                         [("Sheet!", "A1"), ("Sheet!", "3:5")])
+
+
+class TestUnsupported(unittest.TestCase):
+    """ files the patcher can not update """
+
+    def test_not_a_zip(self):
+        """ reading a broken file raises UnsupportedWorkbook """
+        reader = fd.XlsxReader(Settings("test.ini"), "test.xlsx")
+        reader._filename = "test.ini"
+        with self.assertRaises(xp.UnsupportedWorkbook):
+            xp.XlsxPatcher(reader._cfg, "test_patch.xlsx", reader)
+
+    def test_footer_formula(self):
+        """ formulas below the persons raise UnsupportedWorkbook """
+        cfg = Settings("test.ini")
+        wb = fd.openpyxl.load_workbook("test.xlsx")
+        wb.active["D9"] = "=SUM(D5:D7)"
+        wb.save("test_patch_footer.xlsx")
+        try:
+            reader = fd.XlsxReader(cfg, "test_patch_footer.xlsx")
+            with self.assertRaises(xp.UnsupportedWorkbook):
+                xp.XlsxPatcher(cfg, "test_patch.xlsx", reader)
+        finally:
+            os.remove("test_patch_footer.xlsx")
+
+    def test_shared_formula(self):
+        """ shared formulas of other sheets referring to the sheet """
+        cfg = Settings("test.ini")
+        wb = fd.openpyxl.load_workbook("test.xlsx")
+        wb.create_sheet("Auswertung")["A1"] = "=Sheet!A5"
+        wb.save("test_patch_shared_in.xlsx")
+        try:
+            with zipfile.ZipFile("test_patch_shared_in.xlsx") as zin, \
+                    zipfile.ZipFile("test_patch_shared.xlsx", "w") as zout:
+                for info in zin.infolist():
+                    data = zin.read(info)
+                    if info.filename == "xl/worksheets/sheet2.xml":
+                        data = data.replace(b"<f>",
+                                            b'<f t="shared" ref="A1" si="0">')
+                    zout.writestr(info, data)
+            reader = fd.XlsxReader(cfg, "test_patch_shared.xlsx")
+            with self.assertRaises(xp.UnsupportedWorkbook):
+                xp.XlsxPatcher(cfg, "test_patch.xlsx", reader)
+        finally:
+            os.remove("test_patch_shared_in.xlsx")
+            os.remove("test_patch_shared.xlsx")
+
+
+if __name__ == "__main__":
+    unittest.main()